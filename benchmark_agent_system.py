@@ -0,0 +1,456 @@
+"""
+JPMC Financial Research Agent System - BENCHMARKS
+Measures the cost of the governance layer at production volumes
+(Run: python benchmark_agent_system.py --help)
+"""
+
+import argparse
+import contextlib
+import gc
+import inspect
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import make_dataclass, fields
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List
+
+import demo_agent_system as agents
+from demo_agent_system import (
+    AgentAction, AgentOrchestrator, AgentRole, AuditTrail, ColumnarActionLog, ComplianceCheck, MockLLM
+)
+
+# Benchmarks drive thousands of workflows; per-action INFO logs would dominate
+logging.getLogger(agents.__name__).setLevel(logging.WARNING)
+
+# AgentAction as originally declared (regular dataclass, per-instance __dict__)
+LegacyAgentAction = make_dataclass(
+    "LegacyAgentAction", [(f.name, f.type, f) for f in fields(AgentAction)]
+)
+
+
+def make_actions(count: int) -> List[Dict[str, Any]]:
+    """Realistic action field dicts, shaped like the agents log them"""
+    roles = [
+        (AgentRole.RESEARCHER.value, "company_research", "summary", 0.002),
+        (AgentRole.ANALYST.value, "investment_analysis", "analysis", 0.003),
+    ]
+    actions = []
+    for i in range(count):
+        company = f"Company {i // 3}"
+        if i % 3 == 2:
+            actions.append(dict(
+                timestamp=datetime.now().isoformat(),
+                agent_role=AgentRole.COMPLIANCE.value,
+                action_type="compliance_review",
+                input_data={"content_type": "investment_research", "company_name": company},
+                output_data={"compliant": True, "risk_message": None},
+                tokens_used=0, cost_usd=0.0, success=True
+            ))
+            continue
+        role, action_type, key, cost = roles[i % 3]
+        output = MockLLM.generate_research(company)
+        actions.append(dict(
+            timestamp=datetime.now().isoformat(),
+            agent_role=role,
+            action_type=action_type,
+            input_data={"company_name": company},
+            output_data={key: output[:200] + "...", "llm_cache_hit": False},
+            tokens_used=len(output.split()), cost_usd=cost, success=True
+        ))
+    return actions
+
+
+def measure_bytes(build: Callable[[], Any]) -> int:
+    """Bytes still allocated after build() returns, i.e. retained by its result"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del obj
+    return after - before
+
+
+def bench_audit_memory(actions: int = 50000) -> Dict[str, Any]:
+    """Bytes retained per action for each in-memory AuditTrail representation"""
+    rows = make_actions(actions)
+    
+    def columnar():
+        log = ColumnarActionLog()
+        for row in rows:
+            log.append(AgentAction(**row))
+        return log
+    
+    # Field values (strings, dicts) are shared with `rows` in the list layouts,
+    # so copy them per action to measure what a live trail actually holds
+    def copied(build_row):
+        return lambda: [build_row(**json.loads(json.dumps(row))) for row in rows]
+    
+    results = {
+        "before (dataclass list)": measure_bytes(copied(LegacyAgentAction)),
+        "slots dataclass list": measure_bytes(copied(AgentAction)),
+        "ColumnarActionLog": measure_bytes(columnar),
+    }
+    return {
+        "actions": actions,
+        "bytes_per_action": {name: round(total / actions, 1) for name, total in results.items()},
+    }
+
+
+class GlobalLockAuditTrail(AuditTrail):
+    """Baseline for audit_contention: all threads share one shard, so one lock"""
+    
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._shared = agents._AuditShard(self.compact)
+        self._shards.append(self._shared)
+    
+    def _shard(self):
+        return self._shared
+
+
+def run_writers(trail: Any, writers: int, per_writer: int, action: AgentAction) -> float:
+    """Log per_writer actions from each of `writers` threads; returns elapsed seconds"""
+    start_line = threading.Barrier(writers + 1)
+    
+    def write():
+        start_line.wait()
+        for _ in range(per_writer):
+            trail.log_action(action)
+    
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    start_line.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def bench_audit_contention(actions: int = 50000, writers: int = 64) -> Dict[str, Any]:
+    """
+    Stress test plus contention benchmark for AuditTrail.log_action
+    Fails loudly if any total is off after `writers` concurrent threads.
+    """
+    per_writer = max(1, actions // writers)
+    action = AgentAction(**make_actions(1)[0])
+    expected_actions = writers * per_writer
+    
+    trail = AuditTrail()
+    elapsed = run_writers(trail, writers, per_writer, action)
+    summary = trail.get_summary()
+    checks = {
+        "total_actions": (summary["total_actions"], expected_actions),
+        "retained_actions": (len(trail.actions), expected_actions),
+        "total_tokens": (summary["total_tokens"], expected_actions * action.tokens_used),
+        "total_cost_usd": (summary["total_cost_usd"], round(expected_actions * action.cost_usd, 4)),
+        "actions_by_agent": (summary["actions_by_agent"][action.agent_role], expected_actions),
+        "successful_actions": (summary["successful_actions"], expected_actions),
+    }
+    mismatches = {name: pair for name, pair in checks.items() if pair[0] != pair[1]}
+    if mismatches:
+        raise AssertionError(f"AuditTrail totals wrong under {writers} writers: {mismatches}")
+    
+    single = AuditTrail()
+    single_elapsed = run_writers(single, 1, expected_actions, action)
+    baseline = GlobalLockAuditTrail()
+    baseline_elapsed = run_writers(baseline, writers, per_writer, action)
+    
+    def ns_per_action(seconds: float) -> float:
+        return round(seconds / expected_actions * 1e9, 1)
+    
+    return {
+        "writers": writers,
+        "actions": expected_actions,
+        "totals_exact": True,
+        "ns_per_action": {
+            "sharded, 1 writer": ns_per_action(single_elapsed),
+            f"sharded, {writers} writers": ns_per_action(elapsed),
+            f"global lock, {writers} writers": ns_per_action(baseline_elapsed),
+        },
+        "contention_overhead_pct": round((elapsed / single_elapsed - 1) * 100, 1),
+    }
+
+
+def run_timed(op: Callable[[int], Any], iterations: int, concurrency: int) -> tuple[List[float], float]:
+    """
+    Call op(0) .. op(iterations - 1) from `concurrency` threads
+    Returns per-call latencies (seconds) and the wall time of the whole run.
+    """
+    counter = itertools.count()
+    per_thread: List[List[float]] = [[] for _ in range(concurrency)]
+    start_line = threading.Barrier(concurrency + 1)
+    
+    def worker(latencies: List[float]):
+        start_line.wait()
+        while (i := next(counter)) < iterations:
+            started = time.perf_counter()
+            op(i)
+            latencies.append(time.perf_counter() - started)
+    
+    threads = [threading.Thread(target=worker, args=(latencies,)) for latencies in per_thread]
+    for t in threads:
+        t.start()
+    start_line.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return [latency for latencies in per_thread for latency in latencies], elapsed
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    return sorted_values[min(len(sorted_values) - 1, round(q * (len(sorted_values) - 1)))]
+
+
+def measure(setup: Callable[[], Callable[[int], Any]], iterations: int,
+            concurrency: int = 1) -> Dict[str, Any]:
+    """
+    Throughput, latency percentiles and peak memory of the op setup() returns
+    Timing and memory come from separate runs (each on a fresh setup()) so
+    tracemalloc's overhead never shows up in the latencies.
+    """
+    latencies, elapsed = run_timed(setup(), iterations, concurrency)
+    latencies.sort()
+    
+    op = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run_timed(op, iterations, concurrency)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    
+    return {
+        "operations": iterations,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(iterations / elapsed, 1),
+        "latency_ms": {
+            name: round(percentile(latencies, q) * 1000, 4)
+            for name, q in (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("max", 1.0))
+        },
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def bench_workflow(companies: int = 50, concurrency: int = 1) -> Dict[str, Any]:
+    """End-to-end AgentOrchestrator.research_investment, one op per company"""
+    names = [f"Company {i}" for i in range(companies)]
+    
+    def setup():
+        orchestrator = AgentOrchestrator()
+        return lambda i: orchestrator.research_investment(names[i])
+    
+    return {"companies": companies, **measure(setup, companies, concurrency)}
+
+
+@contextlib.contextmanager
+def restricted_keywords(size: int) -> Iterator[None]:
+    """Pad ComplianceCheck.RESTRICTED_KEYWORDS to `size` phrases that never match"""
+    original = ComplianceCheck.RESTRICTED_KEYWORDS
+    padding = [f"restricted term {i:05d} zq" for i in range(max(0, size - len(original)))]
+    ComplianceCheck.RESTRICTED_KEYWORDS = original + padding
+    try:
+        yield
+    finally:
+        ComplianceCheck.RESTRICTED_KEYWORDS = original
+
+
+def make_document(size: int) -> str:
+    """Compliant research text (with a disclaimer) of about `size` characters"""
+    text = ComplianceCheck.add_disclaimers(MockLLM.generate_research("Benchmark Corp"))
+    return (text * (size // len(text) + 1))[:size]
+
+
+def bench_compliance(doc_size: int = 5000, keywords: int = 5, iterations: int = 2000,
+                     concurrency: int = 1) -> Dict[str, Any]:
+    """ComplianceCheck.validate_output on doc_size-character documents"""
+    document = make_document(doc_size)
+    with restricted_keywords(keywords):
+        # Compile the (padded) matcher up front; it is cached across calls in production
+        ComplianceCheck.get_matcher()
+        keyword_count = len(ComplianceCheck.RESTRICTED_KEYWORDS)
+        result = measure(lambda: lambda i: ComplianceCheck.validate_output(document),
+                         iterations, concurrency)
+    return {"doc_size": doc_size, "keywords": keyword_count, **result}
+
+
+def bench_log_action(actions: int = 50000, concurrency: int = 1) -> Dict[str, Any]:
+    """AuditTrail.log_action into a fresh trail"""
+    rows = [AgentAction(**row) for row in make_actions(actions)]
+    
+    def setup():
+        trail = AuditTrail()
+        return lambda i: trail.log_action(rows[i])
+    
+    return measure(setup, actions, concurrency)
+
+
+def filled_trail(actions: int) -> AuditTrail:
+    trail = AuditTrail()
+    for row in make_actions(actions):
+        trail.log_action(AgentAction(**row))
+    return trail
+
+
+def bench_get_summary(actions: int = 50000, iterations: int = 2000,
+                      concurrency: int = 1) -> Dict[str, Any]:
+    """AuditTrail.get_summary on a trail holding `actions` actions"""
+    trail = filled_trail(actions)
+    return {"trail_actions": actions,
+            **measure(lambda: lambda i: trail.get_summary(), iterations, concurrency)}
+
+
+def bench_export(actions: int = 50000, exports: int = 3) -> Dict[str, Any]:
+    """AuditTrail.export_to_file of a trail holding `actions` actions"""
+    trail = filled_trail(actions)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "audit_trail.json")
+        result = measure(lambda: lambda i: trail.export_to_file(path), exports)
+        size = os.path.getsize(path)
+    return {"trail_actions": actions, "file_kb": round(size / 1024, 1), **result}
+
+
+def bench_tracing(companies: int = 50, iterations: int = 2000) -> Dict[str, Any]:
+    """
+    Cost of the tracing spans: per span() call while disabled, and workflow
+    throughput with the tracer recording (compare with the workflow benchmark)
+    """
+    tracer = agents.tracer
+    was_enabled = tracer.enabled
+    tracer.disable()
+    calls = iterations * 100
+    started = time.perf_counter()
+    for _ in range(calls):
+        with tracer.span("benchmark", company="Benchmark Corp"):
+            pass
+    disabled_ns = (time.perf_counter() - started) / calls * 1e9
+    
+    names = [f"Company {i}" for i in range(companies)]
+    
+    def setup():
+        orchestrator = AgentOrchestrator()
+        tracer.clear()
+        return lambda i: orchestrator.research_investment(names[i])
+    
+    tracer.enable()
+    try:
+        result = measure(setup, companies)
+        spans = len(tracer.spans())
+    finally:
+        tracer.clear()
+        if not was_enabled:
+            tracer.disable()
+    return {"disabled_span_ns": round(disabled_ns, 1),
+            "spans_per_workflow": round(spans / companies, 1),
+            "companies": companies, **result}
+
+
+BENCHMARKS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "audit_memory": bench_audit_memory,
+    "audit_contention": bench_audit_contention,
+    "workflow": bench_workflow,
+    "compliance": bench_compliance,
+    "log_action": bench_log_action,
+    "get_summary": bench_get_summary,
+    "export": bench_export,
+    "tracing": bench_tracing,
+}
+
+
+def find_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any],
+                     threshold: float) -> List[str]:
+    """
+    Compare measure() results against a saved baseline
+    Throughput may not drop, and p50/p99 latency and peak memory may not
+    grow, by more than `threshold` (a fraction, 0.2 = 20%).
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if not base or "ops_per_sec" not in result or "ops_per_sec" not in base:
+            continue
+        checks = [
+            ("ops_per_sec", base["ops_per_sec"], result["ops_per_sec"], False),
+            ("latency p50 ms", base["latency_ms"]["p50"], result["latency_ms"]["p50"], True),
+            ("latency p99 ms", base["latency_ms"]["p99"], result["latency_ms"]["p99"], True),
+            ("peak_memory_kb", base["peak_memory_kb"], result["peak_memory_kb"], True),
+        ]
+        for metric, before, after, lower_is_better in checks:
+            if not before:
+                continue
+            change = (after - before) / before
+            if (change > threshold) if lower_is_better else (change < -threshold):
+                regressions.append(f"{name}: {metric} {before} -> {after} ({change:+.1%})")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Agent system benchmarks")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS),
+                        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    scenario_args = parser.add_argument_group("scenario")
+    scenario_args.add_argument("--actions", type=int, default=50000, help="audit actions per run")
+    scenario_args.add_argument("--companies", type=int, default=50, help="companies per workflow run")
+    scenario_args.add_argument("--doc-size", type=int, default=5000,
+                               help="characters per document checked by ComplianceCheck")
+    scenario_args.add_argument("--keywords", type=int, default=len(ComplianceCheck.RESTRICTED_KEYWORDS),
+                               help="restricted keyword list size (padded with non-matching phrases)")
+    scenario_args.add_argument("--concurrency", type=int, default=1, help="threads issuing operations")
+    scenario_args.add_argument("--iterations", type=int, default=2000,
+                               help="operations per run for the per-call benchmarks")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results to a baseline JSON file")
+    parser.add_argument("--baseline", metavar="PATH", help="fail if results regress against this baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed regression as a fraction of the baseline (default: 0.2)")
+    args = parser.parse_args(argv)
+    
+    scenario = {
+        "actions": args.actions, "companies": args.companies, "doc_size": args.doc_size,
+        "keywords": args.keywords, "concurrency": args.concurrency, "iterations": args.iterations,
+    }
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark: {name}")
+        bench = BENCHMARKS[name]
+        accepted = inspect.signature(bench).parameters
+        result = bench(**{key: value for key, value in scenario.items() if key in accepted})
+        results[name] = result
+        print(f"\n{name}")
+        print("-" * 70)
+        print(json.dumps(result, indent=2))
+    
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"scenario": scenario, "results": results}, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scenario") != scenario:
+            print(f"\nWarning: baseline scenario {baseline.get('scenario')} differs from this run")
+        regressions = find_regressions(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%} of {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions beyond {args.threshold:.0%} of {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
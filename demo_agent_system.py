@@ -4,11 +4,37 @@ Production-quality multi-agent architecture for financial research
 (This demo version uses simulated LLM responses for demonstration)
 """
 
+import asyncio
+import atexit
+import bisect
+import contextlib
+import contextvars
+import gzip
+import hashlib
+import heapq
+import http.server
+import itertools
 import json
 import logging
-from datetime import datetime
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, asdict
+import math
+import mmap
+import os
+import queue
+import random
+import re
+import selectors
+import sqlite3
+import sys
+import threading
+import time
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Callable, Iterator, Optional, Protocol, runtime_checkable
+from dataclasses import dataclass, asdict, field
 from enum import Enum
 
 # Configure logging
@@ -27,7 +53,12 @@ class AgentRole(Enum):
     ORCHESTRATOR = "orchestrator"
 
 
-@dataclass
+def normalize_company_name(company_name: str) -> str:
+    """Normalize a company name so equivalent requests map to the same key"""
+    return " ".join(company_name.split()).casefold()
+
+
+@dataclass(slots=True)
 class AgentAction:
     """Data class for tracking agent actions (audit trail)"""
     timestamp: str
@@ -39,51 +70,2939 @@ class AgentAction:
     cost_usd: float
     success: bool
     error_message: Optional[str] = None
+    duration_ms: Optional[float] = None  # monotonic-clock time the action took
+    integrity: Optional[Dict[str, Any]] = None  # hash-chain link, set by a tamper-evident AuditTrail
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class SystemClock:
+    """Real time, as the agents and audit trail see it by default"""
+    
+    def now(self) -> datetime:
+        return datetime.now()
+    
+    def monotonic(self) -> float:
+        return time.perf_counter()
+    
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """
+    Simulated time for discrete-event runs (see run_simulated)
+    Starts at `start` and only moves when advanced, by a VirtualTimeEventLoop
+    or by sleep(), so hours of simulated latency take no wall time.
+    """
+    
+    def __init__(self, start: Optional[datetime] = None):
+        self.start = start if start is not None else datetime.now()
+        self._elapsed = 0.0
+    
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self._elapsed)
+    
+    def monotonic(self) -> float:
+        return self._elapsed
+    
+    def sleep(self, seconds: float):
+        # Only meaningful for a single simulated thread: each sleep moves everyone's clock
+        self.advance(seconds)
+    
+    def advance(self, seconds: float):
+        if seconds > 0:
+            self._elapsed += seconds
+
+
+# Source of audit timestamps, action/step durations, cache expiry and simulated LLM latency
+_clock: Any = SystemClock()
+
+
+def get_clock() -> Any:
+    return _clock
+
+
+@contextlib.contextmanager
+def use_clock(clock: Any) -> Iterator[Any]:
+    """Run the agents against another clock (e.g. a VirtualClock) inside the block"""
+    global _clock
+    previous, _clock = _clock, clock
+    try:
+        yield clock
+    finally:
+        _clock = previous
+
+
+def _elapsed_ms(started: float) -> float:
+    """Milliseconds since a _clock.monotonic() reading"""
+    return round((_clock.monotonic() - started) * 1000, 3)
+
+
+class _NoopSpan:
+    """Stand-in returned by a disabled Tracer; entering and annotating it does nothing"""
+    
+    __slots__ = ()
+    
+    def __enter__(self) -> "_NoopSpan":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+    
+    def set(self, **attributes: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+# Innermost open span of the running thread / asyncio task
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation in a trace (a workflow, a step, an LLM call...)
+    Use as a context manager: entering makes it the parent of spans opened
+    inside it, in this thread or in asyncio tasks / threads started with a
+    copy of the current context.
+    """
+    
+    __slots__ = ("tracer", "name", "attributes", "span_id", "parent", "trace_id",
+                 "lane_key", "thread_name", "start", "end", "_token")
+    
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.span_id = 0
+        self.parent: Optional["Span"] = None
+        self.trace_id = 0
+        self.lane_key: tuple = ()
+        self.thread_name = ""
+        self.start = 0.0
+        self.end: Optional[float] = None
+        self._token = None
+    
+    def __enter__(self) -> "Span":
+        self.parent = _current_span.get()
+        self.span_id = next(self.tracer._ids)
+        self.trace_id = self.parent.trace_id if self.parent is not None else self.span_id
+        thread = threading.current_thread()
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        # Turned into Chrome trace lanes only at export, so nothing per task outlives the span buffer
+        self.lane_key = (thread.ident, id(task) if task is not None else None)
+        self.thread_name = thread.name if task is None else f"{thread.name} / asyncio"
+        self._token = _current_span.set(self)
+        self.start = _clock.monotonic()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end = _clock.monotonic()
+        if exc_type is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        self.tracer._finish(self)
+        return False
+    
+    def set(self, **attributes: Any):
+        """Add or overwrite attributes"""
+        self.attributes.update(attributes)
+    
+    @property
+    def parent_id(self) -> Optional[int]:
+        return self.parent.span_id if self.parent is not None else None
+    
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return round((self.end - self.start) * 1000, 3) if self.end is not None else None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attributes": dict(self.attributes)
+        }
+
+
+class Tracer:
+    """
+    In-process span recorder for workflows, steps and LLM/compliance calls
+    Disabled by default: span() then hands back a shared no-op object, so
+    instrumented code costs one attribute check per call. Finished spans are
+    kept in a bounded buffer and can be exported as a Chrome trace
+    (chrome://tracing, Perfetto) with a lane per concurrently running
+    thread / asyncio task.
+    """
+    
+    # Usage attributes that roll up from a finished span into its parent
+    ROLLUP_ATTRIBUTES = ("tokens", "cost_usd")
+    
+    def __init__(self, max_spans: int = 100_000):
+        self.enabled = False
+        self._spans: deque = deque(maxlen=max_spans)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+    
+    def enable(self, max_spans: Optional[int] = None):
+        if max_spans is not None and max_spans != self._spans.maxlen:
+            self._spans = deque(self._spans, maxlen=max_spans)
+        self.enabled = True
+    
+    def disable(self):
+        self.enabled = False
+    
+    def span(self, name: str, **attributes: Any) -> Any:
+        """Open a span (use with `with`); a no-op while the tracer is disabled"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, attributes)
+    
+    @staticmethod
+    def current_span() -> Optional[Span]:
+        return _current_span.get()
+    
+    def annotate(self, **attributes: Any):
+        """Set attributes on the innermost open span, if any"""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+    
+    def add_usage(self, tokens: int, cost_usd: float):
+        """Accumulate token and cost usage on the innermost open span"""
+        span = _current_span.get()
+        if span is None:
+            return
+        with self._lock:
+            attributes = span.attributes
+            attributes["tokens"] = attributes.get("tokens", 0) + tokens
+            attributes["cost_usd"] = round(attributes.get("cost_usd", 0.0) + cost_usd, 6)
+    
+    def _finish(self, span: Span):
+        self._spans.append(span)
+        parent = span.parent
+        if parent is None:
+            return
+        usage = [(key, span.attributes[key]) for key in self.ROLLUP_ATTRIBUTES if key in span.attributes]
+        if usage:
+            with self._lock:
+                for key, value in usage:
+                    parent.attributes[key] = round(parent.attributes.get(key, 0) + value, 6)
+    
+    def spans(self, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Finished spans, oldest first (optionally only those called name)"""
+        return [span.to_dict() for span in list(self._spans) if name is None or span.name == name]
+    
+    def clear(self):
+        self._spans.clear()
+    
+    @staticmethod
+    def _assign_lanes(spans: List[Span]) -> tuple[Dict[tuple, int], Dict[int, str]]:
+        """
+        Pack each thread / asyncio task's spans into the fewest lanes (Chrome 'tid's)
+        Tasks whose spans do not overlap in time share a lane, so the lane
+        count follows peak concurrency, not the number of tasks ever traced.
+        """
+        groups: Dict[tuple, List[Any]] = {}
+        for span in spans:
+            group = groups.get(span.lane_key)
+            if group is None:
+                groups[span.lane_key] = [span.start, span.end, span.thread_name]
+            else:
+                group[0] = min(group[0], span.start)
+                group[1] = max(group[1], span.end)
+        lanes: Dict[tuple, int] = {}
+        names: Dict[int, str] = {}
+        # Per thread: (lane end time, lane id) of lanes that can take a later group
+        free: Dict[Any, List[tuple[float, int]]] = {}
+        for key, (start, end, name) in sorted(groups.items(), key=lambda item: item[1][0]):
+            ends = free.setdefault((key[0], name), [])
+            if ends and ends[0][0] <= start:
+                lane = heapq.heappop(ends)[1]
+            else:
+                lane = len(names) + 1
+                names[lane] = name
+            lanes[key] = lane
+            heapq.heappush(ends, (end, lane))
+        return lanes, names
+    
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Finished spans in Chrome Trace Event format (complete 'X' events, µs)"""
+        pid = os.getpid()
+        spans = list(self._spans)
+        origin = min((span.start for span in spans), default=0.0)
+        events: List[Dict[str, Any]] = []
+        lanes, lane_names = self._assign_lanes(spans)
+        for lane, name in lane_names.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": lane,
+                           "args": {"name": name}})
+        for span in spans:
+            # End rounded like start, so back-to-back spans never appear to overlap
+            ts = round((span.start - origin) * 1e6, 3)
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".", 1)[0],
+                "ph": "X",
+                "ts": ts,
+                "dur": round(round((span.end - origin) * 1e6, 3) - ts, 3),
+                "pid": pid,
+                "tid": lanes[span.lane_key],
+                "args": {**span.attributes, "trace_id": span.trace_id,
+                         "span_id": span.span_id, "parent_id": span.parent_id}
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+    
+    def export(self, filepath: str):
+        """Write finished spans to a JSON timeline (open in chrome://tracing or Perfetto)"""
+        with open(filepath, 'w') as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
+        logger.info(f"Trace exported to {filepath} ({len(self._spans)} spans)")
+
+
+# Process-wide tracer the agents and orchestrators report to; call tracer.enable() to record
+tracer = Tracer()
+
+
+_METRIC_NAME = re.compile(r"[a-zA-Z_:][a-zA-Z0-9_:]*")
+_LABEL_NAME = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+
+
+class _Metric:
+    """Name, help text and label names shared by every metric type"""
+    
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        if not _METRIC_NAME.fullmatch(name):
+            raise ValueError(f"Invalid metric name: {name!r}")
+        for label in labelnames:
+            if not _LABEL_NAME.fullmatch(label) or label == "le":
+                raise ValueError(f"Invalid label name for {name}: {label!r}")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+    
+    def _check_labels(self, labels: tuple):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels!r}")
+    
+    def samples(self) -> List[tuple[str, tuple, float]]:
+        """(suffix, label values, value) triples for the exposition format"""
+        raise NotImplementedError
+
+
+# Each thread is assigned one shard slot, round-robin, shared by every sharded metric
+_METRIC_SHARDS = 16
+_metric_slot_local = threading.local()
+_next_metric_slot = itertools.count()
+
+
+def _metric_slot() -> int:
+    try:
+        return _metric_slot_local.slot
+    except AttributeError:
+        slot = _metric_slot_local.slot = next(_next_metric_slot) % _METRIC_SHARDS
+        return slot
+
+
+class _ShardedMetric(_Metric):
+    """
+    Metric whose updates are spread over a fixed pool of locked shards
+    Threads are assigned shards round-robin, so with up to _METRIC_SHARDS
+    writers every lock is uncontended, and a scrape merges a constant number
+    of shards however many threads have come and gone.
+    """
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._shards: List[tuple[threading.Lock, Dict[tuple, Any]]] = [
+            (threading.Lock(), {}) for _ in range(_METRIC_SHARDS)
+        ]
+    
+    def _snapshots(self) -> List[Dict[tuple, Any]]:
+        snapshots = []
+        for lock, values in self._shards:
+            with lock:
+                snapshots.append({labels: self._copy_value(value) for labels, value in values.items()})
+        return snapshots
+    
+    @staticmethod
+    def _copy_value(value: Any) -> Any:
+        return value
+
+
+class Counter(_ShardedMetric):
+    """Monotonically increasing count, e.g. `metric.inc("researcher", amount=3)`"""
+    
+    kind = "counter"
+    
+    def inc(self, *labels: str, amount: float = 1):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        lock, values = self._shards[_metric_slot()]
+        with lock:
+            current = values.get(labels)
+            if current is None:
+                self._check_labels(labels)
+                current = 0
+            values[labels] = current + amount
+    
+    def value(self, *labels: str) -> float:
+        return sum(shard.get(labels, 0) for shard in self._snapshots())
+    
+    def total(self) -> float:
+        """Sum over every label combination"""
+        return sum(sum(shard.values()) for shard in self._snapshots())
+    
+    def samples(self) -> List[tuple[str, tuple, float]]:
+        merged: Dict[tuple, float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                merged[labels] = merged.get(labels, 0) + value
+        return [("", labels, value) for labels, value in sorted(merged.items())]
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down (queue depth, in-flight work)
+    set_function() registers a callback evaluated at scrape time instead.
+    """
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+        self._functions: Dict[tuple, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+    
+    def set(self, value: float, *labels: str):
+        if labels not in self._values:
+            self._check_labels(labels)
+        # A single dict store is atomic; no lock needed for a plain set
+        self._values[labels] = value
+    
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            if labels not in self._values:
+                self._check_labels(labels)
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+    
+    def set_function(self, function: Callable[[], float], *labels: str):
+        self._check_labels(labels)
+        self._functions[labels] = function
+    
+    def value(self, *labels: str) -> float:
+        function = self._functions.get(labels)
+        return function() if function is not None else self._values.get(labels, 0)
+    
+    def samples(self) -> List[tuple[str, tuple, float]]:
+        merged = dict(self._values)
+        for labels, function in list(self._functions.items()):
+            merged[labels] = function()
+        return [("", labels, value) for labels, value in sorted(merged.items())]
+
+
+class Histogram(_ShardedMetric):
+    """
+    Distribution of observed values in fixed cumulative buckets
+    Use seconds for durations, as Prometheus expects.
+    """
+    
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: Optional[tuple] = None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in (buckets or self.DEFAULT_BUCKETS)
+                                    if b != float("inf")))
+        if not self.buckets:
+            raise ValueError("A histogram needs at least one finite bucket")
+    
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        lock, values = self._shards[_metric_slot()]
+        with lock:
+            counts = values.get(labels)
+            if counts is None:
+                self._check_labels(labels)
+                # One slot per bucket, one for +Inf, then the running sum
+                counts = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+    
+    @staticmethod
+    def _copy_value(value: Any) -> Any:
+        return list(value)
+    
+    def samples(self) -> List[tuple[str, tuple, float]]:
+        merged: Dict[tuple, List[float]] = {}
+        for shard in self._snapshots():
+            for labels, counts in shard.items():
+                totals = merged.get(labels)
+                if totals is None:
+                    merged[labels] = counts
+                else:
+                    for i, count in enumerate(counts):
+                        totals[i] += count
+        samples = []
+        for labels, counts in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", labels + (_format_metric_value(bound),), cumulative))
+            samples.append(("_sum", labels, counts[-1]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+def _format_metric_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsRegistry:
+    """
+    Named counters, gauges and histograms, rendered in the Prometheus text format
+    Asking for an existing name returns the registered metric, so modules can
+    declare the metrics they update without coordinating.
+    """
+    
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    
+    def __init__(self):
+        self._metrics: "OrderedDict[str, _Metric]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+    
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+    
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: Optional[tuple] = None) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+    
+    def _register(self, cls: type, name: str, documentation: str, labelnames: tuple,
+                  **options: Any) -> Any:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, tuple(labelnames), **options)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind} "
+                                 f"with labels {metric.labelnames}")
+            return metric
+    
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+    
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            documentation = metric.documentation.replace("\\", "\\\\").replace("\n", "\\n")
+            lines.append(f"# HELP {metric.name} {documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                names = metric.labelnames + (("le",) if suffix == "_bucket" else ())
+                label_text = ",".join(f'{n}="{_escape_label_value(v)}"' for n, v in zip(names, labels))
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{metric.name}{suffix}{label_text} {_format_metric_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the server's registry at /metrics"""
+    
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", MetricsRegistry.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format: str, *args: Any):
+        logger.debug(f"Metrics scrape from {self.client_address[0]}: {format % args}")
+
+
+def start_metrics_server(port: int = 9464, host: str = "127.0.0.1",
+                         registry: Optional[MetricsRegistry] = None) -> http.server.ThreadingHTTPServer:
+    """
+    Serve a registry (default: the module's `metrics`) for Prometheus to scrape
+    Runs on a daemon thread; port 0 picks a free port (see server.server_address).
+    Call shutdown() and server_close() on the returned server to stop it.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    server.registry = registry if registry is not None else metrics
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-exporter").start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+# Process-wide registry the agents, orchestrators and AuditTrail report to
+metrics = MetricsRegistry()
+
+_WORKFLOWS_STARTED = metrics.counter(
+    "agent_workflows_started_total", "Research workflows started (one per company)")
+_WORKFLOWS_FINISHED = metrics.counter(
+    "agent_workflows_finished_total", "Research workflows finished, by outcome (completed, failed, cached)",
+    ("outcome",))
+_WORKFLOWS_IN_FLIGHT = metrics.gauge(
+    "agent_workflows_in_flight", "Research workflows started but not yet finished")
+_ACTIONS = metrics.counter(
+    "agent_actions_total", "Actions logged to an AuditTrail", ("agent", "action_type", "success"))
+_TOKENS = metrics.counter("agent_tokens_total", "LLM tokens used, by agent", ("agent",))
+_COST = metrics.counter("agent_cost_usd_total", "LLM cost in USD, by agent", ("agent",))
+_COST_SAVED = metrics.counter(
+    "agent_cost_saved_usd_total", "Estimated LLM cost avoided by stopping generations early, by agent",
+    ("agent",))
+# Sub-millisecond cache hits up to minute-long LLM calls
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_ACTION_DURATION = metrics.histogram(
+    "agent_action_duration_seconds", "Duration of logged agent actions", ("agent",), _LATENCY_BUCKETS)
+_STEP_DURATION = metrics.histogram(
+    "agent_step_duration_seconds", "Duration of orchestrator steps and whole workflows", ("step",),
+    _LATENCY_BUCKETS)
+_CACHE_LOOKUPS = metrics.counter(
+    "agent_cache_lookups_total", "Cache lookups, by cache (workflow, llm) and result (hit, miss)",
+    ("cache", "result"))
+_CACHE_HIT_RATIO = metrics.gauge(
+    "agent_cache_hit_ratio", "Fraction of cache lookups that hit since start (NaN before any lookup)",
+    ("cache",))
+
+
+def _cache_hit_ratio(cache: str) -> float:
+    hits = _CACHE_LOOKUPS.value(cache, "hit")
+    lookups = hits + _CACHE_LOOKUPS.value(cache, "miss")
+    return hits / lookups if lookups else float("nan")
+
+
+_CACHE_HIT_RATIO.set_function(lambda: _cache_hit_ratio("workflow"), "workflow")
+_CACHE_HIT_RATIO.set_function(lambda: _cache_hit_ratio("llm"), "llm")
+
+_PIPELINE_QUEUE_DEPTH = metrics.gauge(
+    "agent_pipeline_queue_depth", "Items waiting in a research_pipeline stage queue", ("stage",))
+_AUDIT_QUEUE_DEPTH = metrics.gauge(
+    "agent_audit_writer_queue_depth", "Actions waiting in a BackgroundAuditWriter queue")
+
+
+@contextlib.contextmanager
+def _workflows_in_flight(count: int = 1) -> Iterator[None]:
+    """Count workflows as started, and as in flight until the block exits (however it exits)"""
+    _WORKFLOWS_STARTED.inc(amount=count)
+    _WORKFLOWS_IN_FLIGHT.inc(amount=count)
+    try:
+        yield
+    finally:
+        _WORKFLOWS_IN_FLIGHT.dec(amount=count)
+
+
+class LatencySketch:
+    """
+    Mergeable streaming quantile sketch for latencies
+    Values fall into logarithmically spaced buckets, so any quantile is
+    reported within relative_accuracy of the true value while memory stays
+    bounded by the value range (not the sample count).
+    """
+    
+    __slots__ = ("relative_accuracy", "_log_gamma", "buckets", "zero_count", "count", "max")
+    
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.max = 0.0
+    
+    def add(self, value: float):
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+    
+    def merge(self, other: "LatencySketch"):
+        self.count += other.count
+        self.zero_count += other.zero_count
+        self.max = max(self.max, other.max)
+        for key, n in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + n
+    
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = round(q * (self.count - 1))
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # Bucket midpoint (in relative terms) keeps the error within relative_accuracy
+                return min(2 * math.exp(key * self._log_gamma) / (1 + math.exp(self._log_gamma)), self.max)
+        return self.max
+    
+    def state(self) -> Dict[str, Any]:
+        """Lossless JSON-serializable form (see from_state)"""
+        return {"relative_accuracy": self.relative_accuracy, "zero_count": self.zero_count,
+                "count": self.count, "max": self.max,
+                "buckets": {str(key): n for key, n in self.buckets.items()}}
+    
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "LatencySketch":
+        sketch = cls(state["relative_accuracy"])
+        sketch.zero_count = state["zero_count"]
+        sketch.count = state["count"]
+        sketch.max = state["max"]
+        sketch.buckets = {int(key): n for key, n in state["buckets"].items()}
+        return sketch
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "p50": round(self.quantile(0.50), 3),
+            "p90": round(self.quantile(0.90), 3),
+            "p99": round(self.quantile(0.99), 3),
+            "max": round(self.max, 3)
+        }
+
+
+class ColumnarActionLog:
+    """
+    Compact, array-backed list of AgentActions
+    Roles and action types are interned to small integer codes, timestamps
+    are stored as integer microseconds and numeric fields live in typed
+    arrays; input/output dicts are kept as compact JSON bytes. Indexing and
+    iteration rebuild equivalent AgentAction objects, so to_dict() output
+    is unchanged.
+    """
+    
+    _EPOCH = datetime(1970, 1, 1)
+    _MICROSECOND = timedelta(microseconds=1)
+    
+    def __init__(self, actions: Optional[List[AgentAction]] = None):
+        self._codes: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._timestamps = array("q")
+        self._roles = array("H")
+        self._types = array("H")
+        self._tokens = array("q")
+        self._costs = array("d")
+        self._success = array("b")
+        self._durations = array("d")  # NaN when the action has no duration
+        self._payloads: List[bytes] = []
+        # Rare values kept out of the columns: index -> value
+        self._errors: Dict[int, str] = {}
+        self._raw_timestamps: Dict[int, str] = {}
+        for action in actions or []:
+            self.append(action)
+    
+    def append(self, action: AgentAction):
+        index = len(self._timestamps)
+        try:
+            parsed = datetime.fromisoformat(action.timestamp)
+            if parsed.tzinfo is not None or parsed.isoformat() != action.timestamp:
+                raise ValueError("timestamp does not round-trip")
+            self._timestamps.append((parsed - self._EPOCH) // self._MICROSECOND)
+        except ValueError:
+            self._timestamps.append(0)
+            self._raw_timestamps[index] = action.timestamp
+        self._roles.append(self._code(action.agent_role))
+        self._types.append(self._code(action.action_type))
+        self._tokens.append(action.tokens_used)
+        self._costs.append(action.cost_usd)
+        self._success.append(1 if action.success else 0)
+        self._durations.append(math.nan if action.duration_ms is None else action.duration_ms)
+        payload = [action.input_data, action.output_data]
+        if action.integrity is not None:
+            payload.append(action.integrity)
+        self._payloads.append(json.dumps(
+            payload, ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8"))
+        if action.error_message is not None:
+            self._errors[index] = action.error_message
+    
+    def __len__(self) -> int:
+        return len(self._timestamps)
+    
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return [self._build(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("action index out of range")
+        return self._build(index)
+    
+    def __iter__(self) -> Iterator[AgentAction]:
+        for index in range(len(self)):
+            yield self._build(index)
+    
+    def clear(self):
+        self.__init__()
+    
+    def nbytes(self) -> int:
+        """Approximate memory held by the columns and payloads"""
+        columns = (self._timestamps, self._roles, self._types, self._tokens, self._costs, self._success,
+                   self._durations)
+        return (sum(sys.getsizeof(c) for c in columns)
+                + sys.getsizeof(self._payloads) + sum(sys.getsizeof(p) for p in self._payloads)
+                + sys.getsizeof(self._errors) + sum(sys.getsizeof(e) for e in self._errors.values())
+                + sys.getsizeof(self._raw_timestamps))
+    
+    def _code(self, name: str) -> int:
+        code = self._codes.get(name)
+        if code is None:
+            code = len(self._names)
+            self._codes[name] = code
+            self._names.append(name)
+        return code
+    
+    def _build(self, index: int) -> AgentAction:
+        timestamp = self._raw_timestamps.get(index)
+        if timestamp is None:
+            timestamp = (self._EPOCH + self._timestamps[index] * self._MICROSECOND).isoformat()
+        input_data, output_data, *integrity = json.loads(self._payloads[index])
+        duration_ms = self._durations[index]
+        return AgentAction(
+            timestamp=timestamp,
+            agent_role=self._names[self._roles[index]],
+            action_type=self._names[self._types[index]],
+            input_data=input_data,
+            output_data=output_data,
+            tokens_used=self._tokens[index],
+            cost_usd=self._costs[index],
+            success=bool(self._success[index]),
+            error_message=self._errors.get(index),
+            duration_ms=None if math.isnan(duration_ms) else duration_ms,
+            integrity=integrity[0] if integrity else None
+        )
+
+
+class JSONLAuditSink:
+    """
+    Append-only JSON Lines file that audit actions are written through to
+    Writes are buffered; the buffer is flushed every flush_every actions or
+    flush_interval_seconds, whichever comes first. A background timer
+    flushes an idle sink too, so buffered actions never wait on the next
+    write. With fsync=True each flush is also forced to disk so a crash
+    loses at most one buffer.
+    """
+    
+    def __init__(self, path: str, flush_every: int = 100, flush_interval_seconds: float = 1.0,
+                 fsync: bool = False, buffer_bytes: int = 1024 * 1024):
+        if flush_every < 1:
+            raise ValueError("flush_every must be at least 1")
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval_seconds = flush_interval_seconds
+        self.fsync = fsync
+        self._file = open(path, "a", encoding="utf-8", buffering=buffer_bytes)
+        self._lock = threading.Lock()
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        self.written = 0
+        # Bytes appended, counting what was already there
+        self.bytes_written = os.fstat(self._file.fileno()).st_size
+        self._closing = threading.Event()
+        if flush_interval_seconds > 0:
+            # The timer holds only a weak reference, so an abandoned sink can still be collected
+            threading.Thread(target=self._flush_periodically,
+                             args=(weakref.ref(self), self._closing, flush_interval_seconds),
+                             daemon=True, name="audit-sink-flush").start()
+    
+    def write(self, action: "AgentAction"):
+        """Append one action as a JSON line"""
+        self.write_batch([action])
+    
+    def write_batch(self, actions: List["AgentAction"]):
+        """Append several actions with a single buffered write"""
+        data = "".join(json.dumps(a.to_dict(), ensure_ascii=False) + "\n" for a in actions)
+        with self._lock:
+            self._file.write(data)
+            self.written += len(actions)
+            self.bytes_written += len(data) if data.isascii() else len(data.encode("utf-8"))
+            self._unflushed += len(actions)
+            if (self._unflushed >= self.flush_every
+                    or time.monotonic() - self._last_flush >= self.flush_interval_seconds):
+                self._flush_locked()
+    
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+    
+    def close(self):
+        self._closing.set()
+        with self._lock:
+            if not self._file.closed:
+                self._flush_locked()
+                self._file.close()
+    
+    @staticmethod
+    def _flush_periodically(ref: "weakref.ref[JSONLAuditSink]", closing: threading.Event, interval: float):
+        while not closing.wait(interval):
+            sink = ref()
+            if sink is None:
+                return
+            with sink._lock:
+                if (sink._unflushed and not sink._file.closed
+                        and time.monotonic() - sink._last_flush >= interval):
+                    try:
+                        sink._flush_locked()
+                    except OSError as e:
+                        logger.error(f"Timed flush of {sink.path} failed: {str(e)}")
+            del sink
+    
+    def _flush_locked(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+
+
+class AuditWriteError(RuntimeError):
+    """Audit actions could not be written to the sink"""
+
+
+class BackgroundAuditWriter:
+    """
+    Moves audit file I/O off the agents' critical path
+    write() only enqueues onto a bounded queue; a background thread
+    serializes and writes queued actions to the wrapped sink in batches.
+    A full queue blocks the caller rather than dropping entries. A failed
+    batch is retried with backoff and, if it still fails, kept and retried
+    ahead of the next batch; flush() and close() raise AuditWriteError
+    while actions remain unwritten. flush() returns once everything
+    enqueued before it is on the sink and flushed; close() (also run at
+    interpreter exit) drains the queue before closing.
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, sink: Any, max_queue: int = 10000, max_batch: int = 500,
+                 max_retries: int = 3, retry_delay: float = 0.05):
+        if max_queue < 1 or max_batch < 1:
+            raise ValueError("max_queue and max_batch must be at least 1")
+        if max_retries < 0 or retry_delay < 0:
+            raise ValueError("max_retries and retry_delay must not be negative")
+        self.sink = sink
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        # Held for the closed check and the enqueue, so nothing lands behind _STOP
+        self._close_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Actions whose write failed, retried ahead of the next batch (at most max_queue)
+        self._unwritten: List[AgentAction] = []
+        self._reported_lost = 0
+        self.max_queue_depth = 0
+        self.batches_written = 0
+        self.actions_written = 0
+        self.write_errors = 0
+        self.actions_lost = 0
+        self.total_write_seconds = 0.0
+        self.max_write_seconds = 0.0
+        self.last_write_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True, name="audit-writer")
+        self._thread.start()
+        atexit.register(self.close)
+    
+    @property
+    def path(self) -> str:
+        return self.sink.path
+    
+    def write(self, action: "AgentAction"):
+        """Enqueue an action for the background writer"""
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError("BackgroundAuditWriter is closed")
+            self._queue.put(action)
+        depth = self._queue.qsize()
+        _AUDIT_QUEUE_DEPTH.set(depth)
+        if depth > self.max_queue_depth:
+            with self._stats_lock:
+                self.max_queue_depth = max(self.max_queue_depth, depth)
+    
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until everything enqueued so far is written and flushed
+        Returns False on timeout; raises AuditWriteError if actions could
+        not be written.
+        """
+        with self._close_lock:
+            if self._closed:
+                return True
+            done: Future = Future()
+            self._queue.put(done)
+        try:
+            return done.result(timeout)
+        except TimeoutError:
+            return False
+    
+    def close(self):
+        """Drain the queue, flush and close the underlying sink"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(self._STOP)
+        self._thread.join()
+        atexit.unregister(self.close)
+        self.sink.close()
+        with self._stats_lock:
+            lost = self.actions_lost - self._reported_lost
+            self._reported_lost = self.actions_lost
+        if lost:
+            raise AuditWriteError(f"{lost} audit actions were never written to {type(self.sink).__name__}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth and write latency metrics"""
+        with self._stats_lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "queue_capacity": self._queue.maxsize,
+                "batches_written": self.batches_written,
+                "actions_written": self.actions_written,
+                "write_errors": self.write_errors,
+                "unwritten_actions": len(self._unwritten),
+                "actions_lost": self.actions_lost,
+                "avg_write_latency_ms": round(
+                    self.total_write_seconds / self.batches_written * 1000, 3
+                ) if self.batches_written else 0,
+                "max_write_latency_ms": round(self.max_write_seconds * 1000, 3),
+                "last_write_latency_ms": round(self.last_write_seconds * 1000, 3)
+            }
+    
+    def _run(self):
+        while True:
+            batch: List[AgentAction] = []
+            flush_waiters: List[Future] = []
+            stop = False
+            item = self._queue.get()
+            while True:
+                if item is self._STOP:
+                    stop = True
+                elif isinstance(item, Future):
+                    flush_waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            
+            _AUDIT_QUEUE_DEPTH.set(self._queue.qsize())
+            if batch or self._unwritten:
+                self._write(batch)
+            if stop and self._unwritten:
+                # Nothing is left to retry them with; close() reports the loss
+                with self._stats_lock:
+                    self.actions_lost += len(self._unwritten)
+                    self._unwritten = []
+            if flush_waiters or stop:
+                error: Optional[Exception] = None
+                try:
+                    self.sink.flush()
+                except Exception as e:
+                    logger.error(f"Audit writer flush failed: {str(e)}")
+                    error = e
+                # Losses at shutdown stay unreported here so close() raises them too
+                self._notify(flush_waiters, error, mark_reported=not stop)
+            if stop:
+                return
+    
+    def _write(self, batch: List["AgentAction"]):
+        pending = self._unwritten + batch
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self.sink.write_batch(pending)
+            except Exception as e:
+                logger.error(f"Audit writer failed to write {len(pending)} actions "
+                             f"(attempt {attempt + 1}): {str(e)}")
+                with self._stats_lock:
+                    self.write_errors += 1
+                if attempt < self.max_retries:
+                    time.sleep(self.retry_delay * 2 ** attempt)
+                continue
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self._unwritten = []
+                self.batches_written += 1
+                self.actions_written += len(pending)
+                self.total_write_seconds += elapsed
+                self.last_write_seconds = elapsed
+                self.max_write_seconds = max(self.max_write_seconds, elapsed)
+            return
+        # Keep them for the next cycle, bounded like the queue so a dead sink cannot exhaust memory
+        keep = self._queue.maxsize
+        with self._stats_lock:
+            self.actions_lost += max(0, len(pending) - keep)
+            self._unwritten = pending[-keep:]
+    
+    def _notify(self, waiters: List[Future], error: Optional[Exception], mark_reported: bool = True):
+        with self._stats_lock:
+            lost = self.actions_lost - self._reported_lost
+            if mark_reported:
+                self._reported_lost = self.actions_lost
+            unwritten = len(self._unwritten)
+        if lost or unwritten:
+            error = AuditWriteError(f"{lost} audit actions lost and {unwritten} awaiting retry")
+        for waiter in waiters:
+            if error is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(True)
+
+
+def _parse_audit_lines(lines: Iterator[str], source: str) -> Iterator[Dict[str, Any]]:
+    """
+    Parse JSONL audit lines into action dicts
+    A final line with no newline that does not parse is what a crash
+    mid-write leaves behind; it is skipped with a warning. Any other bad
+    line is corruption and raises.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            if line.endswith("\n"):
+                raise
+            logger.warning(f"Skipping partially written last line of {source} ({len(line)} characters)")
+
+
+def _truncate_partial_line(filepath: str) -> int:
+    """Cut a JSONL file back to its last complete line; returns the bytes removed"""
+    with open(filepath, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - 64 * 1024)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end == size:
+            return 0
+        f.seek(end)
+        try:
+            json.loads(f.read())
+            # A complete action that only lacks its newline is kept
+            f.write(b"\n")
+            return 0
+        except ValueError:
+            f.truncate(end)
+    logger.warning(f"Truncated {size - end} bytes of a partially written line from {filepath}")
+    return size - end
+
+
+def read_audit_jsonl(filepath: str) -> Iterator["AgentAction"]:
+    """Stream actions back from a JSONL audit file (one action in memory at a time)"""
+    with open(filepath, "r", encoding="utf-8") as f:
+        for fields in _parse_audit_lines(f, filepath):
+            yield AgentAction(**fields)
+
+
+class MappedAuditLog:
+    """
+    Random-access, memory-mapped reader for a JSONL audit file
+    A sparse index holding the byte offset and timestamp range of every
+    index_every-th action is built once and saved next to the file (path +
+    ".idx"). Lookups by action number and time-range scans then parse only
+    the blocks they touch. Lines appended since the index was saved are
+    indexed on open or refresh(). A file rewritten in place is detected and
+    fully reindexed.
+    """
+    
+    INDEX_VERSION = 1
+    # json.dumps(action.to_dict()) always starts with the timestamp
+    _TIMESTAMP = re.compile(rb'\{"timestamp": "([^"\\]*)"')
+    
+    def __init__(self, path: str, index_every: int = 1024, persist_index: bool = True):
+        if index_every < 1:
+            raise ValueError("index_every must be at least 1")
+        self.path = path
+        self.index_path = path + ".idx"
+        self.persist_index = persist_index
+        self._file = open(path, "rb")
+        self._map: Optional[mmap.mmap] = None
+        self._index = self._load_index(index_every)
+        self.refresh()
+    
+    def refresh(self):
+        """Re-map the file and index any complete lines appended since the last refresh"""
+        size = os.fstat(self._file.fileno()).st_size
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        index = self._index
+        if size < index["indexed_bytes"] or self._head_digest(index["head_length"]) != index["head_digest"]:
+            logger.info(f"{self.path} changed in place; rebuilding its offset index")
+            index = self._index = self._empty_index(index["index_every"])
+        if size > index["indexed_bytes"]:
+            self._extend_index(size)
+            # Appends never change the first bytes; a rewrite almost certainly does
+            index["head_length"] = min(index["indexed_bytes"], 4096)
+            index["head_digest"] = self._head_digest(index["head_length"])
+            if self.persist_index:
+                self._save_index()
+    
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+    
+    def __len__(self) -> int:
+        return self._index["count"]
+    
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return list(self.iter_range(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("action index out of range")
+        return next(self.iter_range(index, index + 1))
+    
+    def iter_range(self, start: int = 0, stop: Optional[int] = None) -> Iterator["AgentAction"]:
+        """Actions numbered start..stop-1, seeking straight to start's index block"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return
+        every = self._index["index_every"]
+        number, offset, _, _ = self._index["blocks"][start // every]
+        for line in self._iter_lines(offset, self._index["indexed_bytes"]):
+            if number >= stop:
+                return
+            if number >= start:
+                yield AgentAction(**json.loads(line))
+            number += 1
+    
+    def scan(self, since: Optional[Any] = None, until: Optional[Any] = None) -> Iterator["AgentAction"]:
+        """
+        Actions with since <= timestamp < until, in file order
+        since/until take a datetime or ISO timestamp; only index blocks
+        whose timestamp range overlaps are read.
+        """
+        since = since.isoformat() if isinstance(since, datetime) else since
+        until = until.isoformat() if isinstance(until, datetime) else until
+        blocks = self._index["blocks"]
+        for i, (_, offset, first, last) in enumerate(blocks):
+            if (since is not None and last < since) or (until is not None and first >= until):
+                continue
+            end = blocks[i + 1][1] if i + 1 < len(blocks) else self._index["indexed_bytes"]
+            for line in self._iter_lines(offset, end):
+                timestamp = self._timestamp(line)
+                if (since is None or timestamp >= since) and (until is None or timestamp < until):
+                    yield AgentAction(**json.loads(line))
+    
+    def _iter_lines(self, start: int, end: int) -> Iterator[bytes]:
+        """Non-blank lines between two byte offsets"""
+        mapped = self._map
+        pos = start
+        while pos < end:
+            newline = mapped.find(b"\n", pos, end)
+            if newline == -1:
+                newline = end
+            line = mapped[pos:newline]
+            pos = newline + 1
+            if line.strip():
+                yield line
+    
+    @classmethod
+    def _timestamp(cls, line: bytes) -> str:
+        match = cls._TIMESTAMP.match(line)
+        if match is not None:
+            return match.group(1).decode("utf-8")
+        return json.loads(line)["timestamp"]
+    
+    def _extend_index(self, size: int):
+        index = self._index
+        every = index["index_every"]
+        blocks = index["blocks"]
+        count = index["count"]
+        mapped = self._map
+        pos = index["indexed_bytes"]
+        while pos < size:
+            newline = mapped.find(b"\n", pos)
+            if newline == -1:
+                # A partially written last line is left for the next refresh
+                break
+            line = mapped[pos:newline]
+            if line.strip():
+                timestamp = self._timestamp(line)
+                if count % every == 0:
+                    blocks.append([count, pos, timestamp, timestamp])
+                else:
+                    block = blocks[-1]
+                    if timestamp < block[2]:
+                        block[2] = timestamp
+                    if timestamp > block[3]:
+                        block[3] = timestamp
+                count += 1
+            pos = newline + 1
+        index["count"] = count
+        index["indexed_bytes"] = pos
+    
+    def _head_digest(self, length: int) -> str:
+        return hashlib.sha256(self._map[:length]).hexdigest() if length else ""
+    
+    def _empty_index(self, index_every: int) -> Dict[str, Any]:
+        return {"version": self.INDEX_VERSION, "index_every": index_every, "indexed_bytes": 0,
+                "count": 0, "head_length": 0, "head_digest": "", "blocks": []}
+    
+    def _load_index(self, index_every: int) -> Dict[str, Any]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return self._empty_index(index_every)
+        if index.get("version") != self.INDEX_VERSION or index.get("index_every") != index_every:
+            return self._empty_index(index_every)
+        return index
+    
+    def _save_index(self):
+        try:
+            with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self._index, f, separators=(",", ":"))
+            os.replace(self.index_path + ".tmp", self.index_path)
+        except OSError as e:
+            logger.warning(f"Could not save audit index {self.index_path}: {str(e)}")
+
+
+class RotatingJSONLAuditSink:
+    """
+    Directory of JSONL audit segments with rotation, compression and retention
+    The active segment is a JSONLAuditSink; it is closed and a new one started
+    once it reaches max_segment_bytes or max_segment_seconds. Closed segments
+    are listed in manifest.json with their timestamp range and summary
+    counters, so readers and summary rebuilds only open segments that
+    overlap the requested time range. They are then compressed (codec
+    "gzip", "zlib" or None) on a background thread, off the write path, and
+    the manifest switched to the compressed copy; close() waits for that.
+    Retention drops the oldest closed segments beyond max_segments,
+    max_total_bytes or max_age_seconds; compact() merges small neighbours.
+    """
+    
+    MANIFEST = "manifest.json"
+    _SUFFIXES = {None: "", "gzip": ".gz", "zlib": ".zz"}
+    
+    def __init__(self, directory: str, max_segment_bytes: int = 64 * 1024 * 1024,
+                 max_segment_seconds: Optional[float] = 3600.0, codec: Optional[str] = "gzip",
+                 compress_level: int = 6, max_segments: Optional[int] = None,
+                 max_total_bytes: Optional[int] = None, max_age_seconds: Optional[float] = None,
+                 **sink_options: Any):
+        """sink_options are passed to each segment's JSONLAuditSink (flush_every, fsync, ...)"""
+        if codec not in self._SUFFIXES:
+            raise ValueError(f"Unknown codec: {codec!r} (expected 'gzip', 'zlib' or None)")
+        if max_segment_bytes < 1:
+            raise ValueError("max_segment_bytes must be at least 1")
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        self.codec = codec
+        self.compress_level = compress_level
+        self.max_segments = max_segments
+        self.max_total_bytes = max_total_bytes
+        self.max_age_seconds = max_age_seconds
+        self.sink_options = sink_options
+        self._lock = threading.Lock()
+        # Started on first use; compresses closed segments one at a time
+        self._compressor: Optional[ThreadPoolExecutor] = None
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+        self._segments: List[Dict[str, Any]] = _load_segment_manifest(directory)
+        self._next_id = max((s["last_id"] for s in self._segments), default=0) + 1
+        # Held so compressions scheduled here cannot rewrite the manifest alongside us
+        with self._lock:
+            # Segments left open by a crashed process are rescanned and closed
+            for entry in list(self._segments):
+                if not entry["closed"]:
+                    raw_path = os.path.join(directory, entry["file"])
+                    if not os.path.exists(raw_path):
+                        self._discard_segment(entry)
+                        continue
+                    _truncate_partial_line(raw_path)
+                    counters = _segment_counters(directory, entry)
+                    if counters["total_actions"]:
+                        self._close_segment(entry, counters)
+                    else:
+                        self._discard_segment(entry)
+                elif entry["codec"] is None and self.codec is not None:
+                    # Closed, but the process exited before compressing it
+                    self._schedule_compression(entry)
+            self._open_segment()
+    
+    @property
+    def path(self) -> str:
+        return self.directory
+    
+    def write(self, action: "AgentAction"):
+        self.write_batch([action])
+    
+    def write_batch(self, actions: List["AgentAction"]):
+        """Append actions to the active segment, rotating first if it is full or too old"""
+        if not actions:
+            return
+        with self._lock:
+            if self._should_rotate():
+                self._rotate_locked()
+            self._active.write_batch(actions)
+            self.written += len(actions)
+            entry = self._active_entry
+            for action in actions:
+                self._active_counters.add(action, itertools.repeat(0), False)
+                if entry["first_timestamp"] is None or action.timestamp < entry["first_timestamp"]:
+                    entry["first_timestamp"] = action.timestamp
+                if entry["last_timestamp"] is None or action.timestamp > entry["last_timestamp"]:
+                    entry["last_timestamp"] = action.timestamp
+    
+    def rotate(self):
+        """Close the active segment now (compressing it in the background) and start a new one"""
+        with self._lock:
+            self._rotate_locked()
+    
+    def flush(self):
+        with self._lock:
+            self._active.flush()
+    
+    def close(self):
+        """Close the active segment and wait until every closed segment is compressed"""
+        with self._lock:
+            if self._active is not None:
+                self._active.close()
+                if self._active_counters.total_actions:
+                    self._close_segment(self._active_entry, self._active_counters.counters())
+                else:
+                    # Nothing was written; do not leave an empty segment behind
+                    self._discard_segment(self._active_entry)
+                self._active = None
+            compressor, self._compressor = self._compressor, None
+        if compressor is not None:
+            # Outside the lock: each compression takes it to publish its result
+            compressor.shutdown(wait=True)
+    
+    def segments(self) -> List[Dict[str, Any]]:
+        """Manifest entries, oldest first (the last one is the active segment)"""
+        with self._lock:
+            return [dict(entry) for entry in self._segments]
+    
+    def iter_actions(self, since: Optional[Any] = None, until: Optional[Any] = None) -> Iterator["AgentAction"]:
+        """Stream actions with since <= timestamp < until, opening only overlapping segments"""
+        self.flush()
+        yield from read_audit_segments(self.directory, since, until)
+    
+    def get_summary(self, since: Optional[Any] = None, until: Optional[Any] = None) -> Dict[str, Any]:
+        """Summary in the AuditTrail.get_summary shape, mostly from manifest counters"""
+        self.flush()
+        return AuditTrail.from_segments(self.directory, since, until).get_summary()
+    
+    def compact(self, target_bytes: Optional[int] = None) -> int:
+        """
+        Merge runs of adjacent closed segments whose combined uncompressed
+        size fits in target_bytes (default max_segment_bytes)
+        Returns the number of segments removed.
+        """
+        target_bytes = target_bytes or self.max_segment_bytes
+        removed = 0
+        with self._lock:
+            closed = [entry for entry in self._segments if entry["closed"]]
+            runs: List[List[Dict[str, Any]]] = []
+            for entry in closed:
+                if runs and sum(e["raw_bytes"] for e in runs[-1]) + entry["raw_bytes"] <= target_bytes:
+                    runs[-1].append(entry)
+                else:
+                    runs.append([entry])
+            for run in runs:
+                if len(run) > 1:
+                    self._merge_segments(run)
+                    removed += len(run) - 1
+        return removed
+    
+    def _should_rotate(self) -> bool:
+        if self._active_counters.total_actions == 0:
+            return False
+        if self._active.bytes_written >= self.max_segment_bytes:
+            return True
+        return (self.max_segment_seconds is not None
+                and time.monotonic() - self._active_opened >= self.max_segment_seconds)
+    
+    def _rotate_locked(self):
+        if self._active_counters.total_actions == 0:
+            return
+        self._active.close()
+        self._close_segment(self._active_entry, self._active_counters.counters())
+        self._open_segment()
+        self._apply_retention()
+    
+    def _open_segment(self):
+        segment_id = self._next_id
+        self._next_id += 1
+        entry = {
+            "first_id": segment_id, "last_id": segment_id,
+            "file": f"segment-{segment_id:06d}.jsonl", "codec": None, "closed": False,
+            "first_timestamp": None, "last_timestamp": None,
+            "actions": 0, "raw_bytes": 0, "bytes": 0, "counters": None
+        }
+        # Listed before any data is written so a crash never leaves an unknown segment
+        self._segments.append(entry)
+        self._write_manifest()
+        self._active = JSONLAuditSink(os.path.join(self.directory, entry["file"]), **self.sink_options)
+        self._active_entry = entry
+        self._active_counters = _AuditShard(compact=False)
+        self._active_opened = time.monotonic()
+    
+    def _close_segment(self, entry: Dict[str, Any], counters: Dict[str, Any]):
+        raw_path = os.path.join(self.directory, entry["file"])
+        entry["raw_bytes"] = os.path.getsize(raw_path)
+        entry["actions"] = counters["total_actions"]
+        entry["counters"] = counters
+        if entry["first_timestamp"] is None and counters["total_actions"]:
+            timestamps = [a.timestamp for a in read_audit_jsonl(raw_path)]
+            entry["first_timestamp"], entry["last_timestamp"] = min(timestamps), max(timestamps)
+        entry["bytes"] = entry["raw_bytes"]
+        entry["closed"] = True
+        self._write_manifest()
+        self._schedule_compression(entry)
+    
+    def _schedule_compression(self, entry: Dict[str, Any]):
+        if self.codec is None:
+            return
+        if self._compressor is None:
+            self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit-compress")
+        self._compressor.submit(self._compress_segment, entry)
+    
+    def _compress_segment(self, entry: Dict[str, Any]):
+        """Compress a closed segment without holding the lock, then point the manifest at it"""
+        raw_path = os.path.join(self.directory, entry["file"])
+        compressed = raw_path + self._SUFFIXES[self.codec]
+        try:
+            _compress_file(raw_path, compressed, self.codec, self.compress_level)
+        except OSError as e:
+            if os.path.exists(compressed + ".tmp"):
+                os.remove(compressed + ".tmp")
+            with self._lock:
+                # Retention or compaction may have removed the segment in the meantime
+                if any(listed is entry for listed in self._segments):
+                    logger.error(f"Failed to compress audit segment {raw_path}: {str(e)}")
+            return
+        with self._lock:
+            if not any(listed is entry for listed in self._segments):
+                os.remove(compressed)
+                return
+            entry["file"] = os.path.basename(compressed)
+            entry["codec"] = self.codec
+            entry["bytes"] = os.path.getsize(compressed)
+            self._write_manifest()
+        # Removed only once the manifest points at the compressed copy
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    
+    def _discard_segment(self, entry: Dict[str, Any]):
+        self._segments.remove(entry)
+        self._write_manifest()
+        path = os.path.join(self.directory, entry["file"])
+        if os.path.exists(path):
+            os.remove(path)
+    
+    def _merge_segments(self, run: List[Dict[str, Any]]):
+        first, last = run[0], run[-1]
+        name = f"segment-{first['first_id']:06d}-{last['last_id']:06d}.jsonl"
+        raw_path = os.path.join(self.directory, name)
+        counters = _AuditShard(compact=False)
+        with open(raw_path, "w", encoding="utf-8") as out:
+            for entry in run:
+                for line in _iter_segment_lines(self.directory, entry):
+                    out.write(line)
+                counters.merge_counters(entry["counters"])
+        merged = {
+            "first_id": first["first_id"], "last_id": last["last_id"], "file": name, "codec": None,
+            "closed": False,
+            "first_timestamp": min(e["first_timestamp"] for e in run),
+            "last_timestamp": max(e["last_timestamp"] for e in run),
+            "actions": 0, "raw_bytes": 0, "bytes": 0, "counters": None
+        }
+        position = self._segments.index(first)
+        self._segments[position:position + len(run)] = [merged]
+        self._close_segment(merged, counters.counters())
+        for entry in run:
+            os.remove(os.path.join(self.directory, entry["file"]))
+    
+    def _apply_retention(self):
+        closed = [entry for entry in self._segments if entry["closed"]]
+        cutoff = (_clock.now() - timedelta(seconds=self.max_age_seconds)).isoformat() \
+            if self.max_age_seconds is not None else None
+        expired = []
+        total_bytes = sum(entry["bytes"] for entry in closed)
+        for entry in closed:
+            remaining = len(closed) - len(expired)
+            if ((self.max_segments is not None and remaining > self.max_segments)
+                    or (self.max_total_bytes is not None and total_bytes > self.max_total_bytes)
+                    or (cutoff is not None and entry["last_timestamp"] < cutoff)):
+                expired.append(entry)
+                total_bytes -= entry["bytes"]
+            else:
+                break
+        if not expired:
+            return
+        for entry in expired:
+            self._segments.remove(entry)
+        self._write_manifest()
+        for entry in expired:
+            os.remove(os.path.join(self.directory, entry["file"]))
+        logger.info(f"Audit retention removed {len(expired)} segment(s) from {self.directory}")
+    
+    def _write_manifest(self):
+        path = os.path.join(self.directory, self.MANIFEST)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"segments": self._segments}, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+def _load_segment_manifest(directory: str) -> List[Dict[str, Any]]:
+    path = os.path.join(directory, RotatingJSONLAuditSink.MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["segments"]
+
+
+def _compress_file(source: str, target: str, codec: str, level: int):
+    """Compress source into target atomically (written to a temp file, then renamed)"""
+    with open(source, "rb") as src, open(target + ".tmp", "wb") as raw_out:
+        if codec == "gzip":
+            with gzip.GzipFile(fileobj=raw_out, mode="wb", compresslevel=level) as out:
+                while chunk := src.read(1024 * 1024):
+                    out.write(chunk)
+        else:
+            compressor = zlib.compressobj(level)
+            while chunk := src.read(1024 * 1024):
+                raw_out.write(compressor.compress(chunk))
+            raw_out.write(compressor.flush())
+    os.replace(target + ".tmp", target)
+
+
+def _iter_segment_lines(directory: str, entry: Dict[str, Any]) -> Iterator[str]:
+    """Yield the JSON lines of one segment, decompressing on the fly"""
+    path = os.path.join(directory, entry["file"])
+    if entry["codec"] == "gzip":
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            yield from f
+    elif entry["codec"] == "zlib":
+        decompressor = zlib.decompressobj()
+        pending = b""
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                pending += decompressor.decompress(chunk)
+                *lines, pending = pending.split(b"\n")
+                for line in lines:
+                    yield line.decode("utf-8") + "\n"
+        pending += decompressor.flush()
+        if pending:
+            yield pending.decode("utf-8")
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from f
+
+
+def _segment_counters(directory: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    counters = _AuditShard(compact=False)
+    for fields in _parse_audit_lines(_iter_segment_lines(directory, entry), entry["file"]):
+        counters.add(AgentAction(**fields), itertools.repeat(0), False)
+    return counters.counters()
+
+
+def _segment_overlaps(entry: Dict[str, Any], since: Optional[str], until: Optional[str]) -> bool:
+    if entry["first_timestamp"] is None:
+        # Open segment with nothing recorded in the manifest yet
+        return True
+    return ((since is None or entry["last_timestamp"] >= since)
+            and (until is None or entry["first_timestamp"] < until))
+
+
+def read_audit_segments(directory: str, since: Optional[Any] = None,
+                        until: Optional[Any] = None) -> Iterator["AgentAction"]:
+    """
+    Stream actions from a RotatingJSONLAuditSink directory, oldest segment first
+    since/until take a datetime or ISO timestamp (since inclusive, until
+    exclusive); segments outside the range are skipped using the manifest.
+    """
+    since = since.isoformat() if isinstance(since, datetime) else since
+    until = until.isoformat() if isinstance(until, datetime) else until
+    for entry in _load_segment_manifest(directory):
+        if not _segment_overlaps(entry, since, until):
+            continue
+        for fields in _parse_audit_lines(_iter_segment_lines(directory, entry), entry["file"]):
+            action = AgentAction(**fields)
+            if (since is None or action.timestamp >= since) and (until is None or action.timestamp < until):
+                yield action
+
+
+class SQLiteAuditStore:
+    """
+    SQLite (WAL mode) storage backend for the audit trail
+    Use it as an AuditTrail sink (optionally behind a BackgroundAuditWriter)
+    and query it with indexed filters instead of loading the whole export.
+    A trigger-maintained rollup table keeps get_summary cheap no matter how
+    many actions are stored.
+    """
+    
+    _COLUMNS = ("timestamp", "agent_role", "action_type", "company", "success",
+                "tokens_used", "cost_usd", "error_message", "input_data", "output_data", "duration_ms",
+                "integrity")
+    
+    def __init__(self, path: str = "audit_trail.sqlite3"):
+        self.path = path
+        # sqlite3 connections must not be shared between threads
+        self._local = threading.local()
+        self._init_schema()
+    
+    def write(self, action: "AgentAction"):
+        self.write_batch([action])
+    
+    def write_batch(self, actions: List["AgentAction"]):
+        """Insert several actions in one transaction"""
+        rows = [self._to_row(a) for a in actions]
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                f"INSERT INTO actions ({', '.join(self._COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in self._COLUMNS)})",
+                rows
+            )
+    
+    def flush(self):
+        """Every write_batch commits, so there is nothing buffered"""
+    
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def query(self, company: Optional[str] = None, agent_role: Optional[str] = None,
+              action_type: Optional[str] = None, success: Optional[bool] = None,
+              since: Optional[Any] = None, until: Optional[Any] = None,
+              limit: Optional[int] = None, newest_first: bool = False) -> List["AgentAction"]:
+        """
+        Return actions matching every given filter
+        company matches the normalized company name; since/until take a
+        datetime or ISO timestamp (since inclusive, until exclusive).
+        """
+        return list(self.iter_query(company, agent_role, action_type, success, since, until,
+                                    limit, newest_first))
+    
+    def iter_query(self, company: Optional[str] = None, agent_role: Optional[str] = None,
+                   action_type: Optional[str] = None, success: Optional[bool] = None,
+                   since: Optional[Any] = None, until: Optional[Any] = None,
+                   limit: Optional[int] = None, newest_first: bool = False) -> Iterator["AgentAction"]:
+        """Like query(), but streams rows from the cursor instead of building a list"""
+        where, params = self._where(company, agent_role, action_type, success, since, until)
+        sql = (f"SELECT {', '.join(self._COLUMNS)} FROM actions{where} "
+               f"ORDER BY timestamp {'DESC' if newest_first else 'ASC'}, id")
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        for row in self._connect().execute(sql, params):
+            yield self._from_row(row)
+    
+    def count(self, **filters: Any) -> int:
+        """Count actions matching the same filters as query()"""
+        where, params = self._where(**filters)
+        return self._connect().execute(f"SELECT COUNT(*) FROM actions{where}", params).fetchone()[0]
+    
+    def get_summary(self, **filters: Any) -> Dict[str, Any]:
+        """
+        Summary in the AuditTrail.get_summary shape, aggregated in SQL
+        Unfiltered summaries read the rollup table; filtered ones aggregate
+        over the matching rows using the indexes.
+        """
+        conn = self._connect()
+        if any(v is not None for v in filters.values()):
+            where, params = self._where(**filters)
+            rows = conn.execute(
+                "SELECT agent_role, action_type, success, COUNT(*), SUM(tokens_used), SUM(cost_usd) "
+                f"FROM actions{where} GROUP BY agent_role, action_type, success",
+                params
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT agent_role, action_type, success, n, tokens, cost FROM action_rollup"
+            ).fetchall()
+        
+        actions_by_agent: Dict[str, int] = {role.value: 0 for role in AgentRole}
+        actions_by_type: Dict[str, int] = {}
+        total = successes = tokens = 0
+        cost = 0.0
+        for agent_role, action_type, success, n, n_tokens, n_cost in rows:
+            if not n:
+                continue
+            actions_by_agent[agent_role] = actions_by_agent.get(agent_role, 0) + n
+            actions_by_type[action_type] = actions_by_type.get(action_type, 0) + n
+            total += n
+            successes += n if success else 0
+            tokens += n_tokens or 0
+            cost += n_cost or 0.0
+        return {
+            "total_actions": total,
+            "total_cost_usd": round(cost, 4),
+            "total_tokens": tokens,
+            "actions_by_agent": actions_by_agent,
+            "actions_by_type": actions_by_type,
+            "successful_actions": successes,
+            "failed_actions": total - successes,
+            "success_rate": round(successes / total * 100, 2) if total else 0
+        }
+    
+    @staticmethod
+    def _where(company: Optional[str] = None, agent_role: Optional[str] = None,
+               action_type: Optional[str] = None, success: Optional[bool] = None,
+               since: Optional[Any] = None, until: Optional[Any] = None) -> tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        if company is not None:
+            clauses.append("company = ?")
+            params.append(normalize_company_name(company))
+        if agent_role is not None:
+            clauses.append("agent_role = ?")
+            params.append(agent_role.value if isinstance(agent_role, AgentRole) else agent_role)
+        if action_type is not None:
+            clauses.append("action_type = ?")
+            params.append(action_type)
+        if success is not None:
+            clauses.append("success = ?")
+            params.append(1 if success else 0)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since.isoformat() if isinstance(since, datetime) else since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until.isoformat() if isinstance(until, datetime) else until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+    
+    @staticmethod
+    def _to_row(action: "AgentAction") -> tuple:
+        company = action.input_data.get("company_name")
+        return (
+            action.timestamp, action.agent_role, action.action_type,
+            normalize_company_name(company) if isinstance(company, str) else None,
+            1 if action.success else 0, action.tokens_used, action.cost_usd,
+            action.error_message,
+            json.dumps(action.input_data, ensure_ascii=False),
+            json.dumps(action.output_data, ensure_ascii=False),
+            action.duration_ms,
+            json.dumps(action.integrity) if action.integrity is not None else None
+        )
+    
+    @staticmethod
+    def _from_row(row: tuple) -> "AgentAction":
+        (timestamp, agent_role, action_type, _, success, tokens_used, cost_usd,
+         error_message, input_data, output_data, duration_ms, integrity) = row
+        return AgentAction(
+            timestamp=timestamp,
+            agent_role=agent_role,
+            action_type=action_type,
+            input_data=json.loads(input_data),
+            output_data=json.loads(output_data),
+            tokens_used=tokens_used,
+            cost_usd=cost_usd,
+            success=bool(success),
+            error_message=error_message,
+            duration_ms=duration_ms,
+            integrity=json.loads(integrity) if integrity is not None else None
+        )
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly where needed
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _init_schema(self):
+        self._connect().executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS actions (
+                id INTEGER PRIMARY KEY,
+                timestamp TEXT NOT NULL,
+                agent_role TEXT NOT NULL,
+                action_type TEXT NOT NULL,
+                company TEXT,
+                success INTEGER NOT NULL,
+                tokens_used INTEGER NOT NULL,
+                cost_usd REAL NOT NULL,
+                error_message TEXT,
+                input_data TEXT NOT NULL,
+                output_data TEXT NOT NULL,
+                duration_ms REAL,
+                integrity TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_actions_timestamp ON actions (timestamp);
+            CREATE INDEX IF NOT EXISTS idx_actions_role ON actions (agent_role, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_actions_type ON actions (action_type, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_actions_company ON actions (company, action_type, timestamp);
+            CREATE INDEX IF NOT EXISTS idx_actions_success ON actions (success, timestamp);
+            CREATE TABLE IF NOT EXISTS action_rollup (
+                agent_role TEXT NOT NULL,
+                action_type TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                n INTEGER NOT NULL,
+                tokens INTEGER NOT NULL,
+                cost REAL NOT NULL,
+                PRIMARY KEY (agent_role, action_type, success)
+            );
+            CREATE TRIGGER IF NOT EXISTS actions_rollup_insert AFTER INSERT ON actions
+            BEGIN
+                INSERT INTO action_rollup (agent_role, action_type, success, n, tokens, cost)
+                VALUES (NEW.agent_role, NEW.action_type, NEW.success, 1, NEW.tokens_used, NEW.cost_usd)
+                ON CONFLICT (agent_role, action_type, success) DO UPDATE SET
+                    n = n + 1, tokens = tokens + excluded.tokens, cost = cost + excluded.cost;
+            END;
+            CREATE TRIGGER IF NOT EXISTS actions_rollup_delete AFTER DELETE ON actions
+            BEGIN
+                UPDATE action_rollup SET n = n - 1, tokens = tokens - OLD.tokens_used,
+                    cost = cost - OLD.cost_usd
+                WHERE agent_role = OLD.agent_role AND action_type = OLD.action_type
+                    AND success = OLD.success;
+            END;
+            COMMIT;
+        """)
+        # Stores created before these columns existed get them added in place
+        conn = self._connect()
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(actions)")}
+        for name, sql_type in (("duration_ms", "REAL"), ("integrity", "TEXT")):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE actions ADD COLUMN {name} {sql_type}")
+
+
+# Positional list + sorted keys gives the same bytes after a JSON round trip
+_CANONICAL_JSON = json.JSONEncoder(sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+def _action_digest(action: AgentAction) -> bytes:
+    """SHA-256 leaf hash of an action's content (everything except its integrity link)"""
+    content = _CANONICAL_JSON.encode(
+        [action.timestamp, action.agent_role, action.action_type, action.input_data,
+         action.output_data, action.tokens_used, action.cost_usd, action.success,
+         action.error_message, action.duration_ms]
+    )
+    return hashlib.sha256(b"\x00" + content.encode("utf-8")).digest()
+
+
+def _merkle_root(leaves: List[bytes]) -> bytes:
+    """Merkle root of leaf hashes (an odd node at any level is carried up unchanged)"""
+    if not leaves:
+        return hashlib.sha256(b"").digest()
+    level = leaves
+    while len(level) > 1:
+        paired = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest()
+                  for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def _chain_genesis(trail_id: str, chain_id: int) -> bytes:
+    return hashlib.sha256(f"audit-chain:{trail_id}:{chain_id}".encode("utf-8")).digest()
+
+
+class _HashChain:
+    """
+    Hash chain over one shard's actions, with a Merkle checkpoint every
+    checkpoint_every links
+    Each link is sha256(previous link + action digest), so altering, dropping
+    or reordering an action breaks every later link. A checkpoint records the
+    chain head and the Merkle root of its segment's digests, which lets a
+    verifier check segments independently of each other.
+    """
     
-    def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+    __slots__ = ("chain_id", "checkpoint_every", "head", "length", "segment_start",
+                 "segment_leaves", "checkpoints")
+    
+    def __init__(self, trail_id: str, chain_id: int, checkpoint_every: int):
+        self.chain_id = chain_id
+        self.checkpoint_every = checkpoint_every
+        self.head = _chain_genesis(trail_id, chain_id)
+        self.length = 0
+        self.segment_start = 0
+        self.segment_leaves: List[bytes] = []
+        self.checkpoints: List[Dict[str, Any]] = []
+    
+    def append(self, action: AgentAction):
+        leaf = _action_digest(action)
+        self.head = hashlib.sha256(self.head + leaf).digest()
+        action.integrity = {"chain": self.chain_id, "index": self.length, "hash": self.head.hex()}
+        self.length += 1
+        self.segment_leaves.append(leaf)
+        if len(self.segment_leaves) >= self.checkpoint_every:
+            self.checkpoints.append(self._checkpoint())
+            self.segment_start = self.length
+            self.segment_leaves = []
+    
+    def _checkpoint(self) -> Dict[str, Any]:
+        return {
+            "start": self.segment_start,
+            "count": len(self.segment_leaves),
+            "merkle_root": _merkle_root(self.segment_leaves).hex(),
+            "head": self.head.hex()
+        }
+    
+    def manifest(self) -> Dict[str, Any]:
+        """Chain length, head and checkpoints (the open segment is checkpointed as of now)"""
+        checkpoints = list(self.checkpoints)
+        if self.segment_leaves:
+            checkpoints.append(self._checkpoint())
+        return {"chain": self.chain_id, "length": self.length, "head": self.head.hex(),
+                "checkpoints": checkpoints}
 
 
-class AuditTrail:
-    """Manages audit trail for all agent actions"""
+class _AuditShard:
+    """
+    One slice of an AuditTrail, written by the threads assigned to it
+    With no more writer threads than shards each lock is uncontended on the
+    hot path; readers take it briefly while merging shards.
+    """
     
-    def __init__(self):
-        self.actions: List[AgentAction] = []
+    __slots__ = ("lock", "actions", "seqs", "total_actions", "total_cost", "total_tokens",
+                 "actions_by_agent", "actions_by_type", "success_count", "failure_count",
+                 "role_latency", "step_latency", "chain")
+    
+    def __init__(self, compact: bool, chain: Optional[_HashChain] = None):
+        self.lock = threading.Lock()
+        self.actions: Any = ColumnarActionLog() if compact else []
+        # Trail-wide sequence number of each retained action, for merged ordering
+        self.seqs = array("q")
+        self.total_actions = 0
         self.total_cost = 0.0
         self.total_tokens = 0
+        self.actions_by_agent: Dict[str, int] = {}
+        self.actions_by_type: Dict[str, int] = {}
+        self.success_count = 0
+        self.failure_count = 0
+        # Latency sketches (milliseconds) by agent role and by orchestrator step
+        self.role_latency: Dict[str, LatencySketch] = {}
+        self.step_latency: Dict[str, LatencySketch] = {}
+        # Set when the trail is tamper-evident
+        self.chain = chain
+    
+    def add(self, action: AgentAction, seqs: Iterator[int], retain: bool, sink: Optional[Any] = None):
+        with self.lock:
+            # Numbered under the lock so a shard's seqs stay sorted when threads share it
+            seq = next(seqs)
+            if self.chain is not None:
+                self.chain.append(action)
+            if retain:
+                self.actions.append(action)
+                self.seqs.append(seq)
+            self.total_actions += 1
+            self.total_cost += action.cost_usd
+            self.total_tokens += action.tokens_used
+            self.actions_by_agent[action.agent_role] = self.actions_by_agent.get(action.agent_role, 0) + 1
+            self.actions_by_type[action.action_type] = self.actions_by_type.get(action.action_type, 0) + 1
+            if action.success:
+                self.success_count += 1
+            else:
+                self.failure_count += 1
+            if action.duration_ms is not None:
+                sketch = self.role_latency.get(action.agent_role)
+                if sketch is None:
+                    sketch = self.role_latency[action.agent_role] = LatencySketch()
+                sketch.add(action.duration_ms)
+            if sink is not None:
+                # Handed over under the lock so the sink receives each chain in order and
+                # nothing counted in a snapshot of this shard is still on its way to the sink
+                sink.write(action)
+    
+    def counters(self) -> Dict[str, Any]:
+        """JSON-serializable snapshot of the summary counters (see merge_counters)"""
+        with self.lock:
+            return {
+                "total_actions": self.total_actions, "total_cost": self.total_cost,
+                "total_tokens": self.total_tokens, "actions_by_agent": dict(self.actions_by_agent),
+                "actions_by_type": dict(self.actions_by_type), "success_count": self.success_count,
+                "failure_count": self.failure_count,
+                "role_latency": {role: sketch.state() for role, sketch in self.role_latency.items()}
+            }
+    
+    def merge_counters(self, counters: Dict[str, Any]):
+        """Add counters() output from another shard (or a stored segment) into this one"""
+        with self.lock:
+            self.total_actions += counters["total_actions"]
+            self.total_cost += counters["total_cost"]
+            self.total_tokens += counters["total_tokens"]
+            self.success_count += counters["success_count"]
+            self.failure_count += counters["failure_count"]
+            for key in ("actions_by_agent", "actions_by_type"):
+                totals = getattr(self, key)
+                for name, count in counters[key].items():
+                    totals[name] = totals.get(name, 0) + count
+            for role, state in counters["role_latency"].items():
+                self.role_latency.setdefault(role, LatencySketch()).merge(LatencySketch.from_state(state))
+    
+    def add_step_latency(self, step: str, duration_ms: float):
+        with self.lock:
+            sketch = self.step_latency.get(step)
+            if sketch is None:
+                sketch = self.step_latency[step] = LatencySketch()
+            sketch.add(duration_ms)
+    
+    def merge_step_latencies(self, states: Dict[str, Dict[str, Any]]):
+        with self.lock:
+            for step, state in states.items():
+                self.step_latency.setdefault(step, LatencySketch()).merge(LatencySketch.from_state(state))
+
+
+class AuditTrail:
+    """
+    Manages audit trail for all agent actions
+    Safe to share between threads: threads are spread round-robin over a
+    fixed pool of shards and totals are merged when read, so log_action never
+    contends on a global lock and reads cost the same however many threads
+    have come and gone.
+    """
+    
+    def __init__(self, sink: Optional[Any] = None, retain_actions: bool = True,
+                 compact: bool = False, tamper_evident: bool = False,
+                 checkpoint_every: int = 1024, shard_count: int = 16):
+        """
+        sink: JSONLAuditSink or SQLiteAuditStore (optionally wrapped in a
+        BackgroundAuditWriter) every logged action is written through to
+        retain_actions: keep actions in memory; turn off with a sink so a
+        long-running orchestrator's memory stays flat
+        compact: retain actions in a ColumnarActionLog instead of a list
+        tamper_evident: hash-chain every action (one chain per shard) and
+        take a Merkle checkpoint every checkpoint_every actions; exports then
+        carry an integrity manifest that verify_audit_export checks
+        shard_count: upper bound on shards (and hash chains); more concurrent
+        writer threads than this share shard locks
+        """
+        if not retain_actions and sink is None:
+            raise ValueError("retain_actions=False requires a sink, or actions would be lost")
+        if checkpoint_every < 1:
+            raise ValueError("checkpoint_every must be at least 1")
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self.sink = sink
+        self.retain_actions = retain_actions
+        # Read-only replay of the file a trail was rebuilt from (see from_jsonl/from_segments)
+        self._source: Optional[Callable[[], Iterator[AgentAction]]] = None
+        self.compact = compact
+        self.tamper_evident = tamper_evident
+        self.checkpoint_every = checkpoint_every
+        # Seeds the chains so links from another trail cannot be spliced in
+        self.trail_id = os.urandom(16).hex()
+        self.shard_count = shard_count
+        self._shards: List[_AuditShard] = []
+        self._local = threading.local()
+        self._next_slot = itertools.count()
+        # itertools.count is advanced atomically, giving a global log order
+        self._seq = itertools.count()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.llm_batches = 0
+        self.llm_batched_requests = 0
+        self.llm_max_batch_size = 0
+        # Guards the shard registry and the (non hot path) cache/batch counters
+        self._lock = threading.Lock()
     
     def log_action(self, action: AgentAction):
         """Log an agent action"""
-        self.actions.append(action)
-        self.total_cost += action.cost_usd
-        self.total_tokens += action.tokens_used
+        self._shard().add(action, self._seq, self.retain_actions, self.sink)
+        if tracer.enabled:
+            tracer.add_usage(action.tokens_used, action.cost_usd)
+        role = action.agent_role
+        _ACTIONS.inc(role, action.action_type, "true" if action.success else "false")
+        if action.tokens_used:
+            _TOKENS.inc(role, amount=action.tokens_used)
+        if action.cost_usd:
+            _COST.inc(role, amount=action.cost_usd)
+        if action.duration_ms is not None:
+            _ACTION_DURATION.observe(action.duration_ms / 1000, role)
         logger.info(f"Agent action logged: {action.agent_role} - {action.action_type}")
     
+    def _shard(self) -> _AuditShard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            slot = next(self._next_slot) % self.shard_count
+            with self._lock:
+                # Slots are handed out in order, but threads may reach here out of order
+                while len(self._shards) <= slot:
+                    chain = (_HashChain(self.trail_id, len(self._shards), self.checkpoint_every)
+                             if self.tamper_evident else None)
+                    self._shards.append(_AuditShard(self.compact, chain))
+                shard = self._shards[slot]
+            self._local.shard = shard
+        return shard
+    
+    def _merged_counters(self) -> Dict[str, Any]:
+        """Sum every shard's counters (cost is bounded by shard_count, not action count)"""
+        merged: Dict[str, Any] = {
+            "total_actions": 0, "total_cost": 0.0, "total_tokens": 0,
+            "actions_by_agent": {role.value: 0 for role in AgentRole}, "actions_by_type": {},
+            "success_count": 0, "failure_count": 0, "role_latency": {}, "step_latency": {}
+        }
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            with shard.lock:
+                merged["total_actions"] += shard.total_actions
+                merged["total_cost"] += shard.total_cost
+                merged["total_tokens"] += shard.total_tokens
+                merged["success_count"] += shard.success_count
+                merged["failure_count"] += shard.failure_count
+                for key in ("actions_by_agent", "actions_by_type"):
+                    totals = merged[key]
+                    for name, count in getattr(shard, key).items():
+                        totals[name] = totals.get(name, 0) + count
+                for key in ("role_latency", "step_latency"):
+                    sketches = merged[key]
+                    for name, sketch in getattr(shard, key).items():
+                        sketches.setdefault(name, LatencySketch()).merge(sketch)
+        return merged
+    
+    @property
+    def total_actions(self) -> int:
+        return self._merged_counters()["total_actions"]
+    
+    @property
+    def total_cost(self) -> float:
+        return self._merged_counters()["total_cost"]
+    
+    @property
+    def total_tokens(self) -> int:
+        return self._merged_counters()["total_tokens"]
+    
+    @property
+    def actions(self) -> List[AgentAction]:
+        """Snapshot of the retained actions, in logging order"""
+        return list(self._iter_retained())
+    
+    def _snapshot(self) -> tuple[Optional[Dict[str, Any]], List[tuple[_AuditShard, int]]]:
+        """
+        Integrity manifest (None unless tamper-evident) and each shard's
+        retained length, taken together under each shard's lock
+        Shards only ever append, so the lengths bound a stable snapshot that
+        matches the manifest's chains exactly.
+        """
+        with self._lock:
+            shards = list(self._shards)
+        chains = []
+        snapshots = []
+        for shard in shards:
+            with shard.lock:
+                if shard.chain is not None:
+                    chains.append(shard.chain.manifest())
+                snapshots.append((shard, len(shard.seqs)))
+        if not self.tamper_evident:
+            return None, snapshots
+        manifest = {
+            "algorithm": "sha256",
+            "trail_id": self.trail_id,
+            "checkpoint_every": self.checkpoint_every,
+            "root": _manifest_root(chains),
+            "chains": chains
+        }
+        return manifest, snapshots
+    
+    def _iter_retained(self, snapshots: Optional[List[tuple[_AuditShard, int]]] = None) -> Iterator[AgentAction]:
+        if snapshots is None:
+            snapshots = self._snapshot()[1]
+        
+        def ordered(shard_index: int, shard: _AuditShard, length: int):
+            seqs = shard.seqs
+            for i in range(length):
+                yield seqs[i], shard_index, i
+        
+        for _, shard_index, i in heapq.merge(*(ordered(n, shard, length)
+                                               for n, (shard, length) in enumerate(snapshots))):
+            yield snapshots[shard_index][0].actions[i]
+    
+    @classmethod
+    def from_jsonl(cls, filepath: str, retain_actions: bool = False,
+                   compact: bool = False) -> "AuditTrail":
+        """
+        Rebuild an audit trail (and so its summary) from a JSONL audit file
+        Actions are replayed one at a time; by default only totals are kept.
+        """
+        trail = cls(compact=compact)
+        # Replayed actions already live in the file, so nothing is lost by not retaining them
+        trail.retain_actions = retain_actions
+        trail._source = lambda: read_audit_jsonl(filepath)
+        shard = trail._shard()
+        for action in read_audit_jsonl(filepath):
+            shard.add(action, trail._seq, retain_actions)
+        return trail
+    
+    @classmethod
+    def from_segments(cls, directory: str, since: Optional[Any] = None, until: Optional[Any] = None,
+                      retain_actions: bool = False, compact: bool = False) -> "AuditTrail":
+        """
+        Rebuild an audit trail from a RotatingJSONLAuditSink directory
+        Closed segments entirely inside [since, until) contribute their
+        manifest counters without being opened; only segments straddling a
+        boundary (or still open) are replayed. retain_actions replays every
+        overlapping segment so the actions themselves are kept.
+        """
+        since = since.isoformat() if isinstance(since, datetime) else since
+        until = until.isoformat() if isinstance(until, datetime) else until
+        trail = cls(compact=compact)
+        trail.retain_actions = retain_actions
+        trail._source = lambda: read_audit_segments(directory, since, until)
+        shard = trail._shard()
+        for entry in _load_segment_manifest(directory):
+            if not _segment_overlaps(entry, since, until):
+                continue
+            if (entry["closed"] and not retain_actions
+                    and (since is None or entry["first_timestamp"] >= since)
+                    and (until is None or entry["last_timestamp"] < until)):
+                shard.merge_counters(entry["counters"])
+                continue
+            for fields in _parse_audit_lines(_iter_segment_lines(directory, entry), entry["file"]):
+                action = AgentAction(**fields)
+                if (since is None or action.timestamp >= since) and (until is None or action.timestamp < until):
+                    shard.add(action, trail._seq, retain_actions)
+        return trail
+    
+    def iter_actions(self) -> Iterator[AgentAction]:
+        """Iterate over all logged actions, from memory, the sink or a rebuilt trail's source file"""
+        if self.retain_actions:
+            yield from self._iter_retained()
+        elif self.sink is None:
+            if self._source is None:
+                raise ValueError("This AuditTrail neither retains actions nor has a sink to read them from")
+            yield from self._source()
+        else:
+            self.sink.flush()
+            store = self.sink.sink if isinstance(self.sink, BackgroundAuditWriter) else self.sink
+            if isinstance(store, SQLiteAuditStore):
+                yield from store.iter_query()
+            elif isinstance(store, RotatingJSONLAuditSink):
+                yield from store.iter_actions()
+            else:
+                yield from read_audit_jsonl(self.sink.path)
+    
+    def query(self, **filters: Any) -> List[AgentAction]:
+        """
+        Return logged actions matching the SQLiteAuditStore.query filters
+        Runs in SQL when the sink is a SQLiteAuditStore, otherwise filters
+        the actions in Python.
+        """
+        store = self.sink.sink if isinstance(self.sink, BackgroundAuditWriter) else self.sink
+        if isinstance(store, SQLiteAuditStore):
+            self.flush()
+            return store.query(**filters)
+        
+        limit = filters.pop("limit", None)
+        newest_first = filters.pop("newest_first", False)
+        company = filters.pop("company", None)
+        key = normalize_company_name(company) if company is not None else None
+        role = filters.pop("agent_role", None)
+        if isinstance(role, AgentRole):
+            role = role.value
+        action_type = filters.pop("action_type", None)
+        success = filters.pop("success", None)
+        since, until = filters.pop("since", None), filters.pop("until", None)
+        since = since.isoformat() if isinstance(since, datetime) else since
+        until = until.isoformat() if isinstance(until, datetime) else until
+        if filters:
+            raise TypeError(f"Unknown query filters: {', '.join(filters)}")
+        
+        matches = [
+            a for a in self.iter_actions()
+            if (key is None or (isinstance(a.input_data.get("company_name"), str)
+                                and normalize_company_name(a.input_data["company_name"]) == key))
+            and (role is None or a.agent_role == role)
+            and (action_type is None or a.action_type == action_type)
+            and (success is None or a.success == success)
+            and (since is None or a.timestamp >= since)
+            and (until is None or a.timestamp < until)
+        ]
+        matches.sort(key=lambda a: a.timestamp, reverse=newest_first)
+        return matches[:limit] if limit is not None else matches
+    
+    def flush(self):
+        if self.sink is not None:
+            self.sink.flush()
+    
+    def close(self):
+        """Flush and close the sink, if any"""
+        if self.sink is not None:
+            self.sink.close()
+    
+    def integrity_manifest(self) -> Dict[str, Any]:
+        """
+        Chain heads and Merkle checkpoints for every shard
+        "root" commits to every chain head; keeping a copy of it outside the
+        export is what exposes a wholesale rewrite of the file.
+        """
+        if not self.tamper_evident:
+            raise ValueError("integrity_manifest requires an AuditTrail created with tamper_evident=True")
+        return self._snapshot()[0]
+    
+    def record_step_latency(self, step: str, duration_ms: float):
+        """Record how long an orchestrator step (or whole workflow) took"""
+        self._shard().add_step_latency(step, duration_ms)
+        _STEP_DURATION.observe(duration_ms / 1000, step)
+    
+    def step_latency_states(self) -> Dict[str, Dict[str, Any]]:
+        """Step latency sketches in LatencySketch.state() form (see merge_step_latencies)"""
+        return {step: sketch.state() for step, sketch in self._merged_counters()["step_latency"].items()}
+    
+    def merge_step_latencies(self, states: Dict[str, Dict[str, Any]]):
+        """Add step_latency_states() output from another trail (e.g. a worker process's)"""
+        self._shard().merge_step_latencies(states)
+    
+    def record_cache_lookup(self, hit: bool):
+        """Count a workflow result cache lookup"""
+        with self._lock:
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+    
+    def record_llm_batch(self, size: int):
+        """Count one batch dispatched to the LLM backend"""
+        with self._lock:
+            self.llm_batches += 1
+            self.llm_batched_requests += size
+            self.llm_max_batch_size = max(self.llm_max_batch_size, size)
+    
     def get_summary(self) -> Dict[str, Any]:
-        """Get summary of all actions"""
+        """Get summary of all actions (from maintained counters, independent of trail length)"""
+        counters = self._merged_counters()
+        total_actions = counters["total_actions"]
+        success_count = counters["success_count"]
+        with self._lock:
+            cache_hits = self.cache_hits
+            cache_misses = self.cache_misses
+            llm_batches = self.llm_batches
+            llm_batched_requests = self.llm_batched_requests
+            llm_max_batch_size = self.llm_max_batch_size
+        cache_lookups = cache_hits + cache_misses
         return {
-            "total_actions": len(self.actions),
-            "total_cost_usd": round(self.total_cost, 4),
-            "total_tokens": self.total_tokens,
-            "actions_by_agent": {
-                role.value: len([a for a in self.actions if a.agent_role == role.value])
-                for role in AgentRole
-            },
+            "total_actions": total_actions,
+            "total_cost_usd": round(counters["total_cost"], 4),
+            "total_tokens": counters["total_tokens"],
+            "actions_by_agent": counters["actions_by_agent"],
+            "actions_by_type": counters["actions_by_type"],
+            "successful_actions": success_count,
+            "failed_actions": counters["failure_count"],
             "success_rate": round(
-                len([a for a in self.actions if a.success]) / len(self.actions) * 100, 2
-            ) if self.actions else 0
+                success_count / total_actions * 100, 2
+            ) if total_actions else 0,
+            "cache": {
+                "hits": cache_hits,
+                "misses": cache_misses,
+                "hit_rate": round(cache_hits / cache_lookups * 100, 2) if cache_lookups else 0
+            },
+            "llm_batching": {
+                "batches": llm_batches,
+                "requests": llm_batched_requests,
+                "avg_batch_size": round(llm_batched_requests / llm_batches, 2) if llm_batches else 0,
+                "max_batch_size": llm_max_batch_size
+            },
+            "latency_ms": {
+                role: sketch.to_dict() for role, sketch in sorted(counters["role_latency"].items())
+            },
+            "step_latency_ms": {
+                step: sketch.to_dict() for step, sketch in sorted(counters["step_latency"].items())
+            }
         }
     
     def export_to_file(self, filepath: str):
-        """Export audit trail to JSON file"""
-        with open(filepath, 'w') as f:
-            json.dump({
-                "summary": self.get_summary(),
-                "actions": [a.to_dict() for a in self.actions]
-            }, f, indent=2)
+        """
+        Export audit trail to JSON file (with an integrity manifest when tamper-evident)
+        Safe while actions are still being logged: the manifest and the
+        exported actions describe the same moment.
+        """
+        manifest, snapshots = self._snapshot()
+        if self.retain_actions:
+            actions = list(self._iter_retained(snapshots))
+            export: Dict[str, Any] = {"summary": self.get_summary()}
+            if manifest is not None:
+                export["integrity"] = manifest
+            export["actions"] = [a.to_dict() for a in actions]
+            with open(filepath, 'w') as f:
+                json.dump(export, f, indent=2)
+        else:
+            # Stream from the sink so the export never holds every action in memory
+            summary = self.get_summary()
+            with open(filepath, 'w') as f:
+                f.write('{\n  "summary": ')
+                f.write(json.dumps(summary, indent=2).replace("\n", "\n  "))
+                actions = self.iter_actions()
+                if manifest is not None:
+                    f.write(',\n  "integrity": ')
+                    f.write(json.dumps(manifest, indent=2).replace("\n", "\n  "))
+                    actions = self._cut_to_manifest(actions, manifest)
+                f.write(',\n  "actions": [')
+                for i, action in enumerate(actions):
+                    f.write(",\n    " if i else "\n    ")
+                    f.write(json.dumps(action.to_dict(), indent=2).replace("\n", "\n    "))
+                f.write("\n  ]\n}")
+        logger.info(f"Audit trail exported to {filepath}")
+    
+    @staticmethod
+    def _cut_to_manifest(actions: Iterator[AgentAction], manifest: Dict[str, Any]) -> Iterator[AgentAction]:
+        """Only the actions a manifest counts; the sink already had all of them when it was taken"""
+        lengths = {chain["chain"]: chain["length"] for chain in manifest["chains"]}
+        remaining = sum(lengths.values())
+        for action in actions:
+            if not remaining:
+                # Stop reading: the sink may still be growing
+                return
+            link = action.integrity
+            if link:
+                if link["index"] >= lengths.get(link["chain"], 0):
+                    continue
+                remaining -= 1
+            yield action
+    
+    def export_to_jsonl(self, filepath: str):
+        """Export the actions as JSON Lines (readable with read_audit_jsonl or MappedAuditLog)"""
+        # Same line format as JSONLAuditSink
+        with open(filepath, "w", encoding="utf-8") as f:
+            for action in self.iter_actions():
+                f.write(json.dumps(action.to_dict(), ensure_ascii=False) + "\n")
         logger.info(f"Audit trail exported to {filepath}")
 
 
+def _manifest_root(chains: List[Dict[str, Any]]) -> str:
+    heads = b"".join(bytes.fromhex(c["head"]) for c in sorted(chains, key=lambda c: c["chain"]))
+    return hashlib.sha256(b"\x02" + heads).hexdigest()
+
+
+def _verify_chain_segment(trail_id: str, chain_id: int, prev_head: str,
+                          checkpoint: Dict[str, Any], actions: List[AgentAction]) -> List[str]:
+    """Re-hash one checkpointed segment; runs in a worker, independent of other segments"""
+    where = f"chain {chain_id} segment at {checkpoint['start']}"
+    if len(actions) != checkpoint["count"]:
+        return [f"{where}: expected {checkpoint['count']} actions, found {len(actions)}"]
+    errors = []
+    head = bytes.fromhex(prev_head)
+    leaves = []
+    for offset, action in enumerate(actions):
+        index = checkpoint["start"] + offset
+        if action.integrity.get("index") != index:
+            errors.append(f"{where}: expected index {index}, found {action.integrity.get('index')}")
+            return errors
+        leaf = _action_digest(action)
+        head = hashlib.sha256(head + leaf).digest()
+        leaves.append(leaf)
+        if action.integrity.get("hash") != head.hex():
+            errors.append(f"chain {chain_id} action {index}: hash mismatch (content or order altered)")
+            return errors
+    if head.hex() != checkpoint["head"]:
+        errors.append(f"{where}: chain head does not match the checkpoint")
+    if _merkle_root(leaves).hex() != checkpoint["merkle_root"]:
+        errors.append(f"{where}: Merkle root does not match the checkpoint")
+    return errors
+
+
+def verify_audit_actions(actions: Any, manifest: Dict[str, Any], max_workers: Optional[int] = None,
+                         executor: str = "process", expected_root: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Verify actions (AgentActions or their dicts, in any interleaving of
+    chains) against an integrity manifest
+    Each checkpointed segment starts from the previous checkpoint's head, so
+    segments are re-hashed in parallel on a process (or thread) pool as soon
+    as they are complete; at most a few segments per worker are queued, so
+    actions can be streamed in from a file of any size. Pass expected_root, kept apart from the export,
+    to also rule out a rewritten manifest.
+    """
+    if executor not in ("thread", "process"):
+        raise ValueError(f"Unknown executor: {executor!r} (expected 'thread' or 'process')")
+    errors: List[str] = []
+    trail_id = manifest["trail_id"]
+    every = manifest["checkpoint_every"]
+    chains = {c["chain"]: c for c in manifest["chains"]}
+    
+    # Manifest consistency: checkpoint heads chain into each other and end at the chain head
+    for chain_id, chain in chains.items():
+        checkpoints = chain["checkpoints"]
+        expected_starts = list(range(0, chain["length"], every))
+        if [c["start"] for c in checkpoints] != expected_starts:
+            errors.append(f"chain {chain_id}: checkpoints do not cover its {chain['length']} actions")
+        last_head = checkpoints[-1]["head"] if checkpoints else _chain_genesis(trail_id, chain_id).hex()
+        if last_head != chain["head"]:
+            errors.append(f"chain {chain_id}: last checkpoint does not end at the chain head")
+    root = _manifest_root(manifest["chains"])
+    if root != manifest["root"]:
+        errors.append("manifest root does not match its chain heads")
+    if expected_root is not None and root != expected_root:
+        errors.append("manifest root does not match the expected root")
+    
+    pending: Dict[tuple, List[AgentAction]] = {}
+    futures: deque = deque()
+    submitted = set()
+    actions_checked = 0
+    max_queued = 2 * (max_workers or os.cpu_count() or 1)
+    pool_cls = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    with pool_cls(max_workers=max_workers) as pool:
+        def submit(key: tuple, segment: List[AgentAction]):
+            chain_id, number = key
+            checkpoints = chains[chain_id]["checkpoints"]
+            if number >= len(checkpoints):
+                errors.append(f"chain {chain_id}: actions beyond the last checkpoint")
+                return
+            prev_head = (checkpoints[number - 1]["head"] if number
+                         else _chain_genesis(trail_id, chain_id).hex())
+            submitted.add(key)
+            if len(futures) >= max_queued:
+                # Backpressure: hold the reader back until a worker frees up
+                errors.extend(futures.popleft().result())
+            futures.append(pool.submit(_verify_chain_segment, trail_id, chain_id, prev_head,
+                                       checkpoints[number], segment))
+        
+        for action in actions:
+            if isinstance(action, dict):
+                action = AgentAction(**action)
+            actions_checked += 1
+            link = action.integrity
+            if not link or link.get("chain") not in chains or not isinstance(link.get("index"), int):
+                errors.append(f"action at {action.timestamp} has no valid integrity link")
+                continue
+            key = (link["chain"], link["index"] // every)
+            segment = pending.setdefault(key, [])
+            segment.append(action)
+            if len(segment) == every:
+                submit(key, pending.pop(key))
+        # Incomplete segments (the open tail of each chain, or ones missing actions)
+        for key, segment in pending.items():
+            submit(key, segment)
+        for future in futures:
+            errors.extend(future.result())
+    
+    for chain_id, chain in chains.items():
+        for number in range(len(chain["checkpoints"])):
+            if (chain_id, number) not in submitted:
+                errors.append(f"chain {chain_id} segment at {number * every}: actions missing")
+    return {
+        "valid": not errors,
+        "actions_checked": actions_checked,
+        "segments_checked": len(submitted),
+        "chains": len(chains),
+        "root": root,
+        "errors": errors
+    }
+
+
+class _JSONStreamReader:
+    """Reads the values of one large JSON document piece by piece from a text file"""
+    
+    def __init__(self, f: Any, chunk_size: int = 1 << 20):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+    
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        data = self._f.read(self._chunk_size)
+        if not data:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
+    
+    def peek(self) -> str:
+        """Next non-whitespace character ('' at end of input)"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+    
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", self._buffer, self._pos)
+        self._pos += 1
+    
+    def value(self) -> Any:
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def _stream_audit_export(f: Any, chunk_size: int = 1 << 20
+                         ) -> tuple[Optional[Dict[str, Any]], Iterator[Dict[str, Any]]]:
+    """
+    Incrementally parse an AuditTrail.export_to_file export
+    Returns the integrity manifest (None if the export has none before its
+    actions) and an iterator over the action dicts, read as it is consumed.
+    """
+    reader = _JSONStreamReader(f, chunk_size)
+    reader.expect("{")
+    manifest = None
+    has_actions = False
+    while reader.peek() != "}":
+        key = reader.value()
+        reader.expect(":")
+        if key == "actions":
+            has_actions = True
+            break
+        value = reader.value()
+        if key == "integrity":
+            manifest = value
+        if reader.peek() == ",":
+            reader.expect(",")
+    
+    def actions() -> Iterator[Dict[str, Any]]:
+        if not has_actions:
+            return
+        reader.expect("[")
+        if reader.peek() == "]":
+            return
+        while True:
+            yield reader.value()
+            if reader.peek() == "]":
+                return
+            reader.expect(",")
+    
+    return manifest, actions()
+
+
+def verify_audit_export(filepath: str, max_workers: Optional[int] = None, executor: str = "process",
+                        expected_root: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Verify a tamper-evident AuditTrail.export_to_file export (see verify_audit_actions)
+    The export is parsed incrementally, so memory stays flat however many
+    actions it holds.
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        manifest, actions = _stream_audit_export(f)
+        if manifest is None:
+            raise ValueError(f"{filepath} has no integrity manifest (export from a tamper_evident AuditTrail)")
+        return verify_audit_actions(actions, manifest, max_workers, executor, expected_root)
+
+
+@dataclass(frozen=True)
+class PhraseMatch:
+    """One phrase occurrence found by PhraseMatcher"""
+    phrase: str
+    category: str
+    start: int  # offset into the scanned text
+    end: int
+
+
+def _lower_keeping_offsets(text: str) -> str:
+    """Lowercase text so every character keeps its offset"""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # A few characters change length when lowercased; lower per character instead
+        lowered = "".join(ch.lower()[:1] or ch for ch in text)
+    return lowered
+
+
+class PhraseMatcher:
+    """
+    Case-insensitive multi-phrase search
+    Finds every occurrence of every phrase, overlapping ones included. Small
+    phrase sets (like the compliance lists) are scanned with one str.find
+    per phrase, which runs in C; from AUTOMATON_MIN_PHRASES phrases on, an
+    Aho–Corasick automaton scans the text once however many phrases there are.
+    """
+    
+    # Measured break-even between per-phrase str.find and the pure-Python automaton
+    AUTOMATON_MIN_PHRASES = 500
+    
+    def __init__(self, phrases: Dict[str, List[str]], automaton: Optional[bool] = None):
+        """
+        phrases: category -> phrases in that category
+        automaton: force (True) or rule out (False) the Aho–Corasick scan
+        """
+        # (lowered phrase, phrase, category), in insertion order
+        self._keys: List[tuple[str, str, str]] = [
+            (phrase.lower(), phrase, category)
+            for category, category_phrases in phrases.items()
+            for phrase in category_phrases if phrase
+        ]
+        self._max_length = max((len(key) for key, _, _ in self._keys), default=0)
+        self.uses_automaton = (len(self._keys) >= self.AUTOMATON_MIN_PHRASES
+                               if automaton is None else automaton)
+        if self.uses_automaton:
+            self._build_automaton()
+    
+    def _build_automaton(self):
+        # Node 0 is the root; each node maps a character to its child node
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # (phrase, category, length) tuples ending at each node, incl. via fail links
+        self._out: List[List[tuple[str, str, int]]] = [[]]
+        
+        for key, phrase, category in self._keys:
+            node = 0
+            for ch in key:
+                child = self._goto[node].get(ch)
+                if child is None:
+                    child = len(self._goto)
+                    self._goto[node][ch] = child
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = child
+            self._out[node].append((phrase, category, len(key)))
+        
+        # Breadth-first pass sets fail links and merges suffix outputs
+        pending = list(self._goto[0].values())
+        while pending:
+            next_level = []
+            for node in pending:
+                for ch, child in self._goto[node].items():
+                    fail = self._fail[node]
+                    while fail and ch not in self._goto[fail]:
+                        fail = self._fail[fail]
+                    target = self._goto[fail].get(ch, 0)
+                    self._fail[child] = target if target != child else 0
+                    if self._out[self._fail[child]]:
+                        self._out[child] = self._out[child] + self._out[self._fail[child]]
+                    next_level.append(child)
+            pending = next_level
+    
+    def find_all(self, text: str) -> List[PhraseMatch]:
+        """Return every phrase occurrence in text, ordered by end offset (longest first on ties)"""
+        matches, _ = self._scan(text, None, 0)
+        return matches
+    
+    def stream(self) -> "PhraseStream":
+        """Start an incremental scan over text that arrives in chunks"""
+        return PhraseStream(self)
+    
+    def _scan(self, text: str, state: Any, base_offset: int) -> tuple[List[PhraseMatch], Any]:
+        """
+        Scan text that starts at base_offset in the stream
+        state carries over from the previous chunk (None at the start); returns
+        (matches, state): the automaton node, or the tail a phrase could still
+        complete from.
+        """
+        lowered = _lower_keeping_offsets(text)
+        if self.uses_automaton:
+            return self._scan_automaton(lowered, state or 0, base_offset)
+        
+        # Phrases may straddle chunks, so search the previous chunk's tail as well
+        tail = state or ""
+        window = tail + lowered
+        origin = base_offset - len(tail)
+        found = []
+        for order, (key, phrase, category) in enumerate(self._keys):
+            start = window.find(key)
+            while start != -1:
+                end = start + len(key)
+                # Matches ending inside the tail were reported with the previous chunk
+                if end > len(tail):
+                    found.append((end, -len(key), order, phrase, category))
+                start = window.find(key, start + 1)
+        found.sort()
+        matches = [PhraseMatch(phrase, category, origin + end + negative_length, origin + end)
+                   for end, negative_length, _, phrase, category in found]
+        keep = self._max_length - 1
+        return matches, window[-keep:] if keep > 0 else ""
+    
+    def _scan_automaton(self, lowered: str, node: int, base_offset: int) -> tuple[List[PhraseMatch], int]:
+        goto, fail, out = self._goto, self._fail, self._out
+        matches: List[PhraseMatch] = []
+        for i, ch in enumerate(lowered, base_offset + 1):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for phrase, category, length in out[node]:
+                    matches.append(PhraseMatch(phrase, category, i - length, i))
+        return matches, node
+
+
+class PhraseStream:
+    """
+    Incremental PhraseMatcher scan
+    Scan state carries over between chunks, so phrases split across a chunk
+    boundary are still found; offsets are relative to the whole stream.
+    """
+    
+    def __init__(self, matcher: PhraseMatcher):
+        self._matcher = matcher
+        self._state: Any = None
+        self.offset = 0
+    
+    def feed(self, chunk: str) -> List[PhraseMatch]:
+        """Scan the next chunk and return the phrases completed inside it"""
+        matches, self._state = self._matcher._scan(chunk, self._state, self.offset)
+        self.offset += len(chunk)
+        return matches
+
+
 class ComplianceCheck:
     """Handles compliance validation for agent outputs"""
     
@@ -93,23 +3012,61 @@ class ComplianceCheck:
         "guaranteed returns", "risk-free investment"
     ]
     
+    # Phrases that suggest the output gives financial advice
+    ADVICE_INDICATORS = ["you should", "i recommend", "best investment"]
+    
+    # Phrases that count as a disclaimer for advice-like content
+    DISCLAIMER_PHRASES = ["not financial advice", "for informational purposes"]
+    
+    _matcher: Optional[PhraseMatcher] = None
+    _matcher_key: Optional[tuple] = None
+    _matcher_lock = threading.Lock()
+    
+    @classmethod
+    def get_matcher(cls) -> PhraseMatcher:
+        """Return the compiled matcher, rebuilding it if the phrase lists changed"""
+        key = (tuple(cls.RESTRICTED_KEYWORDS), tuple(cls.ADVICE_INDICATORS),
+               tuple(cls.DISCLAIMER_PHRASES))
+        matcher = cls._matcher
+        if matcher is None or cls._matcher_key != key:
+            with cls._matcher_lock:
+                if cls._matcher is None or cls._matcher_key != key:
+                    cls._matcher = PhraseMatcher({
+                        "restricted": list(key[0]),
+                        "advice": list(key[1]),
+                        "disclaimer": list(key[2])
+                    })
+                    cls._matcher_key = key
+                matcher = cls._matcher
+        return matcher
+    
+    @staticmethod
+    def find_matches(output: str) -> List[PhraseMatch]:
+        """Find every restricted, advice and disclaimer phrase in output with its offset"""
+        return ComplianceCheck.get_matcher().find_all(output)
+    
     @staticmethod
     def validate_output(output: str) -> tuple[bool, Optional[str]]:
         """
         Validate agent output for compliance
         Returns: (is_compliant, risk_message)
         """
-        output_lower = output.lower()
+        matches = ComplianceCheck.find_matches(output)
+        return ComplianceCheck.evaluate_matches(matches)
+    
+    @staticmethod
+    def evaluate_matches(matches: List[PhraseMatch]) -> tuple[bool, Optional[str]]:
+        """Turn phrase matches into a compliance verdict: (is_compliant, risk_message)"""
+        restricted = {m.phrase for m in matches if m.category == "restricted"}
         
-        # Check for restricted keywords
+        # Check for restricted keywords (reported in list order)
         for keyword in ComplianceCheck.RESTRICTED_KEYWORDS:
-            if keyword in output_lower:
+            if keyword in restricted:
                 return False, f"Output contains restricted keyword: '{keyword}'"
         
         # Check for potential financial advice (without disclaimers)
-        advice_indicators = ["you should", "i recommend", "best investment"]
-        has_advice = any(ind in output_lower for ind in advice_indicators)
-        has_disclaimer = "not financial advice" in output_lower or "for informational purposes" in output_lower
+        has_advice = any(m.category == "advice" for m in matches)
+        has_disclaimer = any(m.category == "disclaimer" for m in matches)
         
         if has_advice and not has_disclaimer:
             return False, "Output appears to provide financial advice without disclaimer"
@@ -123,8 +3080,162 @@ class ComplianceCheck:
         return output + disclaimer
 
 
+class StreamingComplianceCheck:
+    """
+    Compliance scanner for text that is still being generated
+    Feed it output chunks as they arrive. A restricted keyword is a violation
+    no matter what follows, so the scanner sets stop_event as soon as one
+    appears and the producing agent can abandon the generation. The advice
+    vs. disclaimer rule can only be settled once the text is complete; see
+    finish().
+    """
+    
+    def __init__(self):
+        self._stream = ComplianceCheck.get_matcher().stream()
+        self.matches: List[PhraseMatch] = []
+        self.violation: Optional[str] = None
+        self.stop_event = threading.Event()
+    
+    @property
+    def should_stop(self) -> bool:
+        return self.stop_event.is_set()
+    
+    def feed(self, chunk: str) -> bool:
+        """Scan a chunk; returns False once generation should stop"""
+        found = self._stream.feed(chunk)
+        if found:
+            self.matches.extend(found)
+            if self.violation is None:
+                restricted = next((m for m in found if m.category == "restricted"), None)
+                if restricted is not None:
+                    self.violation = f"Output contains restricted keyword: '{restricted.phrase}'"
+                    self.stop_event.set()
+        return self.violation is None
+    
+    def finish(self) -> tuple[bool, Optional[str]]:
+        """
+        Final verdict for everything fed so far
+        Returns: (is_compliant, risk_message)
+        """
+        if self.violation is not None:
+            return False, self.violation
+        return ComplianceCheck.evaluate_matches(self.matches)
+
+
+@dataclass(frozen=True)
+class LLMRequest:
+    """Prompt inputs for a single LLM generation"""
+    task: str  # "research" or "analysis"
+    company_name: str
+    context: Optional[str] = None  # research summary fed to analysis
+    
+    @classmethod
+    def for_research(cls, company_name: str) -> "LLMRequest":
+        return cls("research", company_name)
+    
+    @classmethod
+    def for_analysis(cls, company_name: str, research: str) -> "LLMRequest":
+        return cls("analysis", company_name, research)
+    
+    def inputs(self) -> List[str]:
+        """Prompt inputs in a stable order (used for cache keys)"""
+        return [self.company_name] if self.context is None else [self.company_name, self.context]
+
+
+@runtime_checkable
+class LLMBackend(Protocol):
+    """
+    Interface every LLM backend implements
+    generate_batch must return responses in request order; batch submission
+    is how inference gateways reach acceptable throughput. Backends should
+    also expose a model_id naming the model that produced the responses;
+    the response cache keys on it (see llm_backend_id).
+    """
+    
+    def generate(self, request: LLMRequest) -> str: ...
+    
+    def generate_batch(self, requests: List[LLMRequest]) -> List[str]: ...
+    
+    async def agenerate(self, request: LLMRequest) -> str: ...
+    
+    async def agenerate_batch(self, requests: List[LLMRequest]) -> List[str]: ...
+
+
+@runtime_checkable
+class StreamingLLMBackend(Protocol):
+    """Optional interface for backends that can stream output in chunks"""
+    
+    def generate_stream(self, request: LLMRequest) -> Iterator[str]: ...
+
+
+class LLMBackendError(RuntimeError):
+    """An LLM backend call failed (simulated by MockLLM's error_rate)"""
+
+
+@dataclass(frozen=True)
+class LatencyModel:
+    """
+    Distribution of simulated LLM call latency, in seconds
+    kind "fixed" always takes `seconds`; "lognormal" has median `seconds`
+    and shape `sigma`; "pareto" (heavy tail) never goes below `seconds` and
+    has tail index `alpha` (lower = heavier). max_seconds caps any draw.
+    """
+    kind: str = "fixed"
+    seconds: float = 0.0
+    sigma: float = 0.5
+    alpha: float = 1.5
+    max_seconds: Optional[float] = None
+    
+    def __post_init__(self):
+        if self.kind not in ("fixed", "lognormal", "pareto"):
+            raise ValueError(f"Unknown latency kind: {self.kind!r} (expected 'fixed', 'lognormal' or 'pareto')")
+        if self.seconds < 0:
+            raise ValueError("seconds must not be negative")
+    
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyModel":
+        """Build from "fixed:0.2", "lognormal:0.8,0.5" or "pareto:0.3,1.2" (kind:seconds[,shape])"""
+        kind, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v]
+        if not values:
+            raise ValueError(f"Latency spec needs at least a seconds value: {spec!r}")
+        if kind == "lognormal" and len(values) > 1:
+            return cls(kind, values[0], sigma=values[1])
+        if kind == "pareto" and len(values) > 1:
+            return cls(kind, values[0], alpha=values[1])
+        return cls(kind, values[0])
+    
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "lognormal":
+            value = self.seconds * math.exp(rng.gauss(0.0, self.sigma))
+        elif self.kind == "pareto":
+            value = self.seconds * rng.paretovariate(self.alpha)
+        else:
+            value = self.seconds
+        return min(value, self.max_seconds) if self.max_seconds is not None else value
+
+
 class MockLLM:
-    """Mock LLM for demo purposes"""
+    """
+    Mock LLM for demo purposes (reference LLMBackend implementation)
+    By default it answers instantly. Give it a LatencyModel, an error_rate
+    and/or a timeout to see how the agents behave behind a realistic backend:
+    each call (or batch) sleeps for a sampled latency, calls slower than
+    timeout raise TimeoutError after `timeout` seconds, and error_rate of
+    the calls raise LLMBackendError.
+    """
+    
+    def __init__(self, latency: Optional[LatencyModel] = None, error_rate: float = 0.0,
+                 timeout: Optional[float] = None, seed: Optional[int] = None):
+        if not 0.0 <= error_rate <= 1.0:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout = timeout
+        self._rng = random.Random(seed)
+    
+    # Latency, errors and timeouts never change the text, so every MockLLM shares one id
+    model_id = "mock"
     
     @staticmethod
     def generate_research(company_name: str) -> str:
@@ -152,137 +3263,813 @@ Market Position:
 """
     
     @staticmethod
-    def generate_analysis(company_name: str, research: str) -> str:
-        """Generate simulated financial analysis"""
-        return f"""
-INVESTMENT ANALYSIS: {company_name}
+    def generate_analysis(company_name: str, research: str) -> str:
+        """Generate simulated financial analysis"""
+        return f"""
+INVESTMENT ANALYSIS: {company_name}
+
+Key Strengths:
+1. Strong Market Position: Leading player with established brand and customer base
+2. Revenue Growth: Consistent double-digit growth trajectory
+3. Financial Health: Strong balance sheet with healthy cash reserves
+4. Innovation Pipeline: Continued investment in R&D and new products
+
+Key Risks:
+1. Market Competition: Intensifying competition from new entrants
+2. Economic Sensitivity: Performance tied to broader economic conditions
+3. Regulatory Environment: Potential regulatory changes could impact operations
+4. Operational Complexity: Scale brings increased complexity in management
+
+Market Opportunities:
+- Expansion into emerging markets
+- Digital transformation initiatives
+- Strategic acquisitions in adjacent markets
+- Product line extensions
+
+Threats:
+- Disruptive technologies from competitors
+- Economic downturn risks
+- Supply chain vulnerabilities
+- Changing consumer preferences
+
+Investment Considerations:
+Based on the available information, {company_name} demonstrates several positive indicators including strong financial performance, market leadership, and growth trajectory. However, investors should carefully consider the identified risks and conduct thorough due diligence. Diversification remains important, and this analysis should be one input among many in investment decision-making.
+
+Note: This analysis is based on publicly available information and should not be the sole basis for investment decisions.
+"""
+    
+    def generate(self, request: LLMRequest) -> str:
+        """Generate a response for one request"""
+        delay, error = self._simulate_call()
+        if delay:
+            _clock.sleep(delay)
+        if error is not None:
+            raise error
+        return self._respond(request)
+    
+    def generate_batch(self, requests: List[LLMRequest]) -> List[str]:
+        """Generate responses for a batch of requests, in order (one simulated call)"""
+        delay, error = self._simulate_call()
+        if delay:
+            _clock.sleep(delay)
+        if error is not None:
+            raise error
+        return [self._respond(request) for request in requests]
+    
+    async def agenerate(self, request: LLMRequest) -> str:
+        """Async variant of generate"""
+        delay, error = self._simulate_call()
+        if delay:
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._respond(request)
+    
+    async def agenerate_batch(self, requests: List[LLMRequest]) -> List[str]:
+        """Async variant of generate_batch"""
+        delay, error = self._simulate_call()
+        if delay:
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return [self._respond(request) for request in requests]
+    
+    def generate_stream(self, request: LLMRequest, chunk_chars: int = 64) -> Iterator[str]:
+        """Yield the response in chunks, as a streaming backend would (latency spread over the chunks)"""
+        delay, error = self._simulate_call()
+        output = self._respond(request)
+        chunks = [output[start:start + chunk_chars] for start in range(0, len(output), chunk_chars)]
+        for i, chunk in enumerate(chunks):
+            if delay:
+                _clock.sleep(delay / len(chunks))
+            if error is not None and i == len(chunks) - 1:
+                # Failures surface mid-stream, after the output so far was delivered
+                raise error
+            yield chunk
+    
+    def _respond(self, request: LLMRequest) -> str:
+        if request.task == "research":
+            return self.generate_research(request.company_name)
+        if request.task == "analysis":
+            return self.generate_analysis(request.company_name, request.context or "")
+        raise ValueError(f"Unknown LLM task: {request.task!r}")
+    
+    def _simulate_call(self) -> tuple[float, Optional[Exception]]:
+        """Latency of one simulated call and the error it ends with, if any"""
+        delay = self.latency.sample(self._rng) if self.latency is not None else 0.0
+        if self.timeout is not None and delay > self.timeout:
+            return self.timeout, TimeoutError(f"Simulated LLM call timed out after {self.timeout}s")
+        if self.error_rate and self._rng.random() < self.error_rate:
+            return delay, LLMBackendError("Simulated LLM backend error")
+        return delay, None
+
+
+def llm_backend_id(llm: Any) -> str:
+    """Identity of the model behind an LLM backend, for cache keys"""
+    model_id = getattr(llm, "model_id", None)
+    if model_id:
+        return str(model_id)
+    # Fall back to the class and its public config so distinct backends never share keys
+    config = {k: repr(v) for k, v in sorted(vars(llm).items()) if not k.startswith("_")}
+    return f"{type(llm).__module__}.{type(llm).__qualname__}:{json.dumps(config)}"
+
+
+class CachedResponse(str):
+    """LLM response served from the response cache (no tokens were spent)"""
+    cached = True
+
+
+class LLMResponseCache:
+    """
+    Persistent on-disk cache of LLM responses, backed by SQLite
+    Keys are a hash of the backend's model id and the prompt inputs, so
+    responses from different models never collide. The database runs in
+    WAL mode so several worker processes can read and write it concurrently;
+    once the stored responses exceed max_bytes the least recently used are
+    evicted.
+    Access times are only refreshed once they are touch_interval_seconds
+    old, so a hit is normally a pure read and hits from many processes do
+    not queue on the write lock; LRU order is accurate to that interval.
+    """
+    
+    def __init__(self, path: str = "llm_cache.sqlite3", max_bytes: int = 512 * 1024 * 1024,
+                 touch_interval_seconds: float = 60.0):
+        if max_bytes < 1:
+            raise ValueError("max_bytes must be at least 1")
+        if touch_interval_seconds < 0:
+            raise ValueError("touch_interval_seconds must not be negative")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_interval_seconds = touch_interval_seconds
+        # sqlite3 connections must not be shared between threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._init_schema()
+    
+    @staticmethod
+    def make_key(task: str, *inputs: str, model: str) -> str:
+        """Hash the model id and prompt inputs into a cache key"""
+        payload = json.dumps([model, task, *inputs], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss"""
+        conn = self._connect()
+        row = conn.execute("SELECT response, last_access FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            now = time.time()
+            if now - row[1] >= self.touch_interval_seconds:
+                # The guard skips the write if another process touched it meanwhile
+                with conn:
+                    conn.execute("UPDATE responses SET last_access = ? WHERE key = ? AND last_access <= ?",
+                                 (now, key, now - self.touch_interval_seconds))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        _CACHE_LOOKUPS.inc("llm", "miss" if row is None else "hit")
+        return row[0] if row is not None else None
+    
+    def put(self, key: str, response: str):
+        """Store a response, evicting least recently used entries past max_bytes"""
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        conn = self._connect()
+        now = time.time()
+        evicted = 0
+        with conn:
+            # IMMEDIATE takes the write lock up front so concurrent writers queue on busy_timeout
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.execute(
+                "INSERT INTO responses (key, response, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            total = conn.execute("SELECT total_bytes FROM cache_meta").fetchone()[0]
+            while total > self.max_bytes:
+                oldest = conn.execute(
+                    "SELECT key, size FROM responses ORDER BY last_access LIMIT 64"
+                ).fetchall()
+                for old_key, old_size in oldest:
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total -= old_size
+                    evicted += 1
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+    
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM responses")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache occupancy (shared on disk) and hit/miss counters (this process)"""
+        entries, total_bytes = self._connect().execute(
+            "SELECT (SELECT COUNT(*) FROM responses), total_bytes FROM cache_meta"
+        ).fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions
+            }
+    
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly where needed
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+    
+    def _init_schema(self):
+        conn = self._connect()
+        conn.executescript("""
+            BEGIN IMMEDIATE;
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access);
+            CREATE TABLE IF NOT EXISTS cache_meta (total_bytes INTEGER NOT NULL);
+            INSERT INTO cache_meta (total_bytes)
+                SELECT COALESCE((SELECT SUM(size) FROM responses), 0)
+                WHERE NOT EXISTS (SELECT 1 FROM cache_meta);
+            CREATE TRIGGER IF NOT EXISTS responses_size_insert AFTER INSERT ON responses
+                BEGIN UPDATE cache_meta SET total_bytes = total_bytes + NEW.size; END;
+            CREATE TRIGGER IF NOT EXISTS responses_size_delete AFTER DELETE ON responses
+                BEGIN UPDATE cache_meta SET total_bytes = total_bytes - OLD.size; END;
+            COMMIT;
+        """)
+
+
+class CachingLLM:
+    """LLMBackend wrapper that serves responses from an LLMResponseCache when possible"""
+    
+    def __init__(self, llm: LLMBackend, cache: LLMResponseCache):
+        self.llm = llm
+        self.cache = cache
+        self.model_id = llm_backend_id(llm)
+    
+    def generate(self, request: LLMRequest) -> str:
+        return self.generate_batch([request])[0]
+    
+    def generate_batch(self, requests: List[LLMRequest]) -> List[str]:
+        keys, outputs, misses = self._lookup(requests)
+        if misses:
+            # Only the misses are sent to the backend, still as a single batch
+            generated = self.llm.generate_batch([requests[i] for i in misses])
+            self._store(keys, outputs, misses, generated)
+        return outputs
+    
+    async def agenerate(self, request: LLMRequest) -> str:
+        return (await self.agenerate_batch([request]))[0]
+    
+    async def agenerate_batch(self, requests: List[LLMRequest]) -> List[str]:
+        # SQLite calls can wait up to the busy timeout on another writer, so they run off the loop
+        keys, outputs, misses = await asyncio.to_thread(self._lookup, requests)
+        if misses:
+            generated = await self.llm.agenerate_batch([requests[i] for i in misses])
+            await asyncio.to_thread(self._store, keys, outputs, misses, generated)
+        return outputs
+    
+    def _lookup(self, requests: List[LLMRequest]) -> tuple[List[str], List[Any], List[int]]:
+        keys = [self.cache.make_key(r.task, *r.inputs(), model=self.model_id) for r in requests]
+        outputs: List[Any] = []
+        misses: List[int] = []
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is None:
+                misses.append(i)
+            outputs.append(CachedResponse(cached) if cached is not None else None)
+        return keys, outputs, misses
+    
+    def _store(self, keys: List[str], outputs: List[Any], misses: List[int], generated: List[str]):
+        for i, output in zip(misses, generated):
+            self.cache.put(keys[i], output)
+            outputs[i] = output
+
+
+class MicroBatchingLLM:
+    """
+    LLMBackend wrapper that coalesces concurrent single prompts into batches
+    Prompts are collected until max_batch_size are waiting or the oldest has
+    waited max_wait_ms, then dispatched with one generate_batch call and the
+    responses routed back to each caller. Thread callers are served by a
+    background dispatcher; coroutine callers are batched on their event loop.
+    """
+    
+    def __init__(self, llm: LLMBackend, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 max_concurrent_batches: int = 4, audit_trail: Optional[AuditTrail] = None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must not be negative")
+        self.llm = llm
+        self.model_id = llm_backend_id(llm)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.audit_trail = audit_trail
+        self._cond = threading.Condition()
+        # (request, future, enqueued_at), oldest first
+        self._pending: List[tuple[LLMRequest, Future, float]] = []
+        self._dispatcher: Optional[threading.Thread] = None
+        self._batch_pool = ThreadPoolExecutor(max_workers=max_concurrent_batches,
+                                              thread_name_prefix="llm-batch")
+        self._closed = False
+        self._async_pending: List[tuple[LLMRequest, asyncio.Future]] = []
+        self._async_timer: Optional[asyncio.TimerHandle] = None
+        self._async_tasks: set = set()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.max_observed_batch = 0
+    
+    def generate(self, request: LLMRequest) -> str:
+        """Queue one prompt and block until its batch has been answered"""
+        future: Future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("MicroBatchingLLM is closed")
+            self._pending.append((request, future, time.monotonic()))
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True,
+                                                    name="llm-micro-batcher")
+                self._dispatcher.start()
+            self._cond.notify()
+        return future.result()
+    
+    def generate_batch(self, requests: List[LLMRequest]) -> List[str]:
+        """Already-batched prompts bypass the collector"""
+        self._record_batch(len(requests))
+        return self.llm.generate_batch(requests)
+    
+    async def agenerate(self, request: LLMRequest) -> str:
+        """Queue one prompt on the running loop and await its batch"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._async_pending.append((request, future))
+        if len(self._async_pending) >= self.max_batch_size:
+            self._flush_async()
+        elif self._async_timer is None:
+            self._async_timer = loop.call_later(self.max_wait, self._flush_async)
+        return await future
+    
+    async def agenerate_batch(self, requests: List[LLMRequest]) -> List[str]:
+        self._record_batch(len(requests))
+        return await self.llm.agenerate_batch(requests)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+                "max_observed_batch_size": self.max_observed_batch
+            }
+    
+    def close(self):
+        """Dispatch anything still queued, then stop the background dispatcher"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.join()
+        self._batch_pool.shutdown(wait=True)
+    
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                # Wait for a full batch, but no longer than max_wait past the oldest prompt
+                deadline = self._pending[0][2] + self.max_wait
+                while len(self._pending) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+            self._batch_pool.submit(self._run_batch, batch)
+    
+    def _run_batch(self, batch: List[tuple[LLMRequest, Future, float]]):
+        futures = [future for _, future, _ in batch]
+        try:
+            self._record_batch(len(batch))
+            self._deliver(futures, self.llm.generate_batch([request for request, _, _ in batch]))
+        except BaseException as e:
+            self._fail_pending(futures, e)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            # Every caller is blocked on its future; none may be left unresolved
+            self._fail_pending(futures, LLMBackendError("LLM batch finished without a response"))
+    
+    def _flush_async(self):
+        if self._async_timer is not None:
+            self._async_timer.cancel()
+            self._async_timer = None
+        batch, self._async_pending = self._async_pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run_async_batch(batch))
+            # Keep a reference so the task is not garbage collected mid-flight
+            self._async_tasks.add(task)
+            task.add_done_callback(self._async_tasks.discard)
+    
+    async def _run_async_batch(self, batch: List[tuple[LLMRequest, asyncio.Future]]):
+        futures = [future for _, future in batch]
+        try:
+            self._record_batch(len(batch))
+            self._deliver(futures, await self.llm.agenerate_batch([request for request, _ in batch]))
+        except BaseException as e:
+            self._fail_pending(futures, e)
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self._fail_pending(futures, LLMBackendError("LLM batch finished without a response"))
+    
+    @staticmethod
+    def _deliver(futures: List[Any], outputs: List[str]):
+        """Resolve each caller's future with its response"""
+        if len(outputs) != len(futures):
+            raise LLMBackendError(f"Backend returned {len(outputs)} responses for {len(futures)} prompts")
+        for future, output in zip(futures, outputs):
+            if not future.done():
+                future.set_result(output)
+    
+    @staticmethod
+    def _fail_pending(futures: List[Any], error: BaseException):
+        """Fail (or, for a cancelled batch, cancel) every future not yet resolved"""
+        for future in futures:
+            if future.done():
+                continue
+            if isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+    
+    def _record_batch(self, size: int):
+        with self._stats_lock:
+            self.batches += 1
+            self.requests += size
+            self.max_observed_batch = max(self.max_observed_batch, size)
+        if self.audit_trail is not None:
+            self.audit_trail.record_llm_batch(size)
 
-Key Strengths:
-1. Strong Market Position: Leading player with established brand and customer base
-2. Revenue Growth: Consistent double-digit growth trajectory
-3. Financial Health: Strong balance sheet with healthy cash reserves
-4. Innovation Pipeline: Continued investment in R&D and new products
 
-Key Risks:
-1. Market Competition: Intensifying competition from new entrants
-2. Economic Sensitivity: Performance tied to broader economic conditions
-3. Regulatory Environment: Potential regulatory changes could impact operations
-4. Operational Complexity: Scale brings increased complexity in management
+def _generate_streamed(llm: LLMBackend, request: LLMRequest,
+                       scanner: StreamingComplianceCheck) -> tuple[str, bool]:
+    """
+    Generate a response while feeding it to a streaming compliance scanner
+    Returns (text generated, completed); completed is False when the scanner
+    stopped the generation early. Backends without streaming support are
+    scanned once their full response is back.
+    """
+    if not isinstance(llm, StreamingLLMBackend):
+        output = llm.generate(request)
+        scanner.feed(output)
+        return output, True
+    
+    chunks: List[str] = []
+    stream = llm.generate_stream(request)
+    try:
+        for chunk in stream:
+            chunks.append(chunk)
+            if not scanner.feed(chunk):
+                return "".join(chunks), False
+    finally:
+        # Closing the generator tells the backend to stop producing tokens
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+    return "".join(chunks), True
 
-Market Opportunities:
-- Expansion into emerging markets
-- Digital transformation initiatives
-- Strategic acquisitions in adjacent markets
-- Product line extensions
 
-Threats:
-- Disruptive technologies from competitors
-- Economic downturn risks
-- Supply chain vulnerabilities
-- Changing consumer preferences
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), used for every response the agents bill"""
+    return (len(text) + 3) // 4
 
-Investment Considerations:
-Based on the available information, {company_name} demonstrates several positive indicators including strong financial performance, market leadership, and growth trajectory. However, investors should carefully consider the identified risks and conduct thorough due diligence. Diversification remains important, and this analysis should be one input among many in investment decision-making.
 
-Note: This analysis is based on publicly available information and should not be the sole basis for investment decisions.
-"""
+def _stopped_generation_cost(partial_output: str, response_cost: float,
+                             typical_tokens: int) -> tuple[int, float, float]:
+    """
+    Estimate (tokens, cost_usd, saved_usd) for a generation stopped early
+    Only the tokens produced before the stop are charged, pro rata against
+    the flat price of a typical full response.
+    """
+    tokens = _estimate_tokens(partial_output)
+    cost = response_cost * min(1.0, tokens / typical_tokens)
+    return tokens, round(cost, 6), round(response_cost - cost, 6)
 
 
 class ResearchAgent:
     """Agent specialized in research and information gathering"""
     
-    def __init__(self, audit_trail: AuditTrail):
+    # Flat price of one research response, and the size of a typical (reference) one
+    RESPONSE_COST_USD = 0.002
+    TYPICAL_RESPONSE_TOKENS = _estimate_tokens(MockLLM.generate_research("Example Corp"))
+    
+    def __init__(self, audit_trail: AuditTrail, llm: Optional[LLMBackend] = None):
         self.audit_trail = audit_trail
-        self.llm = MockLLM()
+        self.llm = llm if llm is not None else MockLLM()
     
     def research_company(self, company_name: str) -> str:
         """Research a company"""
-        start_time = datetime.now()
-        
-        try:
-            logger.info(f"Research Agent: Gathering information on {company_name}...")
-            
-            # Generate research using mock LLM
-            output = self.llm.generate_research(company_name)
-            
-            # Log action
-            action = AgentAction(
-                timestamp=datetime.now().isoformat(),
-                agent_role=AgentRole.RESEARCHER.value,
-                action_type="company_research",
-                input_data={"company_name": company_name},
-                output_data={"summary": output[:200] + "..."},
-                tokens_used=len(output.split()),
-                cost_usd=0.002,
-                success=True
-            )
-            self.audit_trail.log_action(action)
-            
-            return output
-            
-        except Exception as e:
-            logger.error(f"Research agent error: {str(e)}")
-            action = AgentAction(
-                timestamp=datetime.now().isoformat(),
-                agent_role=AgentRole.RESEARCHER.value,
-                action_type="company_research",
-                input_data={"company_name": company_name},
-                output_data={},
-                tokens_used=0,
-                cost_usd=0.0,
-                success=False,
-                error_message=str(e)
-            )
-            self.audit_trail.log_action(action)
-            return f"Error during research: {str(e)}"
+        started = _clock.monotonic()
+        with tracer.span("llm.research", company=company_name):
+            try:
+                logger.info(f"Research Agent: Gathering information on {company_name}...")
+                
+                # Generate research using the LLM backend
+                output = self.llm.generate(LLMRequest.for_research(company_name))
+                
+                return self._record_success(company_name, output, started)
+                
+            except Exception as e:
+                return self._record_failure(company_name, e, started)
+    
+    async def research_company_async(self, company_name: str) -> str:
+        """Research a company without blocking the event loop"""
+        started = _clock.monotonic()
+        with tracer.span("llm.research", company=company_name):
+            try:
+                logger.info(f"Research Agent: Gathering information on {company_name}...")
+                
+                output = await self.llm.agenerate(LLMRequest.for_research(company_name))
+                
+                return self._record_success(company_name, output, started)
+                
+            except Exception as e:
+                return self._record_failure(company_name, e, started)
+    
+    def research_companies(self, company_names: List[str]) -> List[str]:
+        """Research several companies with one batched LLM call"""
+        started = _clock.monotonic()
+        with tracer.span("llm.research", companies=len(company_names), batched=True):
+            try:
+                logger.info(f"Research Agent: Gathering information on {len(company_names)} companies (batched)...")
+                
+                outputs = self.llm.generate_batch([LLMRequest.for_research(c) for c in company_names])
+                
+            except Exception as e:
+                return [self._record_failure(company_name, e, started) for company_name in company_names]
+            return [self._record_success(c, output, started) for c, output in zip(company_names, outputs)]
+    
+    def research_company_streaming(self, company_name: str, scanner: StreamingComplianceCheck) -> str:
+        """
+        Research a company while streaming output through a compliance scanner
+        Generation is abandoned as soon as the scanner reports a violation.
+        """
+        started = _clock.monotonic()
+        with tracer.span("llm.research", company=company_name, streaming=True):
+            try:
+                logger.info(f"Research Agent: Gathering information on {company_name} (streaming)...")
+                
+                output, completed = _generate_streamed(self.llm, LLMRequest.for_research(company_name), scanner)
+                if not completed:
+                    return self._record_stopped(company_name, output, scanner.violation, started)
+                
+                return self._record_success(company_name, output, started)
+                
+            except Exception as e:
+                return self._record_failure(company_name, e, started)
+    
+    def _record_success(self, company_name: str, output: str, started: float) -> str:
+        """Log a successful research action and return the output"""
+        cached = getattr(output, "cached", False)
+        if cached:
+            tracer.annotate(llm_cache_hit=True)
+        action = AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.RESEARCHER.value,
+            action_type="company_research",
+            input_data={"company_name": company_name},
+            output_data={"summary": output[:200] + "...", "llm_cache_hit": cached},
+            tokens_used=0 if cached else _estimate_tokens(output),
+            cost_usd=0.0 if cached else self.RESPONSE_COST_USD,
+            success=True,
+            duration_ms=_elapsed_ms(started)
+        )
+        self.audit_trail.log_action(action)
+        return output
+    
+    def _record_stopped(self, company_name: str, partial_output: str, reason: Optional[str],
+                        started: float) -> str:
+        """Log a generation stopped early by the compliance scanner"""
+        logger.warning(f"Research agent stopped generation for {company_name}: {reason}")
+        tokens, cost, saved = _stopped_generation_cost(partial_output, self.RESPONSE_COST_USD,
+                                                       self.TYPICAL_RESPONSE_TOKENS)
+        tracer.annotate(stopped_early=True, error=reason, saved_usd=saved)
+        _COST_SAVED.inc(AgentRole.RESEARCHER.value, amount=saved)
+        action = AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.RESEARCHER.value,
+            action_type="company_research",
+            input_data={"company_name": company_name},
+            output_data={"partial_summary": partial_output[:200] + "...", "stopped_early": True,
+                         "estimated_savings_usd": saved},
+            tokens_used=tokens,
+            cost_usd=cost,
+            success=False,
+            error_message=f"Generation stopped early: {reason}",
+            duration_ms=_elapsed_ms(started)
+        )
+        self.audit_trail.log_action(action)
+        return f"Error during research: generation stopped early ({reason})"
+    
+    def _record_failure(self, company_name: str, e: Exception, started: float) -> str:
+        """Log a failed research action and return the error text"""
+        logger.error(f"Research agent error: {str(e)}")
+        tracer.annotate(error=str(e))
+        action = AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.RESEARCHER.value,
+            action_type="company_research",
+            input_data={"company_name": company_name},
+            output_data={},
+            tokens_used=0,
+            cost_usd=0.0,
+            success=False,
+            error_message=str(e),
+            duration_ms=_elapsed_ms(started)
+        )
+        self.audit_trail.log_action(action)
+        return f"Error during research: {str(e)}"
 
 
 class AnalysisAgent:
     """Agent specialized in financial analysis"""
     
-    def __init__(self, audit_trail: AuditTrail):
+    # Flat price of one analysis response, and the size of a typical (reference) one
+    RESPONSE_COST_USD = 0.003
+    TYPICAL_RESPONSE_TOKENS = _estimate_tokens(
+        MockLLM.generate_analysis("Example Corp", MockLLM.generate_research("Example Corp")))
+    
+    def __init__(self, audit_trail: AuditTrail, llm: Optional[LLMBackend] = None):
         self.audit_trail = audit_trail
-        self.llm = MockLLM()
+        self.llm = llm if llm is not None else MockLLM()
     
     def analyze_investment_potential(self, research_summary: str, company_name: str) -> str:
         """Analyze investment potential based on research"""
-        
-        try:
-            logger.info(f"Analysis Agent: Evaluating investment potential for {company_name}...")
-            
-            # Generate analysis using mock LLM
-            output = self.llm.generate_analysis(company_name, research_summary)
-            
-            # Log action
-            action = AgentAction(
-                timestamp=datetime.now().isoformat(),
-                agent_role=AgentRole.ANALYST.value,
-                action_type="investment_analysis",
-                input_data={"company_name": company_name},
-                output_data={"analysis": output[:200] + "..."},
-                tokens_used=len(output.split()),
-                cost_usd=0.003,
-                success=True
-            )
-            self.audit_trail.log_action(action)
-            
-            return output
-            
-        except Exception as e:
-            logger.error(f"Analysis agent error: {str(e)}")
-            action = AgentAction(
-                timestamp=datetime.now().isoformat(),
-                agent_role=AgentRole.ANALYST.value,
-                action_type="investment_analysis",
-                input_data={"company_name": company_name},
-                output_data={},
-                tokens_used=0,
-                cost_usd=0.0,
-                success=False,
-                error_message=str(e)
-            )
-            self.audit_trail.log_action(action)
-            return f"Error during analysis: {str(e)}"
+        started = _clock.monotonic()
+        with tracer.span("llm.analysis", company=company_name):
+            try:
+                logger.info(f"Analysis Agent: Evaluating investment potential for {company_name}...")
+                
+                # Generate analysis using the LLM backend
+                output = self.llm.generate(LLMRequest.for_analysis(company_name, research_summary))
+                
+                return self._record_success(company_name, output, started)
+                
+            except Exception as e:
+                return self._record_failure(company_name, e, started)
+    
+    async def analyze_investment_potential_async(self, research_summary: str, company_name: str) -> str:
+        """Analyze investment potential without blocking the event loop"""
+        started = _clock.monotonic()
+        with tracer.span("llm.analysis", company=company_name):
+            try:
+                logger.info(f"Analysis Agent: Evaluating investment potential for {company_name}...")
+                
+                output = await self.llm.agenerate(LLMRequest.for_analysis(company_name, research_summary))
+                
+                return self._record_success(company_name, output, started)
+                
+            except Exception as e:
+                return self._record_failure(company_name, e, started)
+    
+    def analyze_investments(self, items: List[tuple[str, str]]) -> List[str]:
+        """
+        Analyze several companies with one batched LLM call
+        items: (research_summary, company_name) pairs
+        """
+        started = _clock.monotonic()
+        with tracer.span("llm.analysis", companies=len(items), batched=True):
+            try:
+                logger.info(f"Analysis Agent: Evaluating investment potential for {len(items)} companies (batched)...")
+                
+                outputs = self.llm.generate_batch(
+                    [LLMRequest.for_analysis(company_name, summary) for summary, company_name in items]
+                )
+                
+            except Exception as e:
+                return [self._record_failure(company_name, e, started) for _, company_name in items]
+            return [self._record_success(company_name, output, started)
+                    for (_, company_name), output in zip(items, outputs)]
+    
+    def analyze_investment_potential_streaming(self, research_summary: str, company_name: str,
+                                               scanner: StreamingComplianceCheck) -> str:
+        """
+        Analyze investment potential while streaming output through a compliance scanner
+        Generation is abandoned as soon as the scanner reports a violation.
+        """
+        started = _clock.monotonic()
+        with tracer.span("llm.analysis", company=company_name, streaming=True):
+            try:
+                logger.info(f"Analysis Agent: Evaluating investment potential for {company_name} (streaming)...")
+                
+                output, completed = _generate_streamed(self.llm, LLMRequest.for_analysis(company_name, research_summary), scanner)
+                if not completed:
+                    return self._record_stopped(company_name, output, scanner.violation, started)
+                
+                return self._record_success(company_name, output, started)
+                
+            except Exception as e:
+                return self._record_failure(company_name, e, started)
+    
+    def _record_success(self, company_name: str, output: str, started: float) -> str:
+        """Log a successful analysis action and return the output"""
+        cached = getattr(output, "cached", False)
+        if cached:
+            tracer.annotate(llm_cache_hit=True)
+        action = AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.ANALYST.value,
+            action_type="investment_analysis",
+            input_data={"company_name": company_name},
+            output_data={"analysis": output[:200] + "...", "llm_cache_hit": cached},
+            tokens_used=0 if cached else _estimate_tokens(output),
+            cost_usd=0.0 if cached else self.RESPONSE_COST_USD,
+            success=True,
+            duration_ms=_elapsed_ms(started)
+        )
+        self.audit_trail.log_action(action)
+        return output
+    
+    def _record_stopped(self, company_name: str, partial_output: str, reason: Optional[str],
+                        started: float) -> str:
+        """Log a generation stopped early by the compliance scanner"""
+        logger.warning(f"Analysis agent stopped generation for {company_name}: {reason}")
+        tokens, cost, saved = _stopped_generation_cost(partial_output, self.RESPONSE_COST_USD,
+                                                       self.TYPICAL_RESPONSE_TOKENS)
+        tracer.annotate(stopped_early=True, error=reason, saved_usd=saved)
+        _COST_SAVED.inc(AgentRole.ANALYST.value, amount=saved)
+        action = AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.ANALYST.value,
+            action_type="investment_analysis",
+            input_data={"company_name": company_name},
+            output_data={"partial_analysis": partial_output[:200] + "...", "stopped_early": True,
+                         "estimated_savings_usd": saved},
+            tokens_used=tokens,
+            cost_usd=cost,
+            success=False,
+            error_message=f"Generation stopped early: {reason}",
+            duration_ms=_elapsed_ms(started)
+        )
+        self.audit_trail.log_action(action)
+        return f"Error during analysis: generation stopped early ({reason})"
+    
+    def _record_failure(self, company_name: str, e: Exception, started: float) -> str:
+        """Log a failed analysis action and return the error text"""
+        logger.error(f"Analysis agent error: {str(e)}")
+        tracer.annotate(error=str(e))
+        action = AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.ANALYST.value,
+            action_type="investment_analysis",
+            input_data={"company_name": company_name},
+            output_data={},
+            tokens_used=0,
+            cost_usd=0.0,
+            success=False,
+            error_message=str(e),
+            duration_ms=_elapsed_ms(started)
+        )
+        self.audit_trail.log_action(action)
+        return f"Error during analysis: {str(e)}"
 
 
 class ComplianceAgent:
@@ -291,143 +4078,1058 @@ class ComplianceAgent:
     def __init__(self, audit_trail: AuditTrail):
         self.audit_trail = audit_trail
     
-    def review_output(self, content: str, content_type: str) -> Dict[str, Any]:
+    def review_output(self, content: str, content_type: str,
+                      company_name: Optional[str] = None) -> Dict[str, Any]:
         """Review content for compliance"""
-        
-        try:
-            logger.info(f"Compliance Agent: Reviewing {content_type} for regulatory compliance...")
-            
-            # Validate compliance
-            is_compliant, risk_message = ComplianceCheck.validate_output(content)
-            
-            # Add disclaimers if compliant
-            if is_compliant:
-                final_content = ComplianceCheck.add_disclaimers(content)
-                result = {
-                    "compliant": True,
-                    "risk_message": None,
-                    "final_content": final_content
-                }
-            else:
-                result = {
+        return self._review(content, content_type, company_name,
+                            lambda: ComplianceCheck.validate_output(content))
+    
+    def review_stream(self, scanner: StreamingComplianceCheck, content: Optional[str],
+                      content_type: str, company_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Review content that was already scanned while it streamed
+        content is None when generation was stopped before completing.
+        """
+        return self._review(content, content_type, company_name, scanner.finish)
+    
+    def _review(self, content: Optional[str], content_type: str, company_name: Optional[str],
+                verdict: Callable[[], tuple[bool, Optional[str]]]) -> Dict[str, Any]:
+        input_data = {"content_type": content_type}
+        if company_name is not None:
+            input_data["company_name"] = company_name
+        started = _clock.monotonic()
+        with tracer.span("compliance.review", content_type=content_type, company=company_name):
+            try:
+                logger.info(f"Compliance Agent: Reviewing {content_type} for regulatory compliance...")
+                
+                # Validate compliance
+                is_compliant, risk_message = verdict()
+                
+                # Add disclaimers if compliant
+                if is_compliant and content is not None:
+                    final_content = ComplianceCheck.add_disclaimers(content)
+                    result = {
+                        "compliant": True,
+                        "risk_message": None,
+                        "final_content": final_content
+                    }
+                else:
+                    result = {
+                        "compliant": False,
+                        "risk_message": risk_message,
+                        "final_content": None
+                    }
+                tracer.annotate(compliant=result["compliant"])
+                
+                # Log action
+                action = AgentAction(
+                    timestamp=_clock.now().isoformat(),
+                    agent_role=AgentRole.COMPLIANCE.value,
+                    action_type="compliance_review",
+                    input_data=input_data,
+                    output_data={"compliant": result["compliant"], "risk_message": result["risk_message"]},
+                    tokens_used=0,
+                    cost_usd=0.0,
+                    success=True,
+                    duration_ms=_elapsed_ms(started)
+                )
+                self.audit_trail.log_action(action)
+                
+                return result
+                
+            except Exception as e:
+                logger.error(f"Compliance agent error: {str(e)}")
+                tracer.annotate(error=str(e))
+                action = AgentAction(
+                    timestamp=_clock.now().isoformat(),
+                    agent_role=AgentRole.COMPLIANCE.value,
+                    action_type="compliance_review",
+                    input_data=input_data,
+                    output_data={},
+                    tokens_used=0,
+                    cost_usd=0.0,
+                    success=False,
+                    error_message=str(e),
+                    duration_ms=_elapsed_ms(started)
+                )
+                self.audit_trail.log_action(action)
+                return {
                     "compliant": False,
-                    "risk_message": risk_message,
+                    "risk_message": f"Compliance check error: {str(e)}",
                     "final_content": None
                 }
-            
-            # Log action
-            action = AgentAction(
-                timestamp=datetime.now().isoformat(),
-                agent_role=AgentRole.COMPLIANCE.value,
-                action_type="compliance_review",
-                input_data={"content_type": content_type},
-                output_data={"compliant": is_compliant, "risk_message": risk_message},
-                tokens_used=0,
-                cost_usd=0.0,
-                success=True
-            )
-            self.audit_trail.log_action(action)
-            
-            return result
-            
-        except Exception as e:
-            logger.error(f"Compliance agent error: {str(e)}")
-            action = AgentAction(
-                timestamp=datetime.now().isoformat(),
-                agent_role=AgentRole.COMPLIANCE.value,
-                action_type="compliance_review",
-                input_data={"content_type": content_type},
-                output_data={},
-                tokens_used=0,
-                cost_usd=0.0,
-                success=False,
-                error_message=str(e)
-            )
-            self.audit_trail.log_action(action)
+    
+    async def review_output_async(self, content: str, content_type: str,
+                                  company_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Review content for compliance from a coroutine
+        The check is a short in-memory scan, so it runs inline on the event loop.
+        """
+        return self.review_output(content, content_type, company_name)
+
+
+@dataclass
+class PipelineStageStats:
+    """Runtime statistics for one stage of a pipelined batch run"""
+    name: str
+    workers: int
+    queue_capacity: int
+    processed: int = 0
+    busy_seconds: float = 0.0
+    backpressure_seconds: float = 0.0
+    max_queue_depth: int = 0
+    queue_depth_samples: int = 0
+    queue_depth_total: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+    
+    def record_enqueue(self, depth: int):
+        """Sample the input queue depth right after an item was enqueued"""
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self.queue_depth_samples += 1
+            self.queue_depth_total += depth
+    
+    def record_work(self, busy_seconds: float, backpressure_seconds: float, items: int = 1):
+        """Record processed items and how long their worker was busy or blocked"""
+        with self._lock:
+            self.processed += items
+            self.busy_seconds += busy_seconds
+            self.backpressure_seconds += backpressure_seconds
+    
+    def to_dict(self, elapsed_seconds: float) -> Dict[str, Any]:
+        capacity = elapsed_seconds * self.workers
+        return {
+            "workers": self.workers,
+            "queue_capacity": self.queue_capacity,
+            "processed": self.processed,
+            "utilization": round(self.busy_seconds / capacity, 4) if capacity else 0,
+            "busy_seconds": round(self.busy_seconds, 4),
+            "backpressure_seconds": round(self.backpressure_seconds, 4),
+            "max_queue_depth": self.max_queue_depth,
+            "avg_queue_depth": round(
+                self.queue_depth_total / self.queue_depth_samples, 2
+            ) if self.queue_depth_samples else 0
+        }
+
+
+class WorkflowResultCache:
+    """
+    In-memory cache of completed workflow results
+    Keyed on (normalized company name, workflow version). Entries expire after
+    ttl_seconds and the least recently used entries are evicted once
+    max_entries or max_bytes is exceeded.
+    """
+    
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 10000,
+                 max_bytes: int = 256 * 1024 * 1024):
+        if ttl_seconds <= 0:
+            raise ValueError("ttl_seconds must be positive")
+        if max_entries < 1 or max_bytes < 1:
+            raise ValueError("max_entries and max_bytes must be at least 1")
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (result, expires_at, size_bytes), oldest first
+        self._entries: "OrderedDict[tuple[str, str], tuple[Dict[str, Any], float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def make_key(company_name: str, workflow_version: str) -> tuple[str, str]:
+        return normalize_company_name(company_name), workflow_version
+    
+    def get(self, key: tuple[str, str]) -> Optional[Dict[str, Any]]:
+        """Return the cached result for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= _clock.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                _CACHE_LOOKUPS.inc("workflow", "miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        _CACHE_LOOKUPS.inc("workflow", "hit")
+        return entry[0]
+    
+    def put(self, key: tuple[str, str], result: Dict[str, Any]):
+        """Store a result, evicting least recently used entries as needed"""
+        size = len(json.dumps(result, default=str).encode("utf-8"))
+        if size > self.max_bytes:
+            logger.warning(f"Result for {key[0]} ({size} bytes) exceeds cache max_bytes; not cached")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, _clock.monotonic() + self.ttl_seconds, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache counters and occupancy"""
+        with self._lock:
+            lookups = self.hits + self.misses
             return {
-                "compliant": False,
-                "risk_message": f"Compliance check error: {str(e)}",
-                "final_content": None
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
             }
+    
+    def _remove(self, key: tuple[str, str]):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
 
 
 class AgentOrchestrator:
     """Orchestrates multi-agent workflow"""
     
-    def __init__(self):
-        self.audit_trail = AuditTrail()
+    # Bump when the workflow's output changes so cached results are not reused
+    WORKFLOW_VERSION = "1"
+    
+    def __init__(self, llm: Optional[LLMBackend] = None,
+                 result_cache: Optional[WorkflowResultCache] = None,
+                 llm_cache: Optional[LLMResponseCache] = None,
+                 audit_trail: Optional[AuditTrail] = None):
+        self.audit_trail = audit_trail if audit_trail is not None else AuditTrail()
+        self.result_cache = result_cache
+        self.llm_cache = llm_cache
+        # Backend as supplied by the caller (process-pool workers rebuild the cache wrapper)
+        self.base_llm = llm if llm is not None else MockLLM()
+        self.llm = CachingLLM(self.base_llm, llm_cache) if llm_cache is not None else self.base_llm
         
         # Initialize agents
-        self.researcher = ResearchAgent(self.audit_trail)
-        self.analyst = AnalysisAgent(self.audit_trail)
+        self.researcher = ResearchAgent(self.audit_trail, self.llm)
+        self.analyst = AnalysisAgent(self.audit_trail, self.llm)
         self.compliance = ComplianceAgent(self.audit_trail)
     
     def research_investment(self, company_name: str) -> Dict[str, Any]:
         """
         Complete workflow: Research → Analyze → Compliance Check
         """
+        with _workflows_in_flight():
+            cached = self._cached_result(company_name)
+            if cached is not None:
+                return cached
+            
+            with self._step_timer("workflow", company=company_name):
+                self._log_workflow_start(company_name)
+                
+                # Step 1: Research
+                self._log_step("STEP 1: Research Agent - Gathering Information")
+                with self._step_timer("research"):
+                    research_summary = self.researcher.research_company(company_name)
+                
+                if "Error" in research_summary:
+                    return self._failure_result(research_summary)
+                
+                # Step 2: Analysis
+                self._log_step("\nSTEP 2: Analysis Agent - Evaluating Investment Potential")
+                with self._step_timer("analysis"):
+                    analysis_result = self.analyst.analyze_investment_potential(research_summary, company_name)
+                
+                if "Error" in analysis_result:
+                    return self._failure_result(analysis_result)
+                
+                # Step 3: Compliance Review
+                self._log_step("\nSTEP 3: Compliance Agent - Reviewing Output")
+                with self._step_timer("compliance"):
+                    compliance_result = self.compliance.review_output(
+                        content=f"{research_summary}\n\n{analysis_result}",
+                        content_type="investment_research",
+                        company_name=company_name
+                    )
+                
+                return self._review_result(company_name, research_summary, analysis_result, compliance_result)
+    
+    def research_investment_streaming(self, company_name: str) -> Dict[str, Any]:
+        """
+        Complete workflow with compliance scanning while output streams
+        Research and analysis output is fed to a StreamingComplianceCheck as
+        it is generated; a restricted keyword stops the current generation and
+        skips any remaining steps, so a bad research draft never pays for
+        analysis. Returns the same result dict as research_investment.
+        """
+        with _workflows_in_flight():
+            cached = self._cached_result(company_name)
+            if cached is not None:
+                return cached
+            
+            with self._step_timer("workflow", company=company_name):
+                self._log_workflow_start(company_name)
+                scanner = StreamingComplianceCheck()
+                
+                # Step 1: Research
+                self._log_step("STEP 1: Research Agent - Gathering Information (streaming)")
+                with self._step_timer("research"):
+                    research_summary = self.researcher.research_company_streaming(company_name, scanner)
+                
+                if scanner.should_stop:
+                    return self._stopped_result(company_name, scanner)
+                if "Error" in research_summary:
+                    return self._failure_result(research_summary)
+                
+                # Step 2: Analysis (scanned as a continuation of the research text)
+                self._log_step("\nSTEP 2: Analysis Agent - Evaluating Investment Potential (streaming)")
+                scanner.feed("\n\n")
+                with self._step_timer("analysis"):
+                    analysis_result = self.analyst.analyze_investment_potential_streaming(
+                        research_summary, company_name, scanner
+                    )
+                
+                if scanner.should_stop:
+                    return self._stopped_result(company_name, scanner)
+                if "Error" in analysis_result:
+                    return self._failure_result(analysis_result)
+                
+                # Step 3: Compliance Review (verdict from the streamed scan)
+                self._log_step("\nSTEP 3: Compliance Agent - Reviewing Output")
+                with self._step_timer("compliance"):
+                    compliance_result = self.compliance.review_stream(
+                        scanner,
+                        content=f"{research_summary}\n\n{analysis_result}",
+                        content_type="investment_research",
+                        company_name=company_name
+                    )
+                
+                return self._review_result(company_name, research_summary, analysis_result, compliance_result)
+    
+    def _stopped_result(self, company_name: str, scanner: StreamingComplianceCheck) -> Dict[str, Any]:
+        """Record the compliance verdict for a generation stopped mid-stream"""
+        compliance_result = self.compliance.review_stream(
+            scanner, content=None, content_type="investment_research", company_name=company_name
+        )
+        return self._failure_result(f"Compliance check failed: {compliance_result['risk_message']}")
+    
+    def _log_workflow_start(self, company_name: str):
         logger.info(f"\n{'='*60}")
         logger.info(f"Starting investment research workflow for: {company_name}")
         logger.info(f"{'='*60}\n")
-        
-        # Step 1: Research
-        logger.info("STEP 1: Research Agent - Gathering Information")
-        logger.info("-" * 60)
-        research_summary = self.researcher.research_company(company_name)
-        
-        if "Error" in research_summary:
-            return {
-                "success": False,
-                "error": research_summary,
-                "audit_summary": self.audit_trail.get_summary()
-            }
-        
-        # Step 2: Analysis
-        logger.info("\nSTEP 2: Analysis Agent - Evaluating Investment Potential")
-        logger.info("-" * 60)
-        analysis_result = self.analyst.analyze_investment_potential(research_summary, company_name)
-        
-        if "Error" in analysis_result:
-            return {
-                "success": False,
-                "error": analysis_result,
-                "audit_summary": self.audit_trail.get_summary()
-            }
-        
-        # Step 3: Compliance Review
-        logger.info("\nSTEP 3: Compliance Agent - Reviewing Output")
+    
+    @staticmethod
+    def _log_step(title: str):
+        logger.info(title)
         logger.info("-" * 60)
-        compliance_result = self.compliance.review_output(
-            content=f"{research_summary}\n\n{analysis_result}",
-            content_type="investment_research"
-        )
-        
+    
+    @contextlib.contextmanager
+    def _step_timer(self, step: str, **attributes: Any) -> Iterator[None]:
+        """
+        Record the wall time of a workflow step in the audit trail's latency sketches
+        The step also runs inside a tracing span ("workflow" or "step.<name>").
+        """
+        started = _clock.monotonic()
+        try:
+            with tracer.span(step if step == "workflow" else f"step.{step}", **attributes):
+                yield
+        finally:
+            self.audit_trail.record_step_latency(step, _elapsed_ms(started))
+    
+    def _failure_result(self, error: str) -> Dict[str, Any]:
+        """Build the result dict returned when a workflow step fails"""
+        _WORKFLOWS_FINISHED.inc("failed")
+        return {
+            "success": False,
+            "error": error,
+            "audit_summary": self.audit_trail.get_summary()
+        }
+    
+    def _review_result(self, company_name: str, research_summary: str, analysis_result: str,
+                       compliance_result: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the workflow result once the compliance review is back"""
         if not compliance_result["compliant"]:
-            return {
-                "success": False,
-                "error": f"Compliance check failed: {compliance_result['risk_message']}",
-                "audit_summary": self.audit_trail.get_summary()
-            }
-        
-        # Success
+            return self._failure_result(f"Compliance check failed: {compliance_result['risk_message']}")
+        return self._success_result(company_name, research_summary, analysis_result, compliance_result)
+    
+    def _success_result(self, company_name: str, research_summary: str, analysis_result: str,
+                        compliance_result: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the result dict returned when all workflow steps pass"""
+        _WORKFLOWS_FINISHED.inc("completed")
         logger.info("\n" + "="*60)
         logger.info("✅ WORKFLOW COMPLETED SUCCESSFULLY")
         logger.info("="*60 + "\n")
         
-        return {
+        result = {
             "success": True,
             "company_name": company_name,
             "research_summary": research_summary,
             "analysis": analysis_result,
-            "final_output": compliance_result["final_content"],
-            "audit_summary": self.audit_trail.get_summary()
+            "final_output": compliance_result["final_content"]
+        }
+        # Only successful runs are cached; failures may be transient
+        self._cache_result(company_name, result)
+        result["audit_summary"] = self.audit_trail.get_summary()
+        return result
+    
+    def _cache_result(self, company_name: str, result: Dict[str, Any]):
+        """Store a successful workflow result (without its audit summary) in the result cache"""
+        if self.result_cache is None:
+            return
+        entry = {k: v for k, v in result.items() if k != "audit_summary"}
+        self.result_cache.put(self.result_cache.make_key(company_name, self.WORKFLOW_VERSION), entry)
+    
+    def _cached_result(self, company_name: str) -> Optional[Dict[str, Any]]:
+        """Return a cached workflow result (logged as a zero-cost cache_hit), if any"""
+        if self.result_cache is None:
+            return None
+        started = _clock.monotonic()
+        cached = self.result_cache.get(self.result_cache.make_key(company_name, self.WORKFLOW_VERSION))
+        self.audit_trail.record_cache_lookup(hit=cached is not None)
+        if cached is None:
+            return None
+        
+        _WORKFLOWS_FINISHED.inc("cached")
+        self.audit_trail.log_action(AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.ORCHESTRATOR.value,
+            action_type="cache_hit",
+            input_data={"company_name": company_name},
+            output_data={"workflow_version": self.WORKFLOW_VERSION},
+            tokens_used=0,
+            cost_usd=0.0,
+            success=True,
+            duration_ms=_elapsed_ms(started)
+        ))
+        result = dict(cached)
+        result["audit_summary"] = self.audit_trail.get_summary()
+        return result
+    
+    def research_batch(self, companies: List[str]) -> List[Dict[str, Any]]:
+        """
+        Run the workflow for a group of companies using batched LLM calls
+        All research prompts go to the backend as one batch, then all analysis
+        prompts; compliance still reviews each company separately.
+        Returns results in input order.
+        """
+        with _workflows_in_flight(len(companies)):
+            results: List[Optional[Dict[str, Any]]] = [None] * len(companies)
+            pending: List[int] = []
+            for index, company in enumerate(companies):
+                cached = self._cached_result(company)
+                if cached is not None:
+                    results[index] = cached
+                else:
+                    pending.append(index)
+            if not pending:
+                return results
+            
+            summaries = self.researcher.research_companies([companies[i] for i in pending])
+            researched: List[tuple[int, str]] = []
+            for index, summary in zip(pending, summaries):
+                if "Error" in summary:
+                    results[index] = self._failure_result(summary)
+                else:
+                    researched.append((index, summary))
+            if not researched:
+                return results
+            
+            analyses = self.analyst.analyze_investments(
+                [(summary, companies[index]) for index, summary in researched]
+            )
+            for (index, summary), analysis in zip(researched, analyses):
+                if "Error" in analysis:
+                    results[index] = self._failure_result(analysis)
+                    continue
+                review = self.compliance.review_output(
+                    content=f"{summary}\n\n{analysis}",
+                    content_type="investment_research",
+                    company_name=companies[index]
+                )
+                results[index] = self._review_result(companies[index], summary, analysis, review)
+            return results
+    
+    def research_many(self, companies: List[str], max_workers: int = 4,
+                      executor: str = "thread", batch_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Run the research workflow for many companies concurrently
+        executor: "thread" shares this orchestrator's agents and audit trail;
+        "process" runs each workflow in a worker process and merges its
+        actions back into this audit trail (the LLM backend must be picklable).
+        batch_size: when set, each worker takes that many companies at a time
+        and submits their prompts to the LLM backend with generate_batch.
+        Returns results in input order plus a per-company status.
+        """
+        if executor not in ("thread", "process"):
+            raise ValueError(f"Unknown executor: {executor!r} (expected 'thread' or 'process')")
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if batch_size is not None and batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        
+        logger.info(f"Starting batch research for {len(companies)} companies "
+                    f"({max_workers} {executor} workers, batch_size={batch_size})")
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(companies)
+        statuses: List[Optional[Dict[str, Any]]] = [None] * len(companies)
+        # Worker processes count their workflows in their own registries, so they are counted here
+        tracked = _workflows_in_flight(len(companies)) if executor == "process" else contextlib.nullcontext()
+        pool_cls = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+        with tracked, pool_cls(max_workers=max_workers) as pool:
+            pending = list(range(len(companies)))
+            if executor == "process" and self.result_cache is not None:
+                # Worker processes cannot see this cache, so hits are served (and logged) here
+                pending = []
+                for index, company in enumerate(companies):
+                    cached = self._cached_result(company)
+                    if cached is None:
+                        pending.append(index)
+                    else:
+                        results[index] = cached
+                        statuses[index] = {"company_name": company, "status": "completed", "error": None}
+            chunk_size = batch_size or 1
+            index_chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            chunks = [[companies[i] for i in chunk] for chunk in index_chunks]
+            
+            if executor == "thread":
+                # Each worker runs in a copy of this context so its spans nest under ours
+                futures = [pool.submit(contextvars.copy_context().run, self._research_chunk,
+                                       chunk, batch_size is not None)
+                           for chunk in chunks]
+            else:
+                # Worker processes open their own connection to the same on-disk LLM cache
+                cache_config = ({"path": self.llm_cache.path, "max_bytes": self.llm_cache.max_bytes,
+                                 "touch_interval_seconds": self.llm_cache.touch_interval_seconds}
+                                if self.llm_cache is not None else None)
+                futures = [pool.submit(_research_in_subprocess, chunk, batch_size is not None,
+                                       self.base_llm, cache_config)
+                           for chunk in chunks]
+            # Results are placed by input index so output lines up with the input list
+            for indexes, chunk, future in zip(index_chunks, chunks, futures):
+                try:
+                    if executor == "thread":
+                        chunk_results = future.result()
+                    else:
+                        chunk_results, actions, step_latencies = future.result()
+                        for action in actions:
+                            self.audit_trail.log_action(AgentAction(**action))
+                        self.audit_trail.merge_step_latencies(step_latencies)
+                except Exception as e:
+                    logger.error(f"Batch worker error for {', '.join(chunk)}: {str(e)}")
+                    if executor == "process":
+                        _WORKFLOWS_FINISHED.inc("failed", amount=len(chunk))
+                    for index, company in zip(indexes, chunk):
+                        results[index] = {"success": False, "company_name": company, "error": str(e)}
+                        statuses[index] = {"company_name": company, "status": "error", "error": str(e)}
+                    continue
+                for index, company, result in zip(indexes, chunk, chunk_results):
+                    if executor == "process":
+                        _WORKFLOWS_FINISHED.inc("completed" if result["success"] else "failed")
+                        if result["success"]:
+                            self._cache_result(company, result)
+                    results[index] = result
+                    statuses[index] = {
+                        "company_name": company,
+                        "status": "completed" if result["success"] else "failed",
+                        "error": result.get("error")
+                    }
+        
+        audit_summary = self.audit_trail.get_summary()
+        if executor == "process":
+            # Worker summaries only cover their own process; report the merged trail
+            for result in results:
+                result["audit_summary"] = audit_summary
+        
+        completed = sum(1 for s in statuses if s["status"] == "completed")
+        logger.info(f"Batch research finished: {completed}/{len(companies)} completed")
+        
+        return {
+            "success": completed == len(companies),
+            "results": results,
+            "statuses": statuses,
+            "completed": completed,
+            "failed": len(companies) - completed,
+            "audit_summary": audit_summary
         }
     
+    def _research_chunk(self, companies: List[str], batched: bool) -> List[Dict[str, Any]]:
+        if batched:
+            return self.research_batch(companies)
+        return [self.research_investment(company) for company in companies]
+    
+    def research_pipeline(self, companies: List[str], research_workers: int = 2,
+                          analysis_workers: int = 2, compliance_workers: int = 1,
+                          queue_size: int = 16, batch_size: int = 1) -> Dict[str, Any]:
+        """
+        Run the workflow for many companies as a three-stage pipeline
+        Research, Analysis and Compliance each have their own worker threads
+        and are connected by bounded queues, so research of company N+1
+        overlaps analysis of company N. A full queue blocks the upstream
+        stage (backpressure) until the downstream stage catches up.
+        Research and analysis workers drain up to batch_size queued items at
+        a time and submit them to the LLM backend as one batch.
+        Each stage call is timed and traced like a research_investment step
+        (a batch counts as one sample); "workflow" latency runs from a
+        company entering the pipeline to its result, queueing included.
+        Returns results in input order plus per-stage queue/utilization stats.
+        """
+        worker_counts = {"research": research_workers, "analysis": analysis_workers,
+                         "compliance": compliance_workers}
+        for name, count in worker_counts.items():
+            if count < 1:
+                raise ValueError(f"{name}_workers must be at least 1")
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        
+        logger.info(f"Starting pipelined research for {len(companies)} companies "
+                    f"(workers: {worker_counts}, queue_size={queue_size}, batch_size={batch_size})")
+        
+        with _workflows_in_flight(len(companies)), tracer.span("pipeline", companies=len(companies)):
+            stop = object()
+            queues = {name: queue.Queue(maxsize=queue_size) for name in worker_counts}
+            stats = {name: PipelineStageStats(name, count, queue_size)
+                     for name, count in worker_counts.items()}
+            results: List[Optional[Dict[str, Any]]] = [None] * len(companies)
+            admitted: List[float] = [0.0] * len(companies)
+            
+            def finish(index: int, result: Dict[str, Any]):
+                results[index] = result
+                self.audit_trail.record_step_latency("workflow", _elapsed_ms(admitted[index]))
+            
+            def enqueue(stage: str, item: Any) -> float:
+                """Put an item on a stage's queue, returning seconds spent blocked"""
+                blocked_start = time.perf_counter()
+                queues[stage].put(item)
+                blocked = time.perf_counter() - blocked_start
+                if item is not stop:
+                    depth = queues[stage].qsize()
+                    stats[stage].record_enqueue(depth)
+                    _PIPELINE_QUEUE_DEPTH.set(depth, stage)
+                return blocked
+            
+            def take(stage: str) -> tuple[List[Any], bool]:
+                """Block for one item, then drain up to batch_size; returns (items, stopped)"""
+                items: List[Any] = []
+                item = queues[stage].get()
+                while item is not stop:
+                    items.append(item)
+                    if len(items) >= batch_size:
+                        break
+                    try:
+                        item = queues[stage].get_nowait()
+                    except queue.Empty:
+                        break
+                _PIPELINE_QUEUE_DEPTH.set(queues[stage].qsize(), stage)
+                return items, item is stop
+            
+            def stage_timer(stage: str, items):
+                if len(items) == 1:
+                    return self._step_timer(stage, company=items[0][1])
+                return self._step_timer(stage, companies=[item[1] for item in items])
+            
+            def run_research(items):
+                with stage_timer("research", items):
+                    summaries = self.researcher.research_companies([company for _, company in items])
+                forward = []
+                for (index, company), summary in zip(items, summaries):
+                    if "Error" in summary:
+                        finish(index, self._failure_result(summary))
+                    else:
+                        forward.append((index, company, summary))
+                return "analysis", forward
+            
+            def run_analysis(items):
+                with stage_timer("analysis", items):
+                    analyses = self.analyst.analyze_investments(
+                        [(summary, company) for _, company, summary in items]
+                    )
+                forward = []
+                for (index, company, summary), analysis in zip(items, analyses):
+                    if "Error" in analysis:
+                        finish(index, self._failure_result(analysis))
+                    else:
+                        forward.append((index, company, summary, analysis))
+                return "compliance", forward
+            
+            def run_compliance(items):
+                for index, company, summary, analysis in items:
+                    with self._step_timer("compliance", company=company):
+                        review = self.compliance.review_output(
+                            content=f"{summary}\n\n{analysis}",
+                            content_type="investment_research",
+                            company_name=company
+                        )
+                    finish(index, self._review_result(company, summary, analysis, review))
+                return None, []
+            
+            handlers = {"research": run_research, "analysis": run_analysis,
+                        "compliance": run_compliance}
+            
+            def stage_worker(stage: str):
+                stopped = False
+                while not stopped:
+                    items, stopped = take(stage)
+                    if not items:
+                        continue
+                    busy_start = time.perf_counter()
+                    try:
+                        next_stage, forward = handlers[stage](items)
+                    except Exception as e:
+                        logger.error(f"Pipeline {stage} stage error for "
+                                     f"{', '.join(item[1] for item in items)}: {str(e)}")
+                        for item in items:
+                            finish(item[0], self._failure_result(str(e)))
+                        next_stage, forward = None, []
+                    busy = time.perf_counter() - busy_start
+                    blocked = sum(enqueue(next_stage, item) for item in forward) if next_stage else 0.0
+                    stats[stage].record_work(busy, blocked, len(items))
+            
+            start = time.perf_counter()
+            threads = {
+                name: [threading.Thread(target=contextvars.copy_context().run, args=(stage_worker, name),
+                                        daemon=True, name=f"pipeline-{name}-{i}")
+                       for i in range(count)]
+                for name, count in worker_counts.items()
+            }
+            for stage_threads in threads.values():
+                for t in stage_threads:
+                    t.start()
+            
+            for index, company in enumerate(companies):
+                cached = self._cached_result(company)
+                if cached is not None:
+                    results[index] = cached
+                else:
+                    admitted[index] = _clock.monotonic()
+                    enqueue("research", (index, company))
+            
+            # Drain stage by stage: once every upstream worker has exited, no more
+            # items can reach the next queue, so its workers can be stopped.
+            for name in worker_counts:
+                for _ in threads[name]:
+                    queues[name].put(stop)
+                for t in threads[name]:
+                    t.join()
+            elapsed = time.perf_counter() - start
+            
+            statuses = [
+                {"company_name": company,
+                 "status": "completed" if result["success"] else "failed",
+                 "error": result.get("error")}
+                for company, result in zip(companies, results)
+            ]
+            completed = sum(1 for s in statuses if s["status"] == "completed")
+            logger.info(f"Pipelined research finished: {completed}/{len(companies)} completed "
+                        f"in {elapsed:.3f}s")
+            
+            return {
+                "success": completed == len(companies),
+                "results": results,
+                "statuses": statuses,
+                "completed": completed,
+                "failed": len(companies) - completed,
+                "elapsed_seconds": round(elapsed, 4),
+                "stage_stats": {name: st.to_dict(elapsed) for name, st in stats.items()},
+                "audit_summary": self.audit_trail.get_summary()
+            }
+    
     def export_audit_trail(self, filepath: str):
         """Export complete audit trail"""
         self.audit_trail.export_to_file(filepath)
 
 
+class AsyncAgentOrchestrator(AgentOrchestrator):
+    """
+    Orchestrates the multi-agent workflow on an asyncio event loop
+    Many workflows can be in flight at once without one OS thread each;
+    results and audit actions match AgentOrchestrator.research_investment.
+    """
+    
+    async def research_investment_async(self, company_name: str) -> Dict[str, Any]:
+        """
+        Complete workflow: Research → Analyze → Compliance Check (async)
+        """
+        with _workflows_in_flight():
+            cached = self._cached_result(company_name)
+            if cached is not None:
+                return cached
+            
+            with self._step_timer("workflow", company=company_name):
+                self._log_workflow_start(company_name)
+                
+                # Step 1: Research
+                self._log_step("STEP 1: Research Agent - Gathering Information")
+                with self._step_timer("research"):
+                    research_summary = await self.researcher.research_company_async(company_name)
+                
+                if "Error" in research_summary:
+                    return self._failure_result(research_summary)
+                
+                # Step 2: Analysis
+                self._log_step("\nSTEP 2: Analysis Agent - Evaluating Investment Potential")
+                with self._step_timer("analysis"):
+                    analysis_result = await self.analyst.analyze_investment_potential_async(
+                        research_summary, company_name
+                    )
+                
+                if "Error" in analysis_result:
+                    return self._failure_result(analysis_result)
+                
+                # Step 3: Compliance Review
+                self._log_step("\nSTEP 3: Compliance Agent - Reviewing Output")
+                with self._step_timer("compliance"):
+                    compliance_result = await self.compliance.review_output_async(
+                        content=f"{research_summary}\n\n{analysis_result}",
+                        content_type="investment_research",
+                        company_name=company_name
+                    )
+                
+                return self._review_result(company_name, research_summary, analysis_result, compliance_result)
+    
+    async def research_many_async(self, companies: List[str],
+                                  max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Run the workflow for many companies on this event loop
+        max_concurrency bounds the number of workflows in flight (None = unbounded).
+        Returns results in input order.
+        """
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        
+        if max_concurrency is None:
+            return list(await asyncio.gather(
+                *(self.research_investment_async(company) for company in companies)
+            ))
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run_bounded(company: str) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.research_investment_async(company)
+        
+        return list(await asyncio.gather(*(run_bounded(company) for company in companies)))
+
+
+class _VirtualTimeSelector(selectors.DefaultSelector):
+    """Selector that advances a VirtualClock instead of blocking until the next timer"""
+    
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self.clock = clock
+    
+    def select(self, timeout: Optional[float] = None) -> List[Any]:
+        # Real readiness (thread wakeups, sockets) is still honoured first
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # No timers pending: only another thread can make progress
+            return super().select(None)
+        self.clock.advance(timeout)
+        return []
+
+
+class VirtualTimeEventLoop(asyncio.SelectorEventLoop):
+    """
+    Discrete-event asyncio loop driven by a VirtualClock
+    Whenever every task is waiting on a timer, the clock jumps to the next
+    timer instead of sleeping, so asyncio.sleep (and MockLLM latency in the
+    async agents) takes no wall time. CPU work between awaits takes no
+    virtual time.
+    """
+    
+    def __init__(self, clock: VirtualClock):
+        self.virtual_clock = clock
+        super().__init__(selector=_VirtualTimeSelector(clock))
+    
+    def time(self) -> float:
+        return self.virtual_clock.monotonic()
+
+
+def run_simulated(main: Any, start: Optional[datetime] = None) -> Any:
+    """
+    Run a coroutine on virtual time, like asyncio.run
+    Audit timestamps, durations, result-cache expiry and MockLLM latency all
+    follow the VirtualClock (get_clock() returns it inside the coroutine), so
+    a day of AsyncAgentOrchestrator traffic runs as fast as the CPU allows.
+    """
+    clock = VirtualClock(start)
+    loop = VirtualTimeEventLoop(clock)
+    try:
+        with use_clock(clock):
+            return loop.run_until_complete(main)
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+
+
+def _research_in_subprocess(companies: List[str], batched: bool, llm: LLMBackend,
+                            llm_cache_config: Optional[Dict[str, Any]] = None
+                            ) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """Process-pool worker: run workflows and return their results, audit actions and step latencies"""
+    llm_cache = LLMResponseCache(**llm_cache_config) if llm_cache_config else None
+    orchestrator = AgentOrchestrator(llm=llm, llm_cache=llm_cache)
+    results = orchestrator._research_chunk(companies, batched)
+    trail = orchestrator.audit_trail
+    return results, [a.to_dict() for a in trail.actions], trail.step_latency_states()
+
+
+class _LeaderAbandoned(Exception):
+    """Set on a shared future when its leader was interrupted or cancelled"""
+
+
+class RequestCoalescer:
+    """
+    Single-flight layer in front of an orchestrator
+    Concurrent requests for the same normalized company share one in-flight
+    workflow; every follower receives the leader's result and gets its own
+    zero-cost "coalesced_hit" audit entry. Workflow errors are shared with
+    the followers (each still gets a failed entry), but a leader that is
+    interrupted or cancelled keeps that to itself: its entry is dropped and
+    one follower takes over as leader.
+    """
+    
+    def __init__(self, orchestrator: AgentOrchestrator):
+        self.orchestrator = orchestrator
+        self.audit_trail = orchestrator.audit_trail
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._in_flight_async: Dict[str, asyncio.Future] = {}
+        self.workflows_started = 0
+        self.coalesced_hits = 0
+    
+    def research_investment(self, company_name: str) -> Dict[str, Any]:
+        """Run (or join) the research workflow for a company"""
+        key = normalize_company_name(company_name)
+        while True:
+            with self._lock:
+                future = self._in_flight.get(key)
+                is_leader = future is None
+                if is_leader:
+                    future = Future()
+                    self._in_flight[key] = future
+                    self.workflows_started += 1
+                else:
+                    self.coalesced_hits += 1
+            if is_leader:
+                break
+            
+            started = _clock.monotonic()
+            try:
+                result = future.result()
+            except _LeaderAbandoned:
+                # Race the other followers to lead the rerun
+                with self._lock:
+                    self.coalesced_hits -= 1
+                continue
+            except Exception as e:
+                self._log_coalesced_hit(company_name, key, started, error=e)
+                raise
+            self._log_coalesced_hit(company_name, key, started, result=result)
+            return dict(result)
+        
+        try:
+            result = self.orchestrator.research_investment(company_name)
+        except Exception as e:
+            self._finish(self._in_flight, key)
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # KeyboardInterrupt and friends belong to the leader's caller, not the followers
+            self._finish(self._in_flight, key)
+            future.set_exception(_LeaderAbandoned())
+            raise
+        self._finish(self._in_flight, key)
+        future.set_result(result)
+        return result
+    
+    async def research_investment_async(self, company_name: str) -> Dict[str, Any]:
+        """Run (or join) the research workflow for a company on the event loop"""
+        if not isinstance(self.orchestrator, AsyncAgentOrchestrator):
+            raise TypeError("research_investment_async requires an AsyncAgentOrchestrator")
+        
+        key = normalize_company_name(company_name)
+        while True:
+            future = self._in_flight_async.get(key)
+            if future is None:
+                break
+            with self._lock:
+                self.coalesced_hits += 1
+            # Shield so a cancelled follower does not cancel the shared workflow
+            started = _clock.monotonic()
+            try:
+                result = await asyncio.shield(future)
+            except _LeaderAbandoned:
+                # The first follower to resume finds no entry and leads the rerun
+                with self._lock:
+                    self.coalesced_hits -= 1
+                continue
+            except Exception as e:
+                self._log_coalesced_hit(company_name, key, started, error=e)
+                raise
+            self._log_coalesced_hit(company_name, key, started, result=result)
+            return dict(result)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight_async[key] = future
+        with self._lock:
+            self.workflows_started += 1
+        try:
+            result = await self.orchestrator.research_investment_async(company_name)
+        except BaseException as e:
+            self._in_flight_async.pop(key, None)
+            # A cancelled leader must not cancel the followers its shield protects
+            future.set_exception(e if isinstance(e, Exception) else _LeaderAbandoned())
+            # Mark retrieved so an exception nobody awaited is not reported as lost
+            future.exception()
+            raise
+        self._in_flight_async.pop(key, None)
+        future.set_result(result)
+        return result
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Get coalescing counters"""
+        with self._lock:
+            total = self.workflows_started + self.coalesced_hits
+            return {
+                "requests": total,
+                "workflows_started": self.workflows_started,
+                "coalesced_hits": self.coalesced_hits,
+                "in_flight": len(self._in_flight) + len(self._in_flight_async),
+                "coalesce_rate": round(self.coalesced_hits / total * 100, 2) if total else 0
+            }
+    
+    def _finish(self, in_flight: Dict[str, Any], key: str):
+        with self._lock:
+            in_flight.pop(key, None)
+    
+    def _log_coalesced_hit(self, company_name: str, key: str, started: float,
+                           result: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None):
+        """Audit one follower served by (or failed with) the shared workflow"""
+        action = AgentAction(
+            timestamp=_clock.now().isoformat(),
+            agent_role=AgentRole.ORCHESTRATOR.value,
+            action_type="coalesced_hit",
+            input_data={"company_name": company_name, "coalesce_key": key},
+            output_data={"shared_workflow_success": error is None and result["success"]},
+            tokens_used=0,
+            cost_usd=0.0,
+            success=error is None,
+            error_message=f"Shared workflow raised: {str(error)}" if error is not None else None,
+            duration_ms=_elapsed_ms(started)  # time spent waiting on the shared workflow
+        )
+        self.audit_trail.log_action(action)
+
+
 def demo_agent_system():
     """Demo the agent system"""
     
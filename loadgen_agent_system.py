@@ -0,0 +1,326 @@
+"""
+JPMC Financial Research Agent System - LOAD GENERATOR
+Drives the orchestrator against a MockLLM with realistic latency and failure
+distributions, to size worker pools before a rollout
+(Run: python loadgen_agent_system.py --help)
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Any, Dict, Iterator, List, Optional
+
+import demo_agent_system as agents
+from demo_agent_system import (
+    AgentOrchestrator, AsyncAgentOrchestrator, AuditTrail, LatencyModel, LatencySketch, MockLLM,
+    RotatingJSONLAuditSink, WorkflowResultCache, run_simulated, start_metrics_server, tracer
+)
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Per-action logs (and the simulated failures' ERROR lines) would drown the report
+logging.getLogger(agents.__name__).setLevel(logging.CRITICAL)
+
+
+class LoadStats:
+    """
+    Per-request outcomes collected from any number of worker threads
+    Latencies go into LatencySketches, so memory stays flat however many
+    requests a (simulated) soak test runs.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = LatencySketch()
+        self.queue_wait = LatencySketch()
+        self.errors: Dict[str, int] = {}
+        self.failures = 0
+        # Maintained by the asyncio runner for timeline samples
+        self.queued = 0
+        self.in_flight = 0
+    
+    @property
+    def completed(self) -> int:
+        return self.latency.count
+    
+    def record(self, latency: float, queue_wait: float, result: Optional[Dict[str, Any]],
+               error: Optional[BaseException] = None):
+        with self._lock:
+            self.latency.add(latency * 1000)
+            self.queue_wait.add(queue_wait * 1000)
+            if error is not None:
+                name = type(error).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+            elif not result["success"]:
+                self.failures += 1
+    
+    def report(self, elapsed: float, offered_rate: Optional[float]) -> Dict[str, Any]:
+        completed = self.completed
+        errors = sum(self.errors.values())
+        latency = self.latency.to_dict()
+        queue_wait = self.queue_wait.to_dict()
+        return {
+            "requests": completed,
+            "seconds": round(elapsed, 3),
+            "offered_rate": offered_rate,
+            "throughput_per_sec": round(completed / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {name: latency[name] for name in ("p50", "p90", "p99", "max")},
+            "queue_wait_ms": {name: queue_wait[name] for name in ("p50", "p99")},
+            "failed_workflows": self.failures,
+            "exceptions": dict(self.errors),
+            "error_rate": round((self.failures + errors) / completed * 100, 2) if completed else 0.0,
+        }
+
+
+def arrival_offsets(rate: float, count: int, arrivals: str, rng: random.Random) -> Iterator[float]:
+    """Seconds after the start at which each request of an open-loop run arrives"""
+    now = 0.0
+    for i in range(count):
+        yield i / rate if arrivals == "uniform" else now
+        now += rng.expovariate(rate)
+
+
+def memory_kb() -> Optional[float]:
+    """Traced Python memory when tracemalloc is on, else peak RSS where available"""
+    if tracemalloc.is_tracing():
+        return round(tracemalloc.get_traced_memory()[0] / 1024, 1)
+    if resource is not None:
+        # ru_maxrss is in KB on Linux
+        return float(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    return None
+
+
+def run_threads(orchestrator: AgentOrchestrator, companies: List[str], requests: int,
+                concurrency: int, rate: Optional[float], arrivals: str,
+                rng: random.Random) -> Dict[str, Any]:
+    """
+    Thread mode: `concurrency` workers call research_investment
+    Without a rate each worker issues requests back to back (closed loop).
+    With a rate, requests arrive on schedule whether or not a worker is free
+    (open loop), and latency is measured from the scheduled arrival so time
+    spent queued for a worker counts.
+    """
+    stats = LoadStats()
+    
+    def call(i: int, scheduled: float):
+        began = time.perf_counter()
+        try:
+            result, error = orchestrator.research_investment(companies[i % len(companies)]), None
+        except Exception as e:
+            result, error = None, e
+        stats.record(time.perf_counter() - scheduled, began - scheduled, result, error)
+    
+    start = time.perf_counter()
+    if rate is None:
+        counter = itertools.count()
+        
+        def worker():
+            while (i := next(counter)) < requests:
+                call(i, time.perf_counter())
+        
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for i, offset in enumerate(arrival_offsets(rate, requests, arrivals, rng)):
+                scheduled = start + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(call, i, scheduled)
+    return stats.report(time.perf_counter() - start, rate)
+
+
+async def run_async(orchestrator: AsyncAgentOrchestrator, companies: List[str], requests: int,
+                    concurrency: int, rate: Optional[float], arrivals: str, rng: random.Random,
+                    sample_every: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Asyncio mode: like run_threads, with at most `concurrency` workflows in flight
+    Times come from the event loop, so the same code measures virtual time
+    under run_simulated. sample_every adds a timeline of queue depth,
+    in-flight workflows, audit trail size and memory.
+    """
+    loop = asyncio.get_running_loop()
+    stats = LoadStats()
+    slots = asyncio.Semaphore(concurrency)
+    all_done = asyncio.Event()
+    timeline: List[Dict[str, Any]] = []
+    
+    async def call(i: int, scheduled: float):
+        stats.queued += 1
+        async with slots:
+            stats.queued -= 1
+            stats.in_flight += 1
+            began = loop.time()
+            try:
+                result, error = await orchestrator.research_investment_async(companies[i % len(companies)]), None
+            except Exception as e:
+                result, error = None, e
+            stats.in_flight -= 1
+        stats.record(loop.time() - scheduled, began - scheduled, result, error)
+        if stats.completed == requests:
+            all_done.set()
+    
+    async def sample():
+        while True:
+            await asyncio.sleep(sample_every)
+            timeline.append({
+                "t": round(loop.time() - start, 3), "completed": stats.completed,
+                "queued": stats.queued, "in_flight": stats.in_flight,
+                "audit_actions": orchestrator.audit_trail.total_actions, "memory_kb": memory_kb(),
+            })
+    
+    start = loop.time()
+    sampler = asyncio.create_task(sample()) if sample_every else None
+    if rate is None:
+        counter = itertools.count()
+        
+        async def worker():
+            while (i := next(counter)) < requests:
+                await call(i, loop.time())
+        
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    else:
+        # Only unfinished tasks are kept, so a million-request run holds just what is in flight
+        pending = set()
+        for i, offset in enumerate(arrival_offsets(rate, requests, arrivals, rng)):
+            scheduled = start + offset
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(call(i, scheduled))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await all_done.wait()
+    elapsed = loop.time() - start
+    if sampler is not None:
+        sampler.cancel()
+    report = stats.report(elapsed, rate)
+    if sample_every:
+        report["timeline"] = timeline
+    return report
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Agent system load generator")
+    load = parser.add_argument_group("load")
+    load.add_argument("--requests", type=int, default=200, help="workflows to run")
+    load.add_argument("--duration", type=float,
+                      help="seconds of traffic at --rate (sets --requests to rate x duration)")
+    load.add_argument("--concurrency", type=int, default=8,
+                      help="worker threads (or in-flight workflows with --mode async)")
+    load.add_argument("--rate", type=float, help="target arrivals per second (open loop); "
+                                                 "omit to run workers back to back")
+    load.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson",
+                      help="arrival process for --rate (default: poisson)")
+    load.add_argument("--mode", choices=["thread", "async"], default="thread")
+    load.add_argument("--companies", type=int, default=50, help="distinct company names to cycle through")
+    load.add_argument("--result-cache-ttl", type=float,
+                      help="put a WorkflowResultCache with this TTL (seconds) in front of the workflow")
+    load.add_argument("--audit-dir", metavar="DIR",
+                      help="stream the audit trail to rotating segments in DIR instead of keeping it in memory")
+    sim = parser.add_argument_group("simulation")
+    sim.add_argument("--simulate", action="store_true",
+                     help="run on a virtual clock (implies --mode async): LLM latency, audit timestamps "
+                          "and cache expiry take no wall time")
+    sim.add_argument("--sample-every", type=float,
+                     help="record queue depth, in-flight workflows, audit size and memory every N seconds "
+                          "(async mode)")
+    sim.add_argument("--trace-memory", action="store_true",
+                     help="sample traced Python memory (tracemalloc) instead of peak RSS")
+    llm = parser.add_argument_group("simulated LLM")
+    llm.add_argument("--latency", type=LatencyModel.parse, default=LatencyModel("lognormal", 0.05, sigma=0.5),
+                     help="per-call latency: fixed:SECONDS, lognormal:MEDIAN[,SIGMA] or "
+                          "pareto:MIN[,ALPHA] (default: lognormal:0.05,0.5)")
+    llm.add_argument("--latency-cap", type=float, help="cap on any single latency draw (seconds)")
+    llm.add_argument("--error-rate", type=float, default=0.0, help="fraction of LLM calls that fail")
+    llm.add_argument("--timeout", type=float, help="LLM calls slower than this raise TimeoutError")
+    parser.add_argument("--seed", type=int, help="seed for latencies, failures and arrivals")
+    parser.add_argument("--output", metavar="PATH", help="also write the report to a JSON file")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve Prometheus metrics on this port while the load runs")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="record tracing spans and write them as a Chrome trace JSON file")
+    args = parser.parse_args(argv)
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.duration is not None:
+        if args.rate is None:
+            parser.error("--duration needs --rate")
+        args.requests = int(args.rate * args.duration)
+    if args.requests < 1 or args.concurrency < 1 or args.companies < 1:
+        parser.error("--requests, --concurrency and --companies must be at least 1")
+    if args.simulate:
+        args.mode = "async"
+    
+    latency = args.latency
+    if args.latency_cap is not None:
+        latency = LatencyModel(latency.kind, latency.seconds, latency.sigma, latency.alpha, args.latency_cap)
+    llm_backend = MockLLM(latency=latency, error_rate=args.error_rate, timeout=args.timeout, seed=args.seed)
+    rng = random.Random(args.seed)
+    companies = [f"Company {i}" for i in range(args.companies)]
+    
+    audit_trail = (AuditTrail(sink=RotatingJSONLAuditSink(args.audit_dir), retain_actions=False)
+                   if args.audit_dir else AuditTrail())
+    result_cache = WorkflowResultCache(args.result_cache_ttl) if args.result_cache_ttl else None
+    if args.trace_memory:
+        tracemalloc.start()
+    if args.trace:
+        tracer.enable()
+    metrics_server = start_metrics_server(args.metrics_port) if args.metrics_port is not None else None
+    
+    wall_start = time.perf_counter()
+    if args.mode == "thread":
+        orchestrator = AgentOrchestrator(llm=llm_backend, result_cache=result_cache, audit_trail=audit_trail)
+        report = run_threads(orchestrator, companies, args.requests, args.concurrency,
+                             args.rate, args.arrivals, rng)
+    else:
+        orchestrator = AsyncAgentOrchestrator(llm=llm_backend, result_cache=result_cache,
+                                              audit_trail=audit_trail)
+        run = run_async(orchestrator, companies, args.requests, args.concurrency,
+                        args.rate, args.arrivals, rng, args.sample_every)
+        report = run_simulated(run) if args.simulate else asyncio.run(run)
+    summary = audit_trail.get_summary()
+    audit_trail.close()
+    report = {
+        "scenario": {
+            "mode": "simulated" if args.simulate else args.mode, "requests": args.requests,
+            "concurrency": args.concurrency, "rate": args.rate,
+            "arrivals": args.arrivals if args.rate else None, "latency": asdict(latency),
+            "error_rate": args.error_rate, "timeout": args.timeout,
+            "result_cache_ttl": args.result_cache_ttl,
+        },
+        **report,
+        "wall_seconds": round(time.perf_counter() - wall_start, 3),
+        "memory_kb": memory_kb(),
+        "cache": summary["cache"],
+        "step_latency_ms": summary["step_latency_ms"],
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.trace:
+        tracer.export(args.trace)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,1444 @@
+"""
+JPMC Financial Research Agent System - TESTS
+(Run: python -m pytest -q)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import benchmark_agent_system as benchmarks
+import demo_agent_system as agents
+import loadgen_agent_system as loadgen
+from demo_agent_system import AgentAction, AgentOrchestrator, AgentRole, AuditTrail
+
+logging.getLogger(agents.__name__).setLevel(logging.CRITICAL)
+
+
+def make_action(index: int = 0, **overrides) -> AgentAction:
+    fields = dict(
+        timestamp=f"2024-01-01T00:00:{index % 60:02d}",
+        agent_role=AgentRole.RESEARCHER.value,
+        action_type="company_research",
+        input_data={"company_name": f"Company {index}"},
+        output_data={"summary": "..."},
+        tokens_used=10,
+        cost_usd=0.002,
+        success=True,
+        duration_ms=1.5
+    )
+    fields.update(overrides)
+    return AgentAction(**fields)
+
+
+def run_threads(target, count: int):
+    start_line = threading.Barrier(count)
+    
+    def run(n: int):
+        start_line.wait()
+        target(n)
+    
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_audit_trail_totals_exact_under_64_concurrent_writers():
+    trail = AuditTrail(tamper_evident=True, checkpoint_every=64)
+    writers, per_writer = 64, 500
+    
+    def write(n: int):
+        for i in range(per_writer):
+            trail.log_action(make_action(n * per_writer + i))
+    
+    run_threads(write, writers)
+    expected = writers * per_writer
+    summary = trail.get_summary()
+    assert summary["total_actions"] == expected
+    assert summary["total_tokens"] == expected * 10
+    assert summary["total_cost_usd"] == round(expected * 0.002, 4)
+    assert summary["actions_by_agent"][AgentRole.RESEARCHER.value] == expected
+    assert summary["successful_actions"] == expected
+    assert len(trail.actions) == expected
+    # Threads beyond shard_count share shards; every chain must still verify
+    report = agents.verify_audit_actions(trail.actions, trail.integrity_manifest(), executor="thread")
+    assert report["valid"], report["errors"]
+
+
+def test_audit_trail_shards_bounded_across_thread_churn():
+    orchestrator = AgentOrchestrator()
+    for _ in range(10):
+        orchestrator.research_many([f"Company {i}" for i in range(8)], max_workers=4)
+        orchestrator.research_pipeline([f"Company {i}" for i in range(4)])
+    trail = orchestrator.audit_trail
+    assert len(trail._shards) <= trail.shard_count
+    assert trail.get_summary()["total_actions"] == 10 * 12 * 3
+    seqs = [list(shard.seqs) for shard in trail._shards]
+    assert all(s == sorted(s) for s in seqs)
+
+
+def test_rotating_sink_recovers_from_partially_written_line(tmp_path):
+    sink = agents.RotatingJSONLAuditSink(str(tmp_path), codec="gzip")
+    for i in range(3):
+        sink.write(make_action(i))
+    sink.flush()
+    active = os.path.join(str(tmp_path), sink.segments()[-1]["file"])
+    # Simulate a crash mid-write: the process dies without closing the sink
+    with open(active, "a", encoding="utf-8") as f:
+        f.write('{"timestamp": "2024-01-01T00:01:00", "agent_ro')
+    
+    assert len(list(agents.read_audit_segments(str(tmp_path)))) == 3
+    assert AuditTrail.from_segments(str(tmp_path)).get_summary()["total_actions"] == 3
+    reopened = agents.RotatingJSONLAuditSink(str(tmp_path), codec="gzip")
+    assert reopened.get_summary()["total_actions"] == 3
+    reopened.write(make_action(3))
+    reopened.close()
+    assert len(list(agents.read_audit_segments(str(tmp_path)))) == 4
+
+
+def test_corrupt_line_before_the_end_still_raises(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    path.write_text('{"broken\n' + json.dumps(make_action().to_dict()) + "\n")
+    with pytest.raises(json.JSONDecodeError):
+        list(agents.read_audit_jsonl(str(path)))
+
+
+def test_trail_rebuilt_from_jsonl_streams_actions_from_the_file(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    trail = AuditTrail(sink=agents.JSONLAuditSink(path), retain_actions=False)
+    for i in range(5):
+        trail.log_action(make_action(i, success=i != 2))
+    trail.close()
+    
+    rebuilt = AuditTrail.from_jsonl(path)
+    assert rebuilt.get_summary()["total_actions"] == 5
+    assert len(list(rebuilt.iter_actions())) == 5
+    assert len(rebuilt.query(success=False)) == 1
+    export = str(tmp_path / "export.json")
+    rebuilt.export_to_file(export)
+    with open(export) as f:
+        assert len(json.load(f)["actions"]) == 5
+
+
+class DroppingLLM(agents.MockLLM):
+    """Backend that loses the last response of every batch"""
+    
+    def generate_batch(self, requests):
+        return super().generate_batch(requests)[:-1]
+    
+    async def agenerate_batch(self, requests):
+        return (await super().agenerate_batch(requests))[:-1]
+
+
+def test_micro_batching_fails_callers_left_without_a_response():
+    llm = agents.MicroBatchingLLM(DroppingLLM(), max_batch_size=2, max_wait_ms=50)
+    outcomes = []
+    
+    def call(n: int):
+        try:
+            outcomes.append(llm.generate(agents.LLMRequest.for_research(f"Company {n}")))
+        except agents.LLMBackendError as e:
+            outcomes.append(e)
+    
+    worker = threading.Thread(target=run_threads, args=(call, 2))
+    worker.start()
+    worker.join(timeout=5)
+    llm.close()
+    assert not worker.is_alive()
+    assert len(outcomes) == 2
+    assert all(isinstance(o, agents.LLMBackendError) for o in outcomes)
+
+
+def test_micro_batching_async_fails_callers_left_without_a_response():
+    llm = agents.MicroBatchingLLM(DroppingLLM(), max_batch_size=2, max_wait_ms=50)
+    
+    async def main():
+        calls = [llm.agenerate(agents.LLMRequest.for_research(f"Company {n}")) for n in range(2)]
+        return await asyncio.wait_for(asyncio.gather(*calls, return_exceptions=True), timeout=5)
+    
+    outcomes = asyncio.run(main())
+    assert all(isinstance(o, agents.LLMBackendError) for o in outcomes)
+
+
+def test_tracer_keeps_no_per_task_state_beyond_the_span_buffer():
+    tracer = agents.Tracer(max_spans=100)
+    tracer.enable()
+    
+    async def workflow(n: int):
+        with tracer.span("workflow", company=f"Company {n}"):
+            with tracer.span("step.research"):
+                await asyncio.sleep(0)
+    
+    async def main():
+        for _ in range(30):
+            await asyncio.gather(*(workflow(n) for n in range(100)))
+    
+    asyncio.run(main())
+    trace = tracer.to_chrome_trace()
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    lanes = [e for e in trace["traceEvents"] if e["ph"] == "M"]
+    assert len(spans) == 100
+    # All 100 tasks of a round overlap, so no more lanes than that are needed
+    assert len(lanes) <= 100
+
+
+def test_metrics_shards_bounded_and_exact_across_thread_churn():
+    registry = agents.MetricsRegistry()
+    counter = registry.counter("test_events_total", "Test events", ("kind",))
+    histogram = registry.histogram("test_seconds", "Test durations")
+    for _ in range(20):
+        def record(n: int):
+            for _ in range(100):
+                counter.inc("a")
+                histogram.observe(0.01)
+        run_threads(record, 8)
+    assert len(counter._shards) <= agents._METRIC_SHARDS
+    assert counter.value("a") == 20 * 8 * 100
+    assert "test_seconds_count 16000" in registry.render()
+
+
+class ExplodingAgent:
+    def research_company(self, company_name):
+        raise KeyboardInterrupt
+
+
+def test_workflows_in_flight_returns_to_zero_when_a_workflow_raises():
+    in_flight = agents.metrics.get("agent_workflows_in_flight")
+    before = in_flight.value()
+    orchestrator = AgentOrchestrator()
+    orchestrator.researcher = ExplodingAgent()
+    with pytest.raises(KeyboardInterrupt):
+        orchestrator.research_investment("Apple")
+    assert in_flight.value() == before
+
+
+class OtherModelLLM(agents.MockLLM):
+    model_id = "other-model"
+    
+    def generate_batch(self, requests):
+        return [f"other: {r.task}" for r in requests]
+
+
+def test_llm_cache_keys_include_the_backend_model(tmp_path):
+    cache = agents.LLMResponseCache(str(tmp_path / "llm.sqlite3"))
+    request = agents.LLMRequest.for_research("Apple")
+    mock = agents.CachingLLM(agents.MockLLM(), cache)
+    other = agents.CachingLLM(agents.MicroBatchingLLM(OtherModelLLM()), cache)
+    assert other.model_id == "other-model"
+    first = mock.generate(request)
+    assert other.generate(request) == "other: research"
+    assert cache.hits == 0
+    assert mock.generate(request) == first
+    assert cache.hits == 1
+    other.llm.close()
+
+
+class FlakySink(agents.JSONLAuditSink):
+    """Sink whose first `failures` batch writes raise"""
+    
+    def __init__(self, path, failures):
+        super().__init__(path)
+        self.failures = failures
+    
+    def write_batch(self, actions):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk unavailable")
+        super().write_batch(actions)
+
+
+def test_background_writer_retries_a_failed_batch(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    writer = agents.BackgroundAuditWriter(FlakySink(path, failures=2), retry_delay=0)
+    for i in range(10):
+        writer.write(make_action(i))
+    assert writer.flush(timeout=5)
+    writer.close()
+    assert writer.get_stats()["write_errors"] == 2
+    assert len(list(agents.read_audit_jsonl(path))) == 10
+
+
+def test_background_writer_reports_actions_it_could_not_write(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    writer = agents.BackgroundAuditWriter(FlakySink(path, failures=100), max_retries=1, retry_delay=0)
+    writer.write(make_action())
+    with pytest.raises(agents.AuditWriteError):
+        writer.flush(timeout=5)
+    assert writer.get_stats()["unwritten_actions"] == 1
+    with pytest.raises(agents.AuditWriteError):
+        writer.close()
+    assert writer.get_stats()["actions_lost"] == 1
+
+
+def test_background_writer_never_accepts_a_write_it_will_not_drain(tmp_path):
+    for _ in range(20):
+        sink = agents.JSONLAuditSink(str(tmp_path / "audit.jsonl"))
+        writer = agents.BackgroundAuditWriter(sink)
+        accepted = []
+        
+        def write(n: int):
+            if n == 0:
+                writer.close()
+                return
+            for i in range(50):
+                try:
+                    writer.write(make_action(i))
+                except RuntimeError:
+                    return
+                accepted.append(i)
+        
+        run_threads(write, 4)
+        assert writer.get_stats()["actions_written"] == len(accepted)
+        os.remove(sink.path)
+
+
+@pytest.mark.parametrize("retain_actions", [True, False])
+def test_verify_audit_export_streams_the_export(tmp_path, retain_actions):
+    sink = agents.JSONLAuditSink(str(tmp_path / "audit.jsonl"))
+    trail = AuditTrail(sink=sink, retain_actions=retain_actions, tamper_evident=True, checkpoint_every=8)
+    run_threads(lambda n: [trail.log_action(make_action(n * 50 + i)) for i in range(50)], 4)
+    export = str(tmp_path / "export.json")
+    trail.export_to_file(export)
+    trail.close()
+    
+    # A tiny chunk size makes every value straddle a read boundary
+    with open(export, encoding="utf-8") as f:
+        manifest, actions = agents._stream_audit_export(f, chunk_size=7)
+        assert manifest == trail.integrity_manifest()
+        assert len(list(actions)) == 200
+    report = agents.verify_audit_export(export, max_workers=2, executor="thread")
+    assert report["valid"], report["errors"]
+    assert report["actions_checked"] == 200
+    
+    with open(export, encoding="utf-8") as f:
+        tampered = f.read().replace('"tokens_used": 10', '"tokens_used": 11', 1)
+    with open(export, "w", encoding="utf-8") as f:
+        f.write(tampered)
+    assert not agents.verify_audit_export(export, max_workers=2, executor="thread")["valid"]
+
+
+class LeakingLLM(agents.MockLLM):
+    """Streams a restricted phrase a few chunks into every response"""
+    
+    def _respond(self, request):
+        return "x" * 200 + " guaranteed returns " + super()._respond(request)
+
+
+@pytest.mark.parametrize("agent_cls", [agents.ResearchAgent, agents.AnalysisAgent])
+def test_stopped_generation_is_charged_for_its_partial_output(agent_cls):
+    trail = AuditTrail()
+    agent = agent_cls(trail, LeakingLLM())
+    scanner = agents.StreamingComplianceCheck()
+    if agent_cls is agents.ResearchAgent:
+        agent.research_company_streaming("Apple", scanner)
+    else:
+        agent.analyze_investment_potential_streaming("summary", "Apple", scanner)
+    action = trail.actions[0]
+    assert action.output_data["stopped_early"]
+    assert 0 < action.cost_usd < agent.RESPONSE_COST_USD
+    # The phrase arrives in the fourth 64-character chunk, so 256 characters were generated
+    assert action.tokens_used == 64
+    assert action.cost_usd + action.output_data["estimated_savings_usd"] == pytest.approx(agent.RESPONSE_COST_USD)
+
+
+class InterruptOnceOrchestrator(AgentOrchestrator):
+    """Leader's first workflow is interrupted once followers have joined it"""
+    
+    def __init__(self, joined: threading.Event):
+        super().__init__()
+        self.joined = joined
+        self.calls = 0
+    
+    def research_investment(self, company_name):
+        self.calls += 1
+        if self.calls == 1:
+            self.joined.wait(5)
+            raise KeyboardInterrupt
+        return super().research_investment(company_name)
+
+
+def test_coalescer_reruns_for_followers_when_the_leader_is_interrupted():
+    joined = threading.Event()
+    coalescer = agents.RequestCoalescer(InterruptOnceOrchestrator(joined))
+    outcomes = []
+    
+    def call(n: int):
+        try:
+            outcomes.append(coalescer.research_investment("Apple"))
+        except KeyboardInterrupt as e:
+            outcomes.append(e)
+    
+    leader = threading.Thread(target=call, args=(0,))
+    leader.start()
+    while not coalescer._in_flight:
+        pass
+    followers = [threading.Thread(target=call, args=(n,)) for n in range(1, 4)]
+    for t in followers:
+        t.start()
+    while coalescer.get_stats()["coalesced_hits"] < 3:
+        pass
+    joined.set()
+    for t in [leader, *followers]:
+        t.join(5)
+    interrupts = [o for o in outcomes if isinstance(o, KeyboardInterrupt)]
+    assert len(interrupts) == 1
+    assert all(o["success"] for o in outcomes if not isinstance(o, KeyboardInterrupt))
+    stats = coalescer.get_stats()
+    # Followers that miss the rerun lead their own, so only the totals are fixed
+    assert stats["workflows_started"] >= 2
+    assert stats["workflows_started"] + stats["coalesced_hits"] == 4
+    assert stats["in_flight"] == 0
+
+
+class SlowAsyncOrchestrator(agents.AsyncAgentOrchestrator):
+    async def research_investment_async(self, company_name):
+        await asyncio.sleep(0.05)
+        return await super().research_investment_async(company_name)
+
+
+def test_coalescer_async_followers_survive_a_cancelled_leader():
+    async def main():
+        coalescer = agents.RequestCoalescer(SlowAsyncOrchestrator())
+        leader = asyncio.ensure_future(coalescer.research_investment_async("Apple"))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(coalescer.research_investment_async("apple")) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*followers), timeout=5)
+        assert leader.cancelled()
+        assert all(r["success"] for r in results)
+        assert coalescer.get_stats()["workflows_started"] == 2
+    
+    asyncio.run(main())
+
+
+def test_result_cache_serves_a_repeat_request_as_a_zero_cost_hit():
+    orchestrator = AgentOrchestrator(result_cache=agents.WorkflowResultCache())
+    first = orchestrator.research_investment("Apple")
+    cost = orchestrator.audit_trail.get_summary()["total_cost_usd"]
+    second = orchestrator.research_investment(" apple ")
+    assert second["final_output"] == first["final_output"]
+    summary = orchestrator.audit_trail.get_summary()
+    assert summary["total_cost_usd"] == cost
+    assert summary["actions_by_type"]["cache_hit"] == 1
+    assert orchestrator.result_cache.get_stats()["hits"] == 1
+
+
+def test_result_cache_entries_expire_after_the_ttl():
+    clock = agents.VirtualClock()
+    with agents.use_clock(clock):
+        cache = agents.WorkflowResultCache(ttl_seconds=60)
+        key = cache.make_key("Apple", "1")
+        cache.put(key, {"success": True})
+        clock.advance(59)
+        assert cache.get(key) is not None
+        clock.advance(2)
+        assert cache.get(key) is None
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_result_cache_evicts_the_least_recently_used_entry():
+    cache = agents.WorkflowResultCache(max_entries=2)
+    for name in ("Apple", "Microsoft"):
+        cache.put(cache.make_key(name, "1"), {"company_name": name})
+    cache.get(cache.make_key("Apple", "1"))
+    cache.put(cache.make_key("Tesla", "1"), {"company_name": "Tesla"})
+    assert cache.get(cache.make_key("Microsoft", "1")) is None
+    assert cache.get(cache.make_key("Apple", "1")) is not None
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_result_cache_is_invalidated_by_a_workflow_version_bump():
+    cache = agents.WorkflowResultCache()
+    AgentOrchestrator(result_cache=cache).research_investment("Apple")
+    
+    class NextVersion(AgentOrchestrator):
+        WORKFLOW_VERSION = "2"
+    
+    orchestrator = NextVersion(result_cache=cache)
+    orchestrator.research_investment("Apple")
+    assert "cache_hit" not in orchestrator.audit_trail.get_summary()["actions_by_type"]
+    assert cache.get_stats()["entries"] == 2
+
+
+@pytest.mark.parametrize("run", [
+    lambda o, companies: o.research_pipeline(companies),
+    lambda o, companies: o.research_many(companies, max_workers=2, executor="process"),
+], ids=["pipeline", "process"])
+def test_result_cache_is_used_by_pipeline_and_process_runs(run):
+    orchestrator = AgentOrchestrator(result_cache=agents.WorkflowResultCache())
+    orchestrator.research_investment("Apple")
+    cost = orchestrator.audit_trail.get_summary()["total_cost_usd"]
+    
+    report = run(orchestrator, ["Apple", "Microsoft"])
+    assert [r["company_name"] for r in report["results"]] == ["Apple", "Microsoft"]
+    summary = orchestrator.audit_trail.get_summary()
+    assert summary["actions_by_type"]["cache_hit"] == 1
+    assert summary["total_cost_usd"] == round(cost * 2, 4)
+    # Workflows run elsewhere are stored back in this orchestrator's cache
+    assert orchestrator.result_cache.get_stats()["entries"] == 2
+
+
+@pytest.mark.parametrize("retain_actions", [True, False])
+def test_export_taken_while_writers_run_still_verifies(tmp_path, retain_actions):
+    sink = agents.JSONLAuditSink(str(tmp_path / "audit.jsonl"))
+    # Fewer shards than writers, so chains are shared between threads
+    trail = AuditTrail(sink=sink, retain_actions=retain_actions, tamper_evident=True,
+                       checkpoint_every=16, shard_count=2)
+    done = threading.Event()
+    
+    def write(n: int):
+        for i in range(2000):
+            if done.is_set():
+                return
+            trail.log_action(make_action(n * 2000 + i))
+    
+    writers = threading.Thread(target=run_threads, args=(write, 6))
+    writers.start()
+    try:
+        while trail.total_actions < 1000:
+            pass
+        reports = []
+        for n in range(3):
+            export = str(tmp_path / f"export-{n}.json")
+            trail.export_to_file(export)
+            reports.append(agents.verify_audit_export(export, executor="thread"))
+    finally:
+        done.set()
+        writers.join()
+        trail.close()
+    for report in reports:
+        assert report["valid"], report["errors"][:3]
+        assert report["actions_checked"] >= 1000
+
+
+class LateLeakingLLM(agents.MockLLM):
+    """Ends every response with a restricted phrase, so streaming stops on the last chunk"""
+    
+    def _respond(self, request):
+        return super()._respond(request) + " guaranteed returns"
+
+
+@pytest.mark.parametrize("agent_cls", [agents.ResearchAgent, agents.AnalysisAgent])
+def test_stopped_generation_never_costs_more_than_completing_it(agent_cls):
+    trail = AuditTrail()
+    agent = agent_cls(trail, LateLeakingLLM())
+    if agent_cls is agents.ResearchAgent:
+        agent.research_company("Apple")
+        agent.research_company_streaming("Apple", agents.StreamingComplianceCheck())
+    else:
+        agent.analyze_investment_potential("summary", "Apple")
+        agent.analyze_investment_potential_streaming("summary", "Apple", agents.StreamingComplianceCheck())
+    completed, stopped = trail.actions
+    assert completed.success and stopped.output_data["stopped_early"]
+    assert 0 < stopped.tokens_used <= completed.tokens_used
+    assert 0 < stopped.cost_usd <= completed.cost_usd
+
+
+def test_jsonl_sink_flushes_buffered_actions_without_further_writes(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    sink = agents.JSONLAuditSink(path, flush_every=1000, flush_interval_seconds=0.05)
+    try:
+        sink.write(make_action())
+        assert os.path.getsize(path) == 0
+        deadline = time.monotonic() + 2
+        while os.path.getsize(path) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(list(agents.read_audit_jsonl(path))) == 1
+    finally:
+        sink.close()
+
+
+def test_rotating_sink_compresses_closed_segments_off_the_write_path(tmp_path, monkeypatch):
+    release = threading.Event()
+    compress = agents._compress_file
+    
+    def slow_compress(*args):
+        release.wait(5)
+        compress(*args)
+    
+    monkeypatch.setattr(agents, "_compress_file", slow_compress)
+    sink = agents.RotatingJSONLAuditSink(str(tmp_path), max_segment_bytes=2000, codec="gzip")
+    written = threading.Event()
+    
+    def write():
+        for i in range(40):
+            sink.write(make_action(i))
+        written.set()
+    
+    threading.Thread(target=write).start()
+    # Several rotations happen while the first compression is still held up
+    assert written.wait(5)
+    segments = sink.segments()
+    assert len(segments) > 2
+    assert all(s["codec"] is None for s in segments)
+    release.set()
+    sink.close()
+    segments = sink.segments()
+    assert all(s["codec"] == "gzip" and s["file"].endswith(".gz") for s in segments)
+    assert sorted(os.listdir(str(tmp_path))) == sorted([s["file"] for s in segments] + ["manifest.json"])
+    assert len(list(agents.read_audit_segments(str(tmp_path)))) == 40
+
+
+def test_jsonl_sink_counts_bytes_not_characters(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    sink = agents.JSONLAuditSink(path)
+    sink.write(make_action(input_data={"company_name": "Société Générale — 株式会社"}))
+    sink.close()
+    assert sink.bytes_written == os.path.getsize(path)
+
+
+OVERLAPPING_PHRASES = {"a": ["he", "she", "hers", "his"], "b": ["she", "Her Share", "ş"]}
+
+
+def naive_matches(text, phrases):
+    lowered = agents._lower_keeping_offsets(text)
+    found = []
+    for order, (category, phrase) in enumerate((c, p) for c, ps in phrases.items() for p in ps):
+        key = phrase.lower()
+        for start in range(len(lowered) - len(key) + 1):
+            if lowered[start:start + len(key)] == key:
+                found.append((start + len(key), -len(key), order, phrase, category))
+    return [agents.PhraseMatch(phrase, category, end + neg, end)
+            for end, neg, _, phrase, category in sorted(found)]
+
+
+@pytest.mark.parametrize("automaton", [False, True])
+def test_phrase_matcher_agrees_with_naive_matching(automaton):
+    matcher = agents.PhraseMatcher(OVERLAPPING_PHRASES, automaton=automaton)
+    texts = ["USHERS SHE HIS hershe", "İstanbul: she said HER SHARE, ŞHE", "", "hhhhershers"]
+    for text in texts:
+        assert matcher.find_all(text) == naive_matches(text, OVERLAPPING_PHRASES)
+    assert [m.phrase for m in matcher.find_all("USHERS")] == ["she", "she", "he", "hers"]
+
+
+@pytest.mark.parametrize("automaton", [False, True])
+def test_phrase_stream_finds_phrases_split_across_chunks(automaton):
+    matcher = agents.PhraseMatcher(OVERLAPPING_PHRASES, automaton=automaton)
+    text = "İ ushers her share, she said; his hers"
+    expected = naive_matches(text, OVERLAPPING_PHRASES)
+    for size in range(1, 8):
+        stream = matcher.stream()
+        found = []
+        for start in range(0, len(text), size):
+            found.extend(stream.feed(text[start:start + size]))
+        assert found == expected, size
+
+
+def test_compliance_matcher_stays_on_the_find_path():
+    assert not agents.ComplianceCheck.get_matcher().uses_automaton
+    assert agents.ComplianceCheck.validate_output("We offer GUARANTEED Returns") == (
+        False, "Output contains restricted keyword: 'guaranteed returns'")
+    assert agents.ComplianceCheck.validate_output("You should buy. Not financial advice.") == (True, None)
+
+
+def test_llm_cache_hits_only_write_once_the_access_time_is_stale(tmp_path):
+    cache = agents.LLMResponseCache(str(tmp_path / "llm.sqlite3"), touch_interval_seconds=60)
+    cache.put("key", "response")
+    conn = cache._connect()
+    
+    def last_access():
+        return conn.execute("SELECT last_access FROM responses WHERE key = 'key'").fetchone()[0]
+    
+    stored = last_access()
+    changes = conn.total_changes
+    for _ in range(10):
+        assert cache.get("key") == "response"
+    assert conn.total_changes == changes
+    assert last_access() == stored
+    
+    conn.execute("UPDATE responses SET last_access = last_access - 120")
+    assert cache.get("key") == "response"
+    assert last_access() > stored - 120
+
+
+def test_caching_llm_keeps_sqlite_off_the_event_loop(tmp_path, monkeypatch):
+    cache = agents.LLMResponseCache(str(tmp_path / "llm.sqlite3"))
+    llm = agents.CachingLLM(agents.MockLLM(), cache)
+    threads = set()
+    for name in ("get", "put"):
+        original = getattr(cache, name)
+        
+        def recorded(*args, _original=original):
+            threads.add(threading.get_ident())
+            return _original(*args)
+        
+        monkeypatch.setattr(cache, name, recorded)
+    
+    async def main():
+        await llm.agenerate(agents.LLMRequest.for_research("Apple"))
+        await llm.agenerate(agents.LLMRequest.for_research("Apple"))
+        return threading.get_ident()
+    
+    loop_thread = asyncio.run(main())
+    assert threads and loop_thread not in threads
+    assert cache.hits == 1
+
+
+def test_sqlite_audit_store_rollups_match_the_in_memory_trail(tmp_path):
+    store = agents.SQLiteAuditStore(str(tmp_path / "audit.sqlite3"))
+    orchestrator = AgentOrchestrator(audit_trail=AuditTrail(sink=store))
+    orchestrator.research_many(["Apple", "Microsoft", "Tesla", "Amazon"], max_workers=2)
+    orchestrator.audit_trail.log_action(make_action(success=False, cost_usd=0.0, tokens_used=0))
+    
+    conn = store._connect()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    rollup = conn.execute("SELECT SUM(n), SUM(tokens), SUM(cost) FROM action_rollup").fetchone()
+    raw = conn.execute("SELECT COUNT(*), SUM(tokens_used), SUM(cost_usd) FROM actions").fetchone()
+    assert rollup[:2] == raw[:2] and rollup[2] == pytest.approx(raw[2])
+    
+    expected = orchestrator.audit_trail.get_summary()
+    summary = store.get_summary()
+    for key in summary:
+        assert summary[key] == expected[key], key
+    # Filtered summaries aggregate the matching rows instead of the rollup
+    failed = store.get_summary(success=False)
+    assert failed["total_actions"] == expected["failed_actions"] == 1
+    assert store.count(company="apple") == len(orchestrator.audit_trail.query(company="APPLE"))
+    
+    conn.execute("DELETE FROM actions WHERE success = 0")
+    assert store.get_summary()["total_actions"] == expected["total_actions"] - 1
+
+
+def write_audit_lines(path, actions, mode: str = "w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for action in actions:
+            f.write(json.dumps(action.to_dict()) + "\n")
+
+
+def minute_action(index: int, **overrides) -> AgentAction:
+    return make_action(index, timestamp=f"2024-01-01T00:{index // 60:02d}:{index % 60:02d}", **overrides)
+
+
+def test_mapped_audit_log_indexes_lines_appended_after_it_was_saved(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    write_audit_lines(path, [minute_action(i) for i in range(10)])
+    log = agents.MappedAuditLog(path, index_every=4)
+    assert len(log) == 10
+    log.close()
+    
+    # A partially written line stays unindexed until it is completed
+    write_audit_lines(path, [minute_action(i) for i in range(10, 17)], mode="a")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(minute_action(17).to_dict())[:20])
+    log = agents.MappedAuditLog(path, index_every=4)
+    assert len(log) == 17
+    with open(log.index_path, encoding="utf-8") as f:
+        assert json.load(f)["count"] == 17
+    assert [a.input_data["company_name"] for a in log[8:17]] == [f"Company {i}" for i in range(8, 17)]
+    assert log[-1].timestamp == minute_action(16).timestamp
+    
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(minute_action(17).to_dict())[20:] + "\n")
+    log.refresh()
+    assert len(log) == 18
+    assert log[17] == minute_action(17)
+    log.close()
+
+
+def test_mapped_audit_log_rebuilds_a_stale_index(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    write_audit_lines(path, [minute_action(i) for i in range(12)])
+    agents.MappedAuditLog(path, index_every=4).close()
+    
+    # Rewritten in place, at least as long as before: the saved offsets are wrong
+    write_audit_lines(path, [minute_action(i, action_type="rewritten") for i in range(100, 115)])
+    log = agents.MappedAuditLog(path, index_every=4)
+    assert len(log) == 15
+    assert [a.action_type for a in log[:]] == ["rewritten"] * 15
+    assert log[14].input_data["company_name"] == "Company 114"
+    log.close()
+    
+    # Truncated below the indexed size
+    write_audit_lines(path, [minute_action(i) for i in range(3)])
+    log = agents.MappedAuditLog(path, index_every=4)
+    assert [a.timestamp for a in log[:]] == [minute_action(i).timestamp for i in range(3)]
+    log.close()
+    
+    # An index saved with a different block size is ignored
+    log = agents.MappedAuditLog(path, index_every=2)
+    assert len(log) == 3 and len(log._index["blocks"]) == 2
+    log.close()
+
+
+def test_mapped_audit_log_scan_is_exact_at_index_block_boundaries(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    actions = [minute_action(i) for i in range(13)]
+    write_audit_lines(path, actions)
+    log = agents.MappedAuditLog(path, index_every=4, persist_index=False)
+    timestamps = [a.timestamp for a in actions]
+    # Every block's first and last timestamp, plus values between and outside them
+    bounds = [None, "2023-12-31T23:59:59", "2024-01-01T00:00:03.5", "2024-01-01T00:01:00"] + timestamps
+    for since in bounds:
+        for until in bounds:
+            expected = [a for a in actions
+                        if (since is None or a.timestamp >= since) and (until is None or a.timestamp < until)]
+            assert list(log.scan(since, until)) == expected, (since, until)
+    
+    assert list(log.scan(agents.datetime(2024, 1, 1, 0, 0, 4), agents.datetime(2024, 1, 1, 0, 0, 8))) == actions[4:8]
+    log.close()
+
+
+def test_pipeline_times_and_traces_every_stage_like_research_investment():
+    agents.tracer.clear()
+    agents.tracer.enable()
+    try:
+        orchestrator = AgentOrchestrator()
+        companies = [f"Company {i}" for i in range(5)]
+        run = orchestrator.research_pipeline(companies)
+        spans = agents.tracer.spans()
+    finally:
+        agents.tracer.disable()
+        agents.tracer.clear()
+    
+    assert run["completed"] == 5
+    latency = run["audit_summary"]["step_latency_ms"]
+    assert {step: latency[step]["count"] for step in latency} == {
+        "workflow": 5, "research": 5, "analysis": 5, "compliance": 5
+    }
+    (pipeline,) = [s for s in spans if s["name"] == "pipeline"]
+    for step in ("research", "analysis", "compliance"):
+        step_spans = [s for s in spans if s["name"] == f"step.{step}"]
+        assert sorted(s["attributes"]["company"] for s in step_spans) == companies
+        assert all(s["parent_id"] == pipeline["span_id"] for s in step_spans)
+    step_ids = {s["span_id"] for s in spans if s["name"].startswith("step.")}
+    llm_spans = [s for s in spans if s["name"].startswith(("llm.", "compliance."))]
+    assert len(llm_spans) == 15 and all(s["parent_id"] in step_ids for s in llm_spans)
+
+
+class ShuffledDelayLLM(agents.MockLLM):
+    """Backend whose latency varies by company, so later inputs can finish first"""
+    
+    def generate_batch(self, requests):
+        time.sleep(0.002 * (hash(requests[0].company_name) % 5))
+        return super().generate_batch(requests)
+
+
+def test_pipeline_applies_backpressure_and_returns_results_in_input_order(monkeypatch):
+    orchestrator = AgentOrchestrator(llm=ShuffledDelayLLM())
+    review = orchestrator.compliance.review_output
+    
+    def slow_review(**kwargs):
+        time.sleep(0.005)
+        return review(**kwargs)
+    
+    monkeypatch.setattr(orchestrator.compliance, "review_output", slow_review)
+    companies = [f"Company {i}" for i in range(24)]
+    run = orchestrator.research_pipeline(companies, research_workers=3, analysis_workers=3,
+                                         compliance_workers=1, queue_size=2)
+    
+    assert run["completed"] == 24
+    assert [r["company_name"] for r in run["results"]] == companies
+    assert [s["company_name"] for s in run["statuses"]] == companies
+    stats = run["stage_stats"]
+    # The slow compliance stage fills its bounded queue and stalls analysis upstream
+    assert all(st["max_queue_depth"] <= 2 for st in stats.values())
+    assert stats["compliance"]["max_queue_depth"] == 2
+    assert stats["analysis"]["backpressure_seconds"] > 0
+    assert stats["compliance"]["processed"] == 24
+
+
+def test_process_runs_merge_worker_step_latencies():
+    companies = [f"Company {i}" for i in range(4)]
+    threaded = AgentOrchestrator().research_many(companies, max_workers=2)
+    orchestrator = AgentOrchestrator()
+    run = orchestrator.research_many(companies, max_workers=2, executor="process")
+    assert run["completed"] == 4
+    latency = run["audit_summary"]["step_latency_ms"]
+    expected = threaded["audit_summary"]["step_latency_ms"]
+    assert {step: s["count"] for step, s in latency.items()} == {step: s["count"] for step, s in expected.items()}
+    assert {step: s["count"] for step, s in latency.items()} == {
+        "workflow": 4, "research": 4, "analysis": 4, "compliance": 4
+    }
+    assert all(s["max"] > 0 for s in latency.values())
+    assert orchestrator.audit_trail.get_summary()["step_latency_ms"] == latency
+
+
+class ConcurrencyTrackingLLM(agents.MockLLM):
+    """Async backend that records how many calls were in flight at once"""
+    
+    def __init__(self):
+        super().__init__()
+        self.in_flight = 0
+        self.peak = 0
+    
+    async def agenerate(self, request):
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            return await super().agenerate(request)
+        finally:
+            self.in_flight -= 1
+
+
+def strip_timing(action: AgentAction) -> tuple:
+    return (action.agent_role, action.action_type, json.dumps(action.input_data, sort_keys=True),
+            json.dumps(action.output_data, sort_keys=True), action.tokens_used, action.cost_usd, action.success)
+
+
+def test_async_orchestrator_overlaps_workflows_and_matches_the_sync_workflow():
+    companies = [f"Company {i}" for i in range(12)]
+    llm = ConcurrencyTrackingLLM()
+    orchestrator = agents.AsyncAgentOrchestrator(llm=llm)
+    results = asyncio.run(orchestrator.research_many_async(companies, max_concurrency=4))
+    
+    # Workflows interleave on the loop, but never more than max_concurrency at once
+    assert llm.peak == 4
+    assert [r["company_name"] for r in results] == companies
+    sync = AgentOrchestrator()
+    expected = [sync.research_investment(company) for company in companies]
+    for got, want in zip(results, expected):
+        assert {k: v for k, v in got.items() if k != "audit_summary"} == \
+            {k: v for k, v in want.items() if k != "audit_summary"}
+    assert sorted(map(strip_timing, orchestrator.audit_trail.actions)) == \
+        sorted(map(strip_timing, sync.audit_trail.actions))
+    summary = orchestrator.audit_trail.get_summary()
+    assert summary["total_actions"] == 36
+    assert summary["step_latency_ms"]["workflow"]["count"] == 12
+    
+    llm.peak = 0
+    asyncio.run(orchestrator.research_many_async(companies))
+    assert llm.peak == 12
+
+
+class RecordingBatchLLM(agents.MockLLM):
+    """Backend that records the size of every batch it is sent"""
+    
+    def __init__(self):
+        super().__init__()
+        self.batch_sizes = []
+    
+    def generate_batch(self, requests):
+        self.batch_sizes.append(len(requests))
+        return super().generate_batch(requests)
+    
+    async def agenerate_batch(self, requests):
+        self.batch_sizes.append(len(requests))
+        return await super().agenerate_batch(requests)
+
+
+def run_micro_batched(llm: agents.MicroBatchingLLM, count: int) -> list:
+    outputs = [None] * count
+    
+    def call(n: int):
+        outputs[n] = llm.generate(agents.LLMRequest.for_research(f"Company {n}"))
+    
+    run_threads(call, count)
+    return outputs
+
+
+def test_micro_batching_flushes_on_size_and_on_timeout():
+    backend = RecordingBatchLLM()
+    # A full batch goes out at once, however long max_wait is
+    llm = agents.MicroBatchingLLM(backend, max_batch_size=4, max_wait_ms=60_000)
+    started = time.monotonic()
+    outputs = run_micro_batched(llm, 8)
+    assert time.monotonic() - started < 5
+    assert backend.batch_sizes == [4, 4]
+    assert all(f"Company {n}" in output for n, output in enumerate(outputs))
+    llm.close()
+    
+    # A partial batch waits for max_wait past its oldest prompt, then goes out
+    backend.batch_sizes.clear()
+    llm = agents.MicroBatchingLLM(backend, max_batch_size=100, max_wait_ms=50)
+    started = time.monotonic()
+    outputs = run_micro_batched(llm, 3)
+    assert time.monotonic() - started >= 0.05
+    assert backend.batch_sizes == [3]
+    assert all(f"Company {n}" in output for n, output in enumerate(outputs))
+    assert llm.get_stats()["max_observed_batch_size"] == 3
+    llm.close()
+
+
+def test_micro_batching_async_flushes_on_size_and_on_timeout():
+    backend = RecordingBatchLLM()
+    
+    async def call_all(llm, count):
+        clock = agents.get_clock()
+        started = clock.monotonic()
+        outputs = await asyncio.gather(
+            *(llm.agenerate(agents.LLMRequest.for_research(f"Company {n}")) for n in range(count))
+        )
+        assert all(f"Company {n}" in output for n, output in enumerate(outputs))
+        return clock.monotonic() - started
+    
+    waited = agents.run_simulated(call_all(agents.MicroBatchingLLM(backend, max_batch_size=4,
+                                                                   max_wait_ms=60_000), 8))
+    assert waited == 0 and backend.batch_sizes == [4, 4]
+    
+    backend.batch_sizes.clear()
+    waited = agents.run_simulated(call_all(agents.MicroBatchingLLM(backend, max_batch_size=100,
+                                                                   max_wait_ms=50), 3))
+    assert waited == pytest.approx(0.05) and backend.batch_sizes == [3]
+
+
+def test_sharded_audit_trail_keeps_log_order_and_exact_summaries():
+    trail = AuditTrail(shard_count=4)
+    roles = [role.value for role in AgentRole]
+    writers, per_writer = 16, 300
+    next_number = iter(range(writers * per_writer))
+    order_lock = threading.Lock()
+    
+    def write(n: int):
+        for i in range(per_writer):
+            # Numbers are taken and logged under one lock, so log order is their order
+            with order_lock:
+                number = next(next_number)
+                trail.log_action(make_action(
+                    number, agent_role=roles[number % len(roles)], action_type=f"type-{number % 3}",
+                    success=number % 7 != 0, tokens_used=number % 11, cost_usd=(number % 5) / 1000,
+                    output_data={"writer": n, "i": i, "number": number}
+                ))
+            if i == per_writer // 2:
+                # Counters are maintained incrementally, so a mid-run summary is already exact
+                assert trail.get_summary()["total_actions"] >= number + 1
+    
+    run_threads(write, writers)
+    actions = trail.actions
+    assert len(trail._shards) == 4
+    assert [a.output_data["number"] for a in actions] == list(range(writers * per_writer))
+    for n in range(writers):
+        assert [a.output_data["i"] for a in actions if a.output_data["writer"] == n] == list(range(per_writer))
+    
+    summary = trail.get_summary()
+    assert summary["total_actions"] == len(actions)
+    assert summary["total_tokens"] == sum(a.tokens_used for a in actions)
+    assert summary["total_cost_usd"] == round(sum(a.cost_usd for a in actions), 4)
+    assert summary["successful_actions"] == sum(a.success for a in actions)
+    assert summary["failed_actions"] == sum(not a.success for a in actions)
+    assert summary["actions_by_agent"] == {role: sum(a.agent_role == role for a in actions) for role in roles}
+    assert summary["actions_by_type"] == {
+        t: sum(a.action_type == t for a in actions) for t in ("type-0", "type-1", "type-2")
+    }
+
+
+def test_columnar_action_log_round_trips_the_dataclass_layout(tmp_path):
+    actions = [
+        make_action(0),
+        make_action(1, timestamp="2024-03-05T10:20:30.123456", duration_ms=None),
+        make_action(2, timestamp="2024-03-05T10:20:30+00:00", duration_ms=0.0),
+        make_action(3, timestamp="2024-03-05T10:20:30.500000Z", success=False, error_message="boom"),
+        make_action(4, timestamp="not a timestamp", input_data={"company_name": "Société Générale ✓"},
+                    output_data={}, tokens_used=0, cost_usd=0.0),
+        make_action(5, integrity={"shard": 0, "link": "ab" * 32}, agent_role="custom_role",
+                    action_type="custom_type", tokens_used=2**40)
+    ]
+    log = agents.ColumnarActionLog(actions)
+    assert len(log) == len(actions)
+    assert list(log) == actions
+    assert [a.to_dict() for a in log] == [a.to_dict() for a in actions]
+    assert log[-1] == actions[-1] and log[1:4] == actions[1:4] and log[::2] == actions[::2]
+    with pytest.raises(IndexError):
+        log[len(actions)]
+    
+    # A compact trail is interchangeable with a list-backed one
+    trails = {compact: AuditTrail(compact=compact, tamper_evident=True) for compact in (False, True)}
+    for compact, trail in trails.items():
+        orchestrator = AgentOrchestrator(audit_trail=trail)
+        for i in range(6):
+            orchestrator.research_investment(f"Company {i}")
+        for action in actions:
+            trail.log_action(action)
+    plain, compact = trails[False], trails[True]
+    assert isinstance(compact._shards[0].actions, agents.ColumnarActionLog)
+    assert [strip_timing(a) for a in compact.actions] == [strip_timing(a) for a in plain.actions]
+    assert [a.timestamp for a in compact.actions][-6:] == [a.timestamp for a in actions]
+    summary_keys = ("total_actions", "total_tokens", "total_cost_usd", "actions_by_agent", "actions_by_type")
+    assert {k: compact.get_summary()[k] for k in summary_keys} == {k: plain.get_summary()[k] for k in summary_keys}
+    export = str(tmp_path / "compact.json")
+    compact.export_to_file(export)
+    assert agents.verify_audit_export(export)["valid"]
+
+
+def test_tracer_builds_workflow_span_trees_and_exports_a_chrome_trace(tmp_path):
+    agents.tracer.clear()
+    orchestrator = AgentOrchestrator()
+    orchestrator.research_investment("Company 0")
+    assert agents.tracer.spans() == []  # disabled by default
+    
+    agents.tracer.enable()
+    try:
+        run = orchestrator.research_many([f"Company {i}" for i in range(1, 5)], max_workers=4)
+        spans = agents.tracer.spans()
+        path = str(tmp_path / "trace.json")
+        agents.tracer.export(path)
+    finally:
+        agents.tracer.disable()
+        agents.tracer.clear()
+    
+    assert run["completed"] == 4
+    by_id = {s["span_id"]: s for s in spans}
+    workflows = [s for s in spans if s["name"] == "workflow"]
+    assert len(workflows) == 4 and all(s["parent_id"] is None for s in workflows)
+    for workflow in workflows:
+        tree = [s for s in spans if s["trace_id"] == workflow["span_id"]]
+        steps = sorted(s["name"] for s in tree if s["parent_id"] == workflow["span_id"])
+        assert steps == ["step.analysis", "step.compliance", "step.research"]
+        assert len(tree) == 7
+        calls = {by_id[s["parent_id"]]["name"]: s["name"] for s in tree if s["name"] not in steps + ["workflow"]}
+        assert calls == {"step.research": "llm.research", "step.analysis": "llm.analysis",
+                         "step.compliance": "compliance.review"}
+        # Token and cost usage rolls up from the LLM calls to the workflow
+        company = workflow["attributes"]["company"]
+        logged = [a for a in orchestrator.audit_trail.actions if a.input_data.get("company_name") == company]
+        assert workflow["attributes"]["tokens"] == sum(a.tokens_used for a in logged)
+        assert workflow["attributes"]["cost_usd"] == round(sum(a.cost_usd for a in logged), 6)
+    
+    with open(path) as f:
+        trace = json.load(f)
+    events = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    lanes = {e["tid"]: e["args"]["name"] for e in trace["traceEvents"] if e["ph"] == "M"}
+    assert len(events) == len(spans)
+    assert min(e["ts"] for e in events) == 0
+    assert {e["tid"] for e in events} <= set(lanes) and len(lanes) <= 4
+    events_by_id = {e["args"]["span_id"]: e for e in events}
+    for event in events:
+        assert event["dur"] >= 0 and event["cat"] == event["name"].split(".")[0]
+        parent = events_by_id.get(event["args"]["parent_id"])
+        if parent is not None:
+            # Children sit inside their parent on the parent's lane
+            assert event["tid"] == parent["tid"]
+            assert parent["ts"] <= event["ts"] and event["ts"] + event["dur"] <= parent["ts"] + parent["dur"]
+
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_latency_sketch_quantiles_stay_within_the_relative_error_bound(relative_accuracy):
+    rng = random.Random(7)
+    samples = {
+        "uniform": [rng.uniform(0.1, 500.0) for _ in range(20_000)],
+        "lognormal": [rng.lognormvariate(3.0, 1.5) for _ in range(20_000)],
+        "pareto": [0.5 * rng.paretovariate(1.1) for _ in range(20_000)],
+        "with_zeros": [0.0] * 500 + [rng.expovariate(0.1) for _ in range(1500)],
+    }
+    for name, values in samples.items():
+        sketch = agents.LatencySketch(relative_accuracy)
+        for value in values:
+            sketch.add(value)
+        ordered = sorted(values)
+        for q in (0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 0.999, 1.0):
+            exact = ordered[round(q * (len(ordered) - 1))]
+            assert abs(sketch.quantile(q) - exact) <= relative_accuracy * exact, (name, q)
+        assert sketch.max == ordered[-1] and sketch.count == len(values)
+        
+        # Merging the sketches of two halves is the same as sketching everything
+        halves = [agents.LatencySketch(relative_accuracy) for _ in range(2)]
+        for i, value in enumerate(values):
+            halves[i % 2].add(value)
+        merged = agents.LatencySketch.from_state(json.loads(json.dumps(halves[0].state())))
+        merged.merge(halves[1])
+        assert merged.state() == sketch.state()
+
+
+class EchoBackend:
+    """Minimal LLMBackend that is not a MockLLM and records every call"""
+    
+    model_id = "echo"
+    
+    def __init__(self):
+        self.calls = []
+    
+    def _respond(self, request):
+        return f"{request.task} for {request.company_name}: looks fine"
+    
+    def generate(self, request):
+        self.calls.append(("generate", request.task, 1))
+        return self._respond(request)
+    
+    def generate_batch(self, requests):
+        self.calls.append(("generate_batch", requests[0].task, len(requests)))
+        return [self._respond(r) for r in requests]
+    
+    async def agenerate(self, request):
+        return self.generate(request)
+    
+    async def agenerate_batch(self, requests):
+        return self.generate_batch(requests)
+
+
+def test_any_llm_backend_serves_the_agents_and_batches_whole_stages():
+    backend = EchoBackend()
+    assert isinstance(backend, agents.LLMBackend)
+    companies = [f"Company {i}" for i in range(5)]
+    orchestrator = AgentOrchestrator(llm=backend)
+    batched = orchestrator.research_batch(companies)
+    
+    # One backend call per stage for the whole batch, responses in request order
+    assert backend.calls == [("generate_batch", "research", 5), ("generate_batch", "analysis", 5)]
+    assert all(r["success"] for r in batched)
+    assert [r["research_summary"] for r in batched] == [f"research for {c}: looks fine" for c in companies]
+    
+    backend.calls.clear()
+    single = [orchestrator.research_investment(company) for company in companies]
+    assert backend.calls == [("generate", task, 1) for _ in companies for task in ("research", "analysis")]
+    for got, want in zip(batched, single):
+        assert {k: v for k, v in got.items() if k != "audit_summary"} == \
+            {k: v for k, v in want.items() if k != "audit_summary"}
+    
+    backend.calls.clear()
+    run = orchestrator.research_many(companies, max_workers=1, batch_size=2)
+    assert run["completed"] == 5
+    assert sorted(n for kind, task, n in backend.calls if task == "research") == [1, 2, 2]
+    assert {kind for kind, _, _ in backend.calls} == {"generate_batch"}
+
+
+def test_benchmark_baseline_round_trip_flags_only_real_regressions(tmp_path, capsys):
+    baseline_path = str(tmp_path / "baseline.json")
+    argv = ["workflow", "log_action", "get_summary", "--companies", "5", "--actions", "200",
+            "--iterations", "50", "--concurrency", "2"]
+    assert benchmarks.main(argv + ["--save-baseline", baseline_path]) == 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    assert baseline["scenario"]["companies"] == 5
+    for name, ops in (("workflow", 5), ("log_action", 200), ("get_summary", 50)):
+        result = baseline["results"][name]
+        assert result["operations"] == ops and result["concurrency"] == 2
+        latency = result["latency_ms"]
+        assert 0 <= latency["p50"] <= latency["p90"] <= latency["p99"] <= latency["max"]
+    assert benchmarks.main(argv + ["--baseline", baseline_path, "--threshold", "1000"]) == 0
+    
+    slower = json.loads(json.dumps(baseline["results"]))
+    slower["workflow"]["ops_per_sec"] = baseline["results"]["workflow"]["ops_per_sec"] / 2
+    slower["log_action"]["latency_ms"]["p99"] = baseline["results"]["log_action"]["latency_ms"]["p99"] * 3
+    slower["get_summary"]["peak_memory_kb"] = baseline["results"]["get_summary"]["peak_memory_kb"] * 1.1
+    regressions = benchmarks.find_regressions(slower, baseline, threshold=0.2)
+    assert [line.split(" ")[:2] for line in regressions] == [["workflow:", "ops_per_sec"], ["log_action:", "latency"]]
+    assert "p99" in regressions[1]
+    
+    # The CLI exits non-zero against a baseline this run cannot match
+    capsys.readouterr()
+    baseline["results"]["log_action"]["ops_per_sec"] *= 1000
+    with open(baseline_path, "w") as f:
+        json.dump(baseline, f)
+    assert benchmarks.main(argv + ["--baseline", baseline_path]) == 1
+    assert "log_action: ops_per_sec" in capsys.readouterr().out
+
+
+def test_simulated_llm_latency_distributions_and_failures(tmp_path, capsys):
+    rng = random.Random(3)
+    assert agents.LatencyModel.parse("fixed:0.2").sample(rng) == 0.2
+    lognormal = agents.LatencyModel.parse("lognormal:0.8,0.5")
+    draws = sorted(lognormal.sample(rng) for _ in range(20_000))
+    assert lognormal.sigma == 0.5 and draws[10_000] == pytest.approx(0.8, rel=0.05)
+    pareto = agents.LatencyModel.parse("pareto:0.3,1.2")
+    draws = sorted(pareto.sample(rng) for _ in range(20_000))
+    assert pareto.alpha == 1.2 and draws[0] >= 0.3 and draws[-1] > 10 * draws[10_000]
+    capped = agents.LatencyModel("pareto", 0.3, alpha=1.2, max_seconds=1.0)
+    assert max(capped.sample(rng) for _ in range(1000)) == 1.0
+    for spec in ("gamma:0.1", "fixed:"):
+        with pytest.raises(ValueError):
+            agents.LatencyModel.parse(spec)
+    
+    # Calls sleep for their latency; slow ones time out at the timeout instead
+    request = agents.LLMRequest.for_research("Company 0")
+    with agents.use_clock(agents.VirtualClock()) as clock:
+        agents.MockLLM(latency=agents.LatencyModel("fixed", 0.25)).generate(request)
+        assert clock.monotonic() == 0.25
+        with pytest.raises(TimeoutError):
+            agents.MockLLM(latency=agents.LatencyModel("fixed", 5.0), timeout=1.0).generate(request)
+        assert clock.monotonic() == 1.25
+    failing = agents.MockLLM(error_rate=0.25, seed=1)
+    outcomes = []
+    for _ in range(2000):
+        try:
+            outcomes.append(failing.generate(request))
+        except agents.LLMBackendError as e:
+            outcomes.append(e)
+    assert sum(isinstance(o, Exception) for o in outcomes) == pytest.approx(500, rel=0.15)
+    
+    output = str(tmp_path / "load.json")
+    assert loadgen.main(["--requests", "40", "--concurrency", "4", "--companies", "10",
+                         "--latency", "fixed:0.002", "--error-rate", "0.5", "--seed", "7",
+                         "--output", output]) == 0
+    capsys.readouterr()
+    with open(output) as f:
+        report = json.load(f)
+    assert report["requests"] == 40 and report["scenario"]["latency"]["kind"] == "fixed"
+    assert 0 < report["failed_workflows"] < 40 and report["error_rate"] > 0
+    assert report["latency_ms"]["p50"] >= 2.0
+
+
+def test_virtual_time_simulation_runs_hours_of_latency_instantly():
+    start = agents.datetime(2024, 6, 1, 9, 0, 0)
+    llm = agents.MockLLM(latency=agents.LatencyModel("fixed", 1.5))
+    cache = agents.WorkflowResultCache(ttl_seconds=600)
+    orchestrator = agents.AsyncAgentOrchestrator(llm=llm, result_cache=cache)
+    companies = [f"Company {i}" for i in range(200)]
+    
+    async def main():
+        clock = agents.get_clock()
+        await orchestrator.research_many_async(companies, max_concurrency=20)
+        ran = clock.monotonic()
+        cached = await orchestrator.research_investment_async("Company 0")
+        await asyncio.sleep(601)
+        expired = await orchestrator.research_investment_async("Company 0")
+        return ran, cached, expired, clock.monotonic()
+    
+    wall_start = time.monotonic()
+    ran, cached, expired, finished = agents.run_simulated(main(), start=start)
+    assert time.monotonic() - wall_start < 10
+    assert isinstance(agents.get_clock(), agents.SystemClock)
+    
+    # 10 waves of 20 workflows, each two 1.5s LLM calls, with CPU time free
+    assert ran == pytest.approx(30.0)
+    assert finished == pytest.approx(30.0 + 601 + 3.0)
+    actions = orchestrator.audit_trail.actions
+    assert actions[0].timestamp >= start.isoformat()
+    assert max(a.timestamp for a in actions) == (start + agents.timedelta(seconds=finished)).isoformat()
+    llm_durations = {a.duration_ms for a in actions if a.action_type in ("company_research", "investment_analysis")}
+    assert llm_durations == {1500.0}
+    assert orchestrator.audit_trail.get_summary()["step_latency_ms"]["workflow"]["max"] == pytest.approx(3000, rel=0.01)
+    # The cache entry was fresh 30s in and expired 601 virtual seconds later
+    assert [a.action_type for a in actions].count("cache_hit") == 1
+    assert cached["success"] and expired["success"]
+    assert cache.get_stats()["expirations"] == 1
+
+
+def test_metrics_render_in_the_prometheus_text_format_and_are_served():
+    registry = agents.MetricsRegistry()
+    requests_total = registry.counter("test_requests_total", "Requests\nby path", ("path",))
+    depth = registry.gauge("test_queue_depth", "Queue depth")
+    latency = registry.histogram("test_latency_seconds", "Latency", ("stage",), buckets=(0.1, 1))
+    requests_total.inc('/a"b\\c')
+    requests_total.inc("/", amount=2.5)
+    depth.set_function(lambda: 7)
+    for value in (0.05, 0.1, 0.5, 3):
+        latency.observe(value, "research")
+    assert registry.counter("test_requests_total", "Requests\nby path", ("path",)) is requests_total
+    with pytest.raises(ValueError):
+        registry.gauge("test_requests_total", "Requests")
+    with pytest.raises(ValueError):
+        requests_total.inc("/", "extra")
+    
+    expected = "\n".join([
+        "# HELP test_requests_total Requests\\nby path",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{path="/"} 2.5',
+        'test_requests_total{path="/a\\"b\\\\c"} 1',
+        "# HELP test_queue_depth Queue depth",
+        "# TYPE test_queue_depth gauge",
+        "test_queue_depth 7",
+        "# HELP test_latency_seconds Latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{stage="research",le="0.1"} 2',
+        'test_latency_seconds_bucket{stage="research",le="1"} 3',
+        'test_latency_seconds_bucket{stage="research",le="+Inf"} 4',
+        'test_latency_seconds_sum{stage="research"} 3.65',
+        'test_latency_seconds_count{stage="research"} 4',
+    ]) + "\n"
+    assert registry.render() == expected
+    
+    server = agents.start_metrics_server(port=0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            assert response.headers["Content-Type"] == agents.MetricsRegistry.CONTENT_TYPE
+            assert response.read().decode("utf-8") == expected
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_reopened_rotating_sink_never_writes_its_manifest_concurrently(tmp_path, monkeypatch):
+    sink = agents.RotatingJSONLAuditSink(str(tmp_path), codec="gzip")
+    for i in range(3):
+        sink.write(make_action(i))
+    sink.flush()  # left open, as after a crash
+    
+    write_manifest = agents.RotatingJSONLAuditSink._write_manifest
+    writing = []
+    overlaps = []
+    
+    def slow_write_manifest(self):
+        writing.append(threading.get_ident())
+        if len(writing) > 1:
+            overlaps.append(list(writing))
+        time.sleep(0.02)
+        try:
+            write_manifest(self)
+        finally:
+            writing.remove(threading.get_ident())
+    
+    monkeypatch.setattr(agents.RotatingJSONLAuditSink, "_write_manifest", slow_write_manifest)
+    # Recovery closes the crashed segment and hands it to the compressor before opening a new one
+    reopened = agents.RotatingJSONLAuditSink(str(tmp_path), codec="gzip")
+    reopened.close()
+    assert overlaps == []
+    assert [s["codec"] for s in reopened.segments()] == ["gzip"]
+    assert len(list(agents.read_audit_segments(str(tmp_path)))) == 3
+
+
+class FailingOrchestrator(agents.AsyncAgentOrchestrator):
+    """Workflow that raises once followers have joined it"""
+    
+    def __init__(self, joined: threading.Event):
+        super().__init__()
+        self.joined = joined
+    
+    def research_investment(self, company_name):
+        self.joined.wait(5)
+        raise RuntimeError("backend down")
+    
+    async def research_investment_async(self, company_name):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("backend down")
+
+
+def assert_failed_follower_entries(trail: AuditTrail, count: int):
+    entries = [a for a in trail.actions if a.action_type == "coalesced_hit"]
+    assert len(entries) == count
+    assert all(not a.success and a.error_message == "Shared workflow raised: backend down" for a in entries)
+    assert all(a.output_data == {"shared_workflow_success": False} and a.cost_usd == 0 for a in entries)
+    assert trail.get_summary()["failed_actions"] == count
+
+
+def test_coalescer_logs_an_entry_for_every_follower_of_a_failed_workflow():
+    joined = threading.Event()
+    orchestrator = FailingOrchestrator(joined)
+    coalescer = agents.RequestCoalescer(orchestrator)
+    outcomes = []
+    
+    def call(n: int):
+        try:
+            outcomes.append(coalescer.research_investment("Apple"))
+        except RuntimeError as e:
+            outcomes.append(e)
+    
+    leader = threading.Thread(target=call, args=(0,))
+    leader.start()
+    while not coalescer._in_flight:
+        pass
+    followers = [threading.Thread(target=call, args=(n,)) for n in range(1, 4)]
+    for t in followers:
+        t.start()
+    while coalescer.get_stats()["coalesced_hits"] < 3:
+        pass
+    joined.set()
+    for t in [leader, *followers]:
+        t.join(5)
+    assert len(outcomes) == 4 and all(isinstance(o, RuntimeError) for o in outcomes)
+    assert coalescer.get_stats()["workflows_started"] == 1
+    assert_failed_follower_entries(orchestrator.audit_trail, 3)
+    
+    async def main():
+        async_orchestrator = FailingOrchestrator(joined)
+        async_coalescer = agents.RequestCoalescer(async_orchestrator)
+        calls = [async_coalescer.research_investment_async(name) for name in ("Apple", "apple", "APPLE ")]
+        outcomes = await asyncio.gather(*calls, return_exceptions=True)
+        assert all(isinstance(o, RuntimeError) for o in outcomes)
+        assert async_coalescer.get_stats()["workflows_started"] == 1
+        assert_failed_follower_entries(async_orchestrator.audit_trail, 2)
+    
+    asyncio.run(main())